@@ -43,7 +43,7 @@ else:
     check_reserved = None
 
 (db_string, pool_size) = settings.get_database_string()
-if db_string.find("sqlite") != -1:
+if db_string.find("sqlite") != -1 or db_string.find("spatialite") != -1:
     db = DAL(db_string,
              check_reserved=check_reserved,
              migrate_enabled = migrate,
@@ -25,6 +25,49 @@ def download_kml(record_id, filename, user_id=None):
 
 tasks["download_kml"] = download_kml
 
+# -----------------------------------------------------------------------------
+def gis_update_location_tree(location_ids=None, user_id=None):
+    """
+        Rebuild the materialized paths of the Location hierarchy
+            - e.g. after a bulk import
+
+        @param location_ids: list of ids of the Locations whose subtrees
+                             to rebuild, or None to rebuild the whole tree
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+    # Run the Task
+    if location_ids is None:
+        result = gis.update_location_tree()
+    else:
+        result = gis.rebuild_location_tree(location_ids)
+    db.commit()
+    return result
+
+tasks["gis_update_location_tree"] = gis_update_location_tree
+
+# -----------------------------------------------------------------------------
+def pr_update_hierarchy(pe_ids=None, user_id=None):
+    """
+        Rebuild the OU hierarchy closure table
+            - e.g. after a bulk import or an upgrade
+
+        @param pe_ids: list of pe_ids of the entities whose ancestors
+                       to rebuild, or None to rebuild the whole table
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+    # Run the Task
+    result = s3db.pr_update_hierarchy(pe_ids)
+    db.commit()
+    return result
+
+tasks["pr_update_hierarchy"] = pr_update_hierarchy
+
 # -----------------------------------------------------------------------------
 if settings.has_module("msg"):
 
@@ -190,6 +190,12 @@ if len(pop_list) > 0:
     db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
     field = "last_name"
     db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
+    # OU hierarchy closure table
+    tablename = "pr_hierarchy"
+    field = "ancestor"
+    db.executesql("CREATE INDEX %s_%s__idx on %s(%s);" % (tablename, field, tablename, field))
+    field = "descendant"
+    db.executesql("CREATE INDEX %s_%s__idx on %s(%s);" % (tablename, field, tablename, field))
 
     # GIS
     # L0 Countries
@@ -205,6 +211,19 @@ if len(pop_list) > 0:
     tablename = "gis_location"
     field = "name"
     db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
+    if settings.get_gis_spatialdb():
+        # Add spatial index for the spatial queries
+        field = "the_geom"
+        if settings.get_database_type() == "postgres":
+            # PostGIS
+            db.executesql("CREATE INDEX %s__idx on %s USING GIST(%s);" % (field, tablename, field))
+        else:
+            # SpatiaLite
+            db.executesql("SELECT CreateSpatialIndex('%s', '%s');" % (tablename, field))
+    elif settings.get_gis_spatial_index():
+        # Used to keep the in-process Location Index in sync
+        field = "modified_on"
+        db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
 
     # Messaging Module
     if settings.has_module("msg"):
@@ -405,6 +424,9 @@ if len(pop_list) > 0:
         except AttributeError:
             # older Python
             print >> sys.stdout, "Pre-populate completed in %s" % duration
+        # Task timings
+        for result in bi.resultList:
+            print >> sys.stdout, result
         bi.resultList = []
 
     grandTotalEnd = datetime.datetime.now()
@@ -30,6 +30,7 @@
 __all__ = ["S3LocationModel",
            "S3LocationNameModel",
            "S3LocationTagModel",
+           "S3LocationSimplifiedModel",
            "S3LocationGroupModel",
            "S3LocationHierarchyModel",
            "S3GISConfigModel",
@@ -353,7 +354,21 @@ class S3LocationModel(S3Model):
 
         # Update the Path
         vars = form.vars
-        current.gis.update_location_tree(vars.id, vars.parent)
+        gis = current.gis
+        gis.update_location_tree(vars.id, vars.parent)
+        # Update the Location Index
+        gis.location_index.update(vars.id)
+        # Update the pre-simplified Geometries (only polygons and lines
+        # have any, so tell whether the location was one before)
+        record = getattr(form, "record", None)
+        if record:
+            previous = record.get("wkt", None)
+        elif getattr(form, "method", None) == "update":
+            previous = None
+        else:
+            previous = ""
+        gis.update_simplified(vars.id, wkt=vars.get("wkt", None),
+                              previous=previous)
         return
 
     # -------------------------------------------------------------------------
@@ -702,6 +717,36 @@ class S3LocationTagModel(S3Model):
         return Storage(
                 )
 
+# =============================================================================
+class S3LocationSimplifiedModel(S3Model):
+    """
+        Simplified Location Geometries model
+        - pre-simplified geometries of Locations for several tolerances,
+          to serve polygon map layers without a spatial database
+    """
+
+    names = ["gis_location_simplified"]
+
+    def model(self):
+
+        # ---------------------------------------------------------------------
+        # Simplified Geometries
+        # - maintained by gis.update_simplified(), not edited directly
+        #
+        tablename = "gis_location_simplified"
+        table = self.define_table(tablename,
+                                  self.gis_location_id(ondelete="CASCADE"),
+                                  # Tolerance in degrees
+                                  Field("tolerance", "double"),
+                                  Field("wkt", "text"),
+                                  Field("geojson", "text"))
+
+        # ---------------------------------------------------------------------
+        # Pass variables back to global scope (response.s3.*)
+        #
+        return Storage(
+                )
+
 # =============================================================================
 class S3LocationGroupModel(S3Model):
     """
@@ -1039,6 +1084,7 @@ class S3GISConfigModel(S3Model):
 
         configure(tablename,
                   onvalidation=self.gis_marker_onvalidation,
+                  onaccept=self.gis_config_clear_cache,
                   deduplicate=self.gis_marker_deduplicate)
 
         # =====================================================================
@@ -1102,6 +1148,7 @@ class S3GISConfigModel(S3Model):
                                         ondelete = "RESTRICT")
 
         configure(tablename,
+                  onaccept=self.gis_config_clear_cache,
                   deduplicate=self.gis_projection_deduplicate,
                   deletable=False)
 
@@ -1167,6 +1214,7 @@ class S3GISConfigModel(S3Model):
                                     autodelete=False))
 
         configure(tablename,
+                  onaccept=self.gis_config_clear_cache,
                   deduplicate=self.gis_symbology_deduplicate)
 
         # =====================================================================
@@ -1625,6 +1673,8 @@ class S3GISConfigModel(S3Model):
             If this is an OU config, then add to GIS menu
         """
 
+        current.gis.clear_config_cache()
+
         try:
             update = False
             id = form.vars.id
@@ -1646,6 +1696,16 @@ class S3GISConfigModel(S3Model):
             # AJAX Save of Viewport from Map
             pass
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def gis_config_clear_cache(form):
+        """
+            Clear the cached map configurations (onaccept of markers,
+            projections and symbologies which are used in configs)
+        """
+
+        current.gis.clear_config_cache()
+
     # -------------------------------------------------------------------------
     @staticmethod
     def gis_config_ondelete(form):
@@ -1656,6 +1716,8 @@ class S3GISConfigModel(S3Model):
         gis = current.gis
         s3 = current.response.s3
 
+        gis.clear_config_cache()
+
         record_id = form.record_id
         if s3.gis.config:
             gis_config_id = s3.gis.config.id
@@ -2028,6 +2090,9 @@ class S3LayerEntityModel(S3Model):
                     msg_record_deleted = T("Symbology removed from Layer"),
                     msg_list_empty = T("No Symbologies currently defined for this Layer"))
 
+        self.configure(tablename,
+                       onaccept=S3GISConfigModel.gis_config_clear_cache)
+
         # ---------------------------------------------------------------------
         return Storage(
                 gis_layer_types = layer_types,
@@ -2052,6 +2117,8 @@ class S3LayerEntityModel(S3Model):
             others in this config.
         """
 
+        current.gis.clear_config_cache()
+
         vars = form.vars
         base = vars.base
         if base == "False":
@@ -3424,6 +3491,8 @@ def gis_layer_onaccept(form):
         Process the enable checkbox
     """
 
+    current.gis.clear_config_cache()
+
     enable = current.request.post_vars.enable
 
     if enable:
@@ -347,6 +347,8 @@ class S3HRModel(S3Model):
                     onaccept = self.hrm_human_resource_onaccept,
                     ondelete = self.hrm_human_resource_ondelete,
                     deduplicate=self.hrm_human_resource_deduplicate,
+                    # Same match for bulk imports (without a query per item)
+                    deduplicate_keys=("person_id", "organisation_id"),
                     report_options = Storage(
                         search=[
                               S3SearchOptionsWidget(
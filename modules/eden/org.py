@@ -392,7 +392,9 @@ class S3OrganisationModel(S3Model):
                                           requires = IS_NULL_OR(IS_ONE_OF(db, "org_organisation.id",
                                                                           org_organisation_represent,
                                                                           orderby="org_organisation.name",
-                                                                          sort=True)),
+                                                                          sort=True,
+                                                                          lazy=True,
+                                                                          cache_tables=["org_organisation_branch"])),
                                           represent = org_organisation_represent,
                                           label = T("Organization"),
                                           comment = organisation_comment,
@@ -988,6 +990,8 @@ class S3SiteModel(S3Model):
                                   represent = org_site_represent,
                                   orderby = "org_site.name",
                                   sort = True,
+                                  lazy = True,
+                                  cache_tables = ["org_office"],
                                   # Comment these to use a Dropdown & not an Autocomplete
                                   widget = S3SiteAutocompleteWidget(),
                                   comment = DIV(_class="tooltip",
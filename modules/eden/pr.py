@@ -57,6 +57,8 @@ __all__ = ["S3PersonEntity",
            "pr_remove_affiliation",
            # PE Helpers
            "pr_get_pe_id",
+           "pr_hierarchy_version",
+           "pr_clear_hierarchy_version",
            # Back-end Role Tools
            "pr_define_role",
            "pr_delete_role",
@@ -72,9 +74,11 @@ __all__ = ["S3PersonEntity",
            "pr_get_descendants",
            "pr_ancestors",
            "pr_descendants",
+           "pr_hierarchy_query",
            # Internal Path Tools
            "pr_rebuild_path",
            "pr_role_rebuild_path",
+           "pr_update_hierarchy",
            # Helpers for ImageLibrary
            "pr_image_modify",
            "pr_image_resize",
@@ -89,6 +93,7 @@ import gluon.contrib.simplejson as json
 from gluon import *
 from gluon.dal import Row
 from gluon.storage import Storage
+from gluon.utils import web2py_uuid
 from gluon.sqlhtml import RadioWidget
 from ..s3 import *
 from layouts import *
@@ -97,12 +102,17 @@ from eden.layouts import S3AddResourceLink
 OU = 1 # role type which indicates hierarchy, see role_types
 OTHER_ROLE = 9
 
+# Interval (seconds) to re-read the hierarchy table stamps without memcache
+HIERARCHY_CHECK_INTERVAL = 60
+HIERARCHY_TABLES = ("pr_affiliation", "pr_role", "pr_delegation")
+
 # =============================================================================
 class S3PersonEntity(S3Model):
     """ Person Super-Entity """
 
     names = ["pr_pentity",
              "pr_affiliation",
+             "pr_hierarchy",
              "pr_role",
              "pr_role_types",
              "pr_role_id",
@@ -272,7 +282,8 @@ class S3PersonEntity(S3Model):
 
         # Resource configuration
         configure(tablename,
-                  onvalidation=self.pr_role_onvalidation)
+                  onvalidation=self.pr_role_onvalidation,
+                  onaccept=self.pr_role_onaccept)
 
         # Reusable fields
         role_id = S3ReusableField("role_id", db.pr_role,
@@ -321,6 +332,20 @@ class S3PersonEntity(S3Model):
                   onaccept=self.pr_affiliation_onaccept,
                   ondelete=self.pr_affiliation_ondelete)
 
+        # ---------------------------------------------------------------------
+        # OU Hierarchy
+        # Closure table with all ancestor/descendant pairs in the OU
+        # hierarchy and their shortest distance, maintained by
+        # pr_update_hierarchy whenever affiliations change
+        #
+        tablename = "pr_hierarchy"
+        table = define_table(tablename,
+                             Field("ancestor", "integer"),
+                             Field("descendant", "integer"),
+                             Field("depth", "integer"),
+                             # Instance type of the descendant
+                             Field("instance_type"))
+
         # ---------------------------------------------------------------------
         # Return model-global names to response.s3
         #
@@ -383,6 +408,32 @@ class S3PersonEntity(S3Model):
                 s3db.pr_role_rebuild_path(role_id, clear=True)
         return
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def pr_role_onaccept(form):
+        """
+            Update the OU hierarchy for all affiliates of the role (in
+            case the role type has changed)
+
+            @param form: the CRUD form
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        role_id = form.vars.id
+        if not role_id:
+            return
+        atable = s3db.pr_affiliation
+        query = (atable.deleted != True) & \
+                (atable.role_id == role_id)
+        rows = db(query).select(atable.pe_id)
+        if rows:
+            s3db.pr_update_hierarchy([row.pe_id for row in rows])
+        else:
+            s3db.pr_clear_hierarchy_version()
+        return
+
     # -------------------------------------------------------------------------
     @staticmethod
     def pr_pentity_onaccept(form):
@@ -3917,6 +3968,13 @@ def pr_define_role(pe_id,
             s3db.pr_role_rebuild_path(duplicate.id, clear=True)
         duplicate.update_record(**data)
         record_id = duplicate.id
+        if duplicate.role_type != role_type:
+            atable = s3db.pr_affiliation
+            query = (atable.deleted != True) & \
+                    (atable.role_id == record_id)
+            rows = db(query).select(atable.pe_id)
+            if rows:
+                pr_update_hierarchy([row.pe_id for row in rows])
     else:
         record_id = rtable.insert(**data)
     return record_id
@@ -4158,30 +4216,15 @@ def pr_get_ancestors(pe_id):
     db = current.db
     s3db = current.s3db
 
-    atable = s3db.pr_affiliation
-    rtable = s3db.pr_role
-
-    query = (atable.deleted != True) & \
-            (atable.role_id == rtable.id) & \
-            (atable.pe_id == pe_id) & \
-            (rtable.deleted != True) & \
-            (rtable.role_type == OU)
-
-    roles = db(query).select(rtable.ALL)
-
-    paths = []
-    append = paths.append
-    for role in roles:
-        path = S3MultiPath([role.pe_id])
-        if role.path is None:
-            ppath = pr_role_rebuild_path(role)
-        else:
-            ppath = S3MultiPath(role.path)
-        path.extend(role.pe_id, ppath, cut=pe_id)
-        append(path)
-    ancestors = S3MultiPath.all_nodes(paths)
+    if not pe_id:
+        return []
 
-    return ancestors
+    pr_check_hierarchy()
+    htable = s3db.pr_hierarchy
+    query = (htable.descendant == pe_id)
+    rows = db(query).select(htable.ancestor,
+                            orderby=htable.depth)
+    return [row.ancestor for row in rows]
 
 # =============================================================================
 def pr_realm(entity):
@@ -4194,18 +4237,15 @@ def pr_realm(entity):
     db = current.db
     s3db = current.s3db
 
-    atable = s3db.pr_affiliation
-    rtable = s3db.pr_role
-
     if not entity:
         return []
-    query = (atable.deleted != True) & \
-            (atable.role_id == rtable.id) & \
-            (atable.pe_id == entity) & \
-            (rtable.deleted != True) & \
-            (rtable.role_type == OU)
-    rows = db(query).select(rtable.pe_id)
-    realm = [row.pe_id for row in rows]
+
+    pr_check_hierarchy()
+    htable = s3db.pr_hierarchy
+    query = (htable.descendant == entity) & \
+            (htable.depth == 1)
+    rows = db(query).select(htable.ancestor)
+    realm = [row.ancestor for row in rows]
     return realm
 
 # =============================================================================
@@ -4231,6 +4271,19 @@ def pr_realm_users(realm, roles=None, role_types=OU):
 
     if realm is None:
         query = (utable.deleted != True)
+    elif roles is None and role_types in (OU, [OU], (OU,)):
+        # Direct OU affiliates => closure table
+        if not isinstance(realm, (list, tuple)):
+            realm = [realm]
+        pr_check_hierarchy()
+        htable = s3db.pr_hierarchy
+        query = (htable.ancestor.belongs(realm)) & \
+                (htable.depth == 1) & \
+                (htable.instance_type == "pr_person") & \
+                (htable.descendant == ltable.pe_id) & \
+                (ltable.deleted != True) & \
+                (ltable.user_id == utable.id) & \
+                (utable.deleted != True)
     else:
         if not isinstance(realm, (list, tuple)):
             realm = [realm]
@@ -4250,7 +4303,7 @@ def pr_realm_users(realm, roles=None, role_types=OU):
                 (ltable.deleted != True) & \
                 (ltable.user_id == utable.id) & \
                 (utable.deleted != True)
-    rows = db(query).select(utable.id, utable.email)
+    rows = db(query).select(utable.id, utable.email, distinct=True)
     if rows:
         if auth.settings.username_field:
             return Storage([(row.id, row.username) for row in rows])
@@ -4265,48 +4318,40 @@ def pr_ancestors(entities):
         Find all ancestor entities of the given entities in the
         OU hierarchy.
 
-        @param entities:
+        @param entities: list of PE-IDs
 
-        @returns: Storage of lists of PE-IDs
+        @returns: Storage of lists of PE-IDs, ordered by distance
     """
 
     db = current.db
     s3db = current.s3db
 
-    atable = s3db.pr_affiliation
-    rtable = s3db.pr_role
-
     if not entities:
         return Storage()
 
-    query = (atable.deleted != True) & \
-            (atable.role_id == rtable.id) & \
-            (atable.pe_id.belongs(entities)) & \
-            (rtable.deleted != True) & \
-            (rtable.role_type == OU)
-    rows = db(query).select(rtable.ALL, atable.pe_id)
+    pr_check_hierarchy()
+    htable = s3db.pr_hierarchy
+    query = (htable.descendant.belongs(entities))
+    rows = db(query).select(htable.ancestor,
+                            htable.descendant,
+                            orderby=htable.depth)
 
     ancestors = Storage([(pe_id, []) for pe_id in entities])
-    r = rtable._tablename
-    a = atable._tablename
     for row in rows:
-        pe_id = row[a].pe_id
-        paths = ancestors[pe_id]
-        role = row[r]
-        path = S3MultiPath([role.pe_id])
-        if role.path is None:
-            ppath = pr_role_rebuild_path(role)
-        else:
-            ppath = S3MultiPath(role.path)
-        path.extend(role.pe_id, ppath, cut=pe_id)
-        paths.append(path)
-    for pe_id in ancestors:
-        ancestors[pe_id] = S3MultiPath.all_nodes(ancestors[pe_id])
+        ancestors[row.descendant].append(row.ancestor)
     return ancestors
 
 # =============================================================================
 def pr_descendants(pe_ids, skip=[]):
     """
+        Find all descendant entities (except persons) of the given
+        entities in the OU hierarchy
+
+        @param pe_ids: list of person entity IDs
+        @param skip: list of person entity IDs to skip
+
+        @returns: Storage {pe_id: [descendant PE-IDs]}, containing only
+                  those entities which have descendants
     """
 
     db = current.db
@@ -4314,63 +4359,39 @@ def pr_descendants(pe_ids, skip=[]):
 
     pe_ids = [i for i in pe_ids if i not in skip]
     if not pe_ids:
-        return []
-
-    etable = s3db.pr_pentity
-    rtable = s3db.pr_role
-    atable = s3db.pr_affiliation
-
-    query = (rtable.deleted != True) & \
-            (rtable.pe_id.belongs(pe_ids)) & \
-            (rtable.role_type == OU) & \
-            (atable.role_id == rtable.id) & \
-            (atable.deleted != True) & \
-            (etable.pe_id == atable.pe_id)
+        return Storage()
 
-    rows = db(query).select(rtable.pe_id,
-                            atable.pe_id,
-                            etable.instance_type)
-    r = rtable._tablename
-    e = etable._tablename
-    a = atable._tablename
+    pr_check_hierarchy()
+    htable = s3db.pr_hierarchy
+    query = (htable.ancestor.belongs(pe_ids)) & \
+            (htable.instance_type != "pr_person")
+    if skip:
+        query &= (~(htable.descendant.belongs(skip)))
+    rows = db(query).select(htable.ancestor,
+                            htable.descendant,
+                            orderby=htable.depth)
 
-    nodes = []
     result = Storage()
     for row in rows:
-        parent = row[r].pe_id
-        child = row[a].pe_id
-        if row[e].instance_type != "pr_person":
-            if parent not in result:
-                result[parent] = [child]
-            else:
-                result[parent].append(child)
-        if child not in nodes:
-            nodes.append(child)
-
-    skip = skip + pe_ids
-    descendants = pr_descendants(nodes, skip=skip)
-
-    for child in descendants:
-        for parent in result:
-            if child in result[parent]:
-                for node in descendants[child]:
-                    if node not in result[parent]:
-                        result[parent].append(node)
-    for x in result:
-        for y in result:
-            if x in result[y]:
-                result[y].extend([i for i in result[x] if i not in result[y] and i != y])
-
+        ancestor = row.ancestor
+        if ancestor not in result:
+            result[ancestor] = [row.descendant]
+        else:
+            result[ancestor].append(row.descendant)
     return result
 
 # =============================================================================
 def pr_get_descendants(pe_ids, skip=[], entity_type=None, ids=True):
     """
         Find descendant entities of a person entity in the OU hierarchy
-        (performs a real search, not a path lookup).
 
         @param pe_ids: person entity ID or list of IDs
         @param skip: list of person entity IDs to skip during descending
+                     (i.e. their descendants are only included if they
+                     can be reached through other entities)
+        @param entity_type: limit the result to this entity type
+        @param ids: return only the PE-IDs (otherwise tuples of
+                    (pe_id, instance_type))
 
         @returns: a list of PE-IDs
     """
@@ -4378,47 +4399,81 @@ def pr_get_descendants(pe_ids, skip=[], entity_type=None, ids=True):
     db = current.db
     s3db = current.s3db
 
-    etable = s3db.pr_pentity
-    rtable = s3db.pr_role
-    atable = s3db.pr_affiliation
-
-    en = etable._tablename
-    an = atable._tablename
-
     if type(pe_ids) is not list:
         pe_ids = [pe_ids]
     pe_ids = [i for i in pe_ids if i not in skip]
     if not pe_ids:
         return []
-    query = (rtable.deleted != True) & \
-            (rtable.pe_id.belongs(pe_ids)) & \
-            (~(rtable.pe_id.belongs(skip))) &\
-            (rtable.role_type == OU) & \
-            (atable.deleted != True) & \
-            (atable.role_id == rtable.id) & \
-            (etable.pe_id == atable.pe_id)
-    skip = skip + pe_ids
-    rows = db(query).select(atable.pe_id,
-                            etable.instance_type)
-    nodes = [(r[an].pe_id, r[en].instance_type) for r in rows]
+
+    pr_check_hierarchy()
+    htable = s3db.pr_hierarchy
+    query = (htable.ancestor.belongs(pe_ids))
+    if ids and entity_type is not None and not skip:
+        query &= (htable.instance_type == entity_type)
+    rows = db(query).select(htable.descendant,
+                            htable.instance_type,
+                            orderby=htable.depth)
+
     result = []
     append = result.append
-    for n in nodes:
-        if n not in result:
-            append(n)
-    node_ids = [n[0] for n in result]
-    descendants = pr_get_descendants(node_ids, skip=skip, ids=False)
-    for d in descendants:
-        if d not in result:
-            append(d)
+    seen = set()
+    for row in rows:
+        pe_id = row.descendant
+        if pe_id not in seen:
+            seen.add(pe_id)
+            append((pe_id, row.instance_type))
+
+    if skip and result:
+        # Walk down the direct affiliations, not descending into
+        # the skipped entities
+        query = (htable.descendant.belongs(seen)) & \
+                (htable.depth == 1)
+        rows = db(query).select(htable.ancestor,
+                                htable.descendant)
+        children = {}
+        for row in rows:
+            children.setdefault(row.ancestor, []).append(row.descendant)
+        reached = set()
+        nodes = pe_ids
+        while nodes:
+            level = []
+            for node in nodes:
+                for child in children.get(node, []):
+                    if child not in reached:
+                        reached.add(child)
+                        if child not in skip:
+                            level.append(child)
+            nodes = level
+        result = [n for n in result if n[0] in reached]
+        if ids and entity_type is not None:
+            result = [n for n in result if n[1] == entity_type]
 
     if ids:
-        return [n[0]
-                for n in result
-                if entity_type is None or n[1] == entity_type]
+        return [n[0] for n in result]
     else:
         return result
 
+# =============================================================================
+def pr_hierarchy_query(field, pe_ids):
+    """
+        Construct a query for records where field refers to any of the
+        given entities or their descendants (except persons) in the OU
+        hierarchy, using a sub-select on the closure table
+
+        @param field: the Field (a pe_id reference)
+        @param pe_ids: list of PE-IDs
+    """
+
+    db = current.db
+    s3db = current.s3db
+
+    pr_check_hierarchy()
+    htable = s3db.pr_hierarchy
+    query = (htable.ancestor.belongs(pe_ids)) & \
+            (htable.instance_type != "pr_person")
+    subselect = db(query)._select(htable.descendant)
+    return (field.belongs(pe_ids)) | (field.belongs(subselect))
+
 # =============================================================================
 # Internal Path Tools
 # =============================================================================
@@ -4436,7 +4491,7 @@ def pr_rebuild_path(pe_id, clear=False):
     s3db = current.s3db
 
     if isinstance(pe_id, Row):
-        pe_id = row.pe_id
+        pe_id = pe_id.pe_id
 
     rtable = s3db.pr_role
     query = (rtable.deleted != True) & \
@@ -4447,6 +4502,10 @@ def pr_rebuild_path(pe_id, clear=False):
     for role in roles:
         if role.path is None:
             pr_role_rebuild_path(role, clear=clear)
+
+    if clear:
+        # Affiliations have changed
+        pr_update_hierarchy(pe_id)
     return
 
 # =============================================================================
@@ -4512,6 +4571,217 @@ def pr_role_rebuild_path(role_id, skip=[], clear=False):
 
     return path
 
+# =============================================================================
+def pr_check_hierarchy():
+    """
+        Rebuild the OU hierarchy closure table (pr_hierarchy) if it is
+        empty while there are OU affiliations (e.g. after upgrading an
+        existing database), checked once per process before the first
+        lookup
+    """
+
+    def check():
+        db = current.db
+        s3db = current.s3db
+        htable = s3db.pr_hierarchy
+        row = db(htable.id > 0).select(htable.id, limitby=(0, 1)).first()
+        if row:
+            return True
+        rtable = s3db.pr_role
+        atable = s3db.pr_affiliation
+        query = (rtable.deleted != True) & \
+                (rtable.role_type == OU) & \
+                (atable.role_id == rtable.id) & \
+                (atable.deleted != True)
+        row = db(query).select(atable.id, limitby=(0, 1)).first()
+        if row:
+            pr_update_hierarchy()
+        return True
+
+    current.cache.ram("pr_hierarchy_checked", check, time_expire=None)
+    return
+
+# =============================================================================
+def pr_update_hierarchy(pe_ids=None):
+    """
+        Update the OU hierarchy closure table (pr_hierarchy) for the
+        given entities and all their descendants, or rebuild it entirely
+
+        @param pe_ids: person entity ID or list of IDs (None to rebuild
+                       the whole closure table)
+    """
+
+    db = current.db
+    s3db = current.s3db
+
+    htable = s3db.pr_hierarchy
+    etable = s3db.pr_pentity
+    rtable = s3db.pr_role
+    atable = s3db.pr_affiliation
+
+    if pe_ids is None:
+        nodes = None
+        db(htable.id > 0).delete()
+    else:
+        if not isinstance(pe_ids, (list, tuple, set)):
+            pe_ids = [pe_ids]
+        pe_ids = [int(pe_id) for pe_id in pe_ids if pe_id]
+        if not pe_ids:
+            return
+        # The descendants of these entities are affected as well, but
+        # their sets of descendants do not change
+        query = (htable.ancestor.belongs(pe_ids))
+        rows = db(query).select(htable.descendant, distinct=True)
+        nodes = set(pe_ids)
+        nodes.update([row.descendant for row in rows])
+
+    # Get the OU parents of all affected entities
+    query = (rtable.deleted != True) & \
+            (rtable.role_type == OU) & \
+            (atable.role_id == rtable.id) & \
+            (atable.deleted != True) & \
+            (etable.pe_id == atable.pe_id)
+    if nodes is not None:
+        query &= (atable.pe_id.belongs(nodes))
+    rows = db(query).select(rtable.pe_id,
+                            atable.pe_id,
+                            etable.instance_type)
+    rtn = rtable._tablename
+    atn = atable._tablename
+    etn = etable._tablename
+
+    parents = {}
+    types = {}
+    for row in rows:
+        child = row[atn].pe_id
+        types[child] = row[etn].instance_type
+        if child in parents:
+            parents[child].add(row[rtn].pe_id)
+        else:
+            parents[child] = set([row[rtn].pe_id])
+
+    ancestors = {}
+    if nodes is None:
+        nodes = set(parents.keys())
+    else:
+        db(htable.descendant.belongs(nodes)).delete()
+
+        # The ancestors of unaffected parents can be taken from the
+        # closure table
+        external = set()
+        for node in nodes:
+            if node in parents:
+                external.update([p for p in parents[node] if p not in nodes])
+        if external:
+            for pe_id in external:
+                ancestors[pe_id] = {}
+            query = (htable.descendant.belongs(external))
+            rows = db(query).select(htable.ancestor,
+                                    htable.descendant,
+                                    htable.depth)
+            for row in rows:
+                ancestors[row.descendant][row.ancestor] = row.depth
+
+    def resolve(node):
+        """ Get {ancestor: depth} for node (cycle-safe) """
+        if node in ancestors:
+            return ancestors[node]
+        result = ancestors[node] = {}
+        for parent in parents.get(node, ()):
+            if parent == node:
+                continue
+            result[parent] = 1
+            for ancestor, depth in resolve(parent).items():
+                if ancestor == node:
+                    continue
+                depth += 1
+                if ancestor not in result or result[ancestor] > depth:
+                    result[ancestor] = depth
+        return result
+
+    # Write the closure rows in batches
+    items = []
+    append = items.append
+    bulk_insert = htable.bulk_insert
+    for node in nodes:
+        instance_type = types.get(node)
+        for ancestor, depth in resolve(node).items():
+            append({"ancestor": ancestor,
+                    "descendant": node,
+                    "depth": depth,
+                    "instance_type": instance_type})
+        if len(items) >= 500:
+            bulk_insert(items)
+            items = []
+            append = items.append
+    if items:
+        bulk_insert(items)
+
+    pr_clear_hierarchy_version()
+    return
+
+# =============================================================================
+def pr_hierarchy_version():
+    """
+        Get a version token for the OU hierarchy, affiliations and
+        delegations (e.g. to validate cached realms), checked once
+        per request
+
+        If memcache is configured, the version is a token shared by all
+        processes, otherwise it is a process-local token combined with
+        the last modifications of pr_affiliation, pr_role and
+        pr_delegation so that changes in other processes are noticed
+        (re-read at most every HIERARCHY_CHECK_INTERVAL seconds)
+    """
+
+    s3 = current.response.s3
+    version = s3.pr_hierarchy_version
+    if version is None:
+        pr_check_hierarchy()
+        cache = current.cache
+        key = "pr_hierarchy_version"
+        memcache = getattr(cache, "memcache", None)
+        if memcache is not None:
+            version = memcache(key, web2py_uuid, time_expire=86400)
+        else:
+            db = current.db
+            s3db = current.s3db
+            def stamps():
+                result = []
+                for tablename in HIERARCHY_TABLES:
+                    table = s3db.table(tablename)
+                    if table is None:
+                        continue
+                    modified_on = table.modified_on.max()
+                    count = table.id.count()
+                    row = db(table.id > 0).select(modified_on,
+                                                  count).first()
+                    result.extend([row[modified_on], row[count]])
+                return tuple(result)
+            version = (cache.ram(key, web2py_uuid, time_expire=86400),
+                       cache.ram("%s_stamps" % key, stamps,
+                                 time_expire=HIERARCHY_CHECK_INTERVAL))
+        s3.pr_hierarchy_version = version
+    return version
+
+# =============================================================================
+def pr_clear_hierarchy_version():
+    """
+        Invalidate the OU hierarchy version (and thus all realms cached
+        in sessions), to be called whenever the hierarchy, affiliations
+        or delegations change
+    """
+
+    cache = current.cache
+    key = "pr_hierarchy_version"
+    memcache = getattr(cache, "memcache", None)
+    if memcache is not None:
+        memcache.delete(key)
+    cache.ram(key, None)
+    cache.ram("%s_stamps" % key, None)
+    current.response.s3.pr_hierarchy_version = None
+    return
+
 # =============================================================================
 def pr_image_represent(image_name,
                        format = None,
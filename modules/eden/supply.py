@@ -378,7 +378,9 @@ class S3SupplyModel(S3Model):
         supply_item_id = S3ReusableField("item_id", db.supply_item, sortby="name", # 'item_id' for backwards-compatibility
                     requires = IS_ONE_OF(db, "supply_item.id",
                                          self.supply_item_represent,
-                                         sort=True),
+                                         sort=True,
+                                         lazy=True,
+                                         cache_tables=["supply_brand"]),
                     represent = self.supply_item_represent,
                     label = T("Item"),
                     widget = S3AutocompleteWidget("supply",
@@ -320,6 +320,14 @@ class SyncDataModel(S3Model):
                                    default = sync_policies.NEWER,
                                    label = T("Conflict Policy"),
                                    represent = sync_policy_represent),
+                             # Cursors to resume interrupted transfers
+                             # (see S3Sync.page)
+                             Field("pull_cursor",
+                                   readable=False,
+                                   writable=False),
+                             Field("push_cursor",
+                                   readable=False,
+                                   writable=False),
                              *s3.meta_fields())
 
         # Field configuration
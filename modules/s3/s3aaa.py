@@ -47,6 +47,7 @@ import urllib
 from urllib import urlencode
 import urllib2
 import math
+import random
 
 from gluon import *
 from gluon.storage import Storage, Messages
@@ -62,10 +63,11 @@ from gluon.contrib.login_methods.oauth20_account import OAuthAccount
 from gluon.sqlhtml import OptionsWidget
 
 from s3method import S3Method
+from s3model import S3Model
 from s3validators import IS_ACL
 from s3widgets import S3ACLWidget, CheckboxesWidgetS3
 
-from s3utils import s3_mark_required
+from s3utils import s3_mark_required, s3_bulk_insert
 from s3fields import s3_uid, s3_timestamp, s3_deletion_status
 
 DEFAULT = lambda: None
@@ -246,7 +248,7 @@ class AuthS3(Auth):
             passfield = settings.password_field
             if settings.username_field:
                 # with username (not used by default in Sahana)
-                settings.table_user = db.define_table(
+                settings.table_user = S3Model.define_table(
                     settings.table_user_name,
                     Field("first_name", length=128, default="",
                           label=messages.label_first_name),
@@ -282,7 +284,7 @@ class AuthS3(Auth):
                     *(s3_uid()+s3_timestamp()))
             else:
                 # with email-address (Sahana default)
-                settings.table_user = db.define_table(
+                settings.table_user = S3Model.define_table(
                     settings.table_user_name,
                     Field("first_name", length=128, default="",
                           label=messages.label_first_name),
@@ -351,7 +353,7 @@ class AuthS3(Auth):
 
         # Group table (roles)
         if not settings.table_group:
-            settings.table_group = db.define_table(
+            settings.table_group = S3Model.define_table(
                 settings.table_group_name,
                 # Group unique ID, must be notnull+unique:
                 Field("uuid",
@@ -395,7 +397,7 @@ class AuthS3(Auth):
 
         # Group membership table (user<->role)
         if not settings.table_membership:
-            settings.table_membership = db.define_table(
+            settings.table_membership = S3Model.define_table(
                 settings.table_membership_name,
                 Field("user_id", settings.table_user,
                       label=messages.label_user_id),
@@ -423,7 +425,7 @@ class AuthS3(Auth):
            not settings.table_permission:
             # Permissions table (group<->permission)
             # NB This Web2Py table is deprecated / replaced in Eden by S3Permission
-            settings.table_permission = db.define_table(
+            settings.table_permission = S3Model.define_table(
                 settings.table_permission_name,
                 Field("group_id", settings.table_group,
                       label=messages.label_group_id),
@@ -447,7 +449,7 @@ class AuthS3(Auth):
         # Records Logins & ?
         # @ToDo: Deprecate? At least make it configurable?
         if not settings.table_event:
-            settings.table_event = db.define_table(
+            settings.table_event = S3Model.define_table(
                 settings.table_event_name,
                 Field("time_stamp", "datetime",
                       default=request.now,
@@ -1729,146 +1731,188 @@ class AuthS3(Auth):
 
             else:
                 # Group memberships are limited to realms (policy 6 and above)
-                realms = {}
-                delegations = {}
+                # => cached in the session until memberships or the OU
+                # hierarchy change
+                memberships = set([(row.group_id, row.pe_id) for row in rows])
+                key = (s3db.pr_hierarchy_version(),
+                       self.permission.policy,
+                       user_id,
+                       self.user["pe_id"],
+                       tuple(sorted(memberships)))
+                cached = session.s3.realms
+                if cached is None or cached.key != key:
+                    realms, delegations = self.s3_get_realms(rows)
+                    cached = Storage(key=key,
+                                     realms=realms,
+                                     delegations=delegations)
+                    session.s3.realms = cached
+                self.user["realms"] = Storage(cached.realms)
+                self.user["delegations"] = Storage(cached.delegations)
 
-                # These roles can't be realm-restricted:
-                unrestrictable = [system_roles.ADMIN,
-                                  system_roles.ANONYMOUS,
-                                  system_roles.AUTHENTICATED]
+            if ANONYMOUS:
+                # Anonymous role has no realm
+                self.user["realms"][ANONYMOUS] = None
 
-                default_realm = s3db.pr_realm(self.user["pe_id"])
+        return
 
-                # Store the realms:
+    # -------------------------------------------------------------------------
+    def s3_get_realms(self, memberships):
+        """
+            Resolve the realms and delegations of the current user's group
+            memberships (policy 6 and above)
+
+            @param memberships: the auth_membership Rows of the user (group_id,
+                                pe_id)
+
+            @returns: tuple (realms, delegations)
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        system_roles = self.get_system_roles()
+
+        realms = {}
+        delegations = {}
+
+        # These roles can't be realm-restricted:
+        unrestrictable = [system_roles.ADMIN,
+                          system_roles.ANONYMOUS,
+                          system_roles.AUTHENTICATED]
+
+        # Default realm (=immediate OU ancestors) and all OU ancestors
+        # of the user, looked up from the hierarchy closure table
+        user_pe_id = self.user["pe_id"]
+        if user_pe_id:
+            htable = s3db.pr_hierarchy
+            query = (htable.descendant == user_pe_id)
+            rows = db(query).select(htable.ancestor, htable.depth)
+            default_realm = [row.ancestor for row in rows if row.depth == 1]
+            ancestors = [row.ancestor for row in rows]
+        else:
+            default_realm = ancestors = []
+
+        # Store the realms:
+        for row in memberships:
+            group_id = row.group_id
+            if group_id in realms and realms[group_id] is None:
+                continue
+            if group_id in unrestrictable:
+                realms[group_id] = None
+                continue
+            if group_id not in realms:
+                realms[group_id] = []
+            realm = realms[group_id]
+            pe_id = row.pe_id
+            if pe_id is None:
+                if default_realm:
+                    realm.extend([e for e in default_realm
+                                    if e not in realm])
+                if not realm:
+                    del realms[group_id]
+            elif pe_id is 0:
+                # Site-wide
+                realms[group_id] = None
+            elif pe_id not in realm:
+                realms[group_id].append(pe_id)
+
+        if self.permission.entity_hierarchy:
+            # Realms include subsidiaries of the realm entities
+
+            # Get all entities in realms
+            all_entities = []
+            append = all_entities.append
+            for realm in realms.values():
+                if realm is not None:
+                    for entity in realm:
+                        if entity not in all_entities:
+                            append(entity)
+
+            # Lookup all delegations to any OU ancestor of the user
+            if self.permission.delegations and user_pe_id:
+
+                dtable = s3db.pr_delegation
+                rtable = s3db.pr_role
+                atable = s3db.pr_affiliation
+
+                dn = dtable._tablename
+                rn = rtable._tablename
+                an = atable._tablename
+
+                query = (dtable.deleted != True) & \
+                        (atable.role_id == dtable.role_id) & \
+                        (atable.pe_id.belongs(ancestors)) & \
+                        (rtable.id == dtable.role_id)
+                rows = db(query).select(rtable.pe_id,
+                                        dtable.group_id,
+                                        atable.pe_id)
+
+                extensions = []
+                partners = []
                 for row in rows:
-                    group_id = row.group_id
-                    if group_id in realms and realms[group_id] is None:
+                    extensions.append(row[rn].pe_id)
+                    partners.append(row[an].pe_id)
+            else:
+                rows = []
+                extensions = []
+                partners = []
+
+            # Lookup the subsidiaries of all realms and extensions
+            entities = all_entities + extensions + partners
+            descendants = s3db.pr_descendants(entities)
+
+            pmap = {}
+            for p in partners:
+                if p in all_entities:
+                    pmap[p] = [p]
+                elif p in descendants:
+                    d = descendants[p]
+                    pmap[p] = [e for e in all_entities if e in d] or [p]
+
+            # Add the subsidiaries to the realms
+            for group_id in realms:
+                realm = realms[group_id]
+                if realm is None:
+                    continue
+                append = realm.append
+                for entity in list(realm):
+                    if entity in descendants:
+                        for subsidiary in descendants[entity]:
+                            if subsidiary not in realm:
+                                append(subsidiary)
+
+            # Process the delegations
+            if self.permission.delegations:
+                for row in rows:
+
+                    # owner == delegates group_id to ==> partner
+                    owner = row[rn].pe_id
+                    partner = row[an].pe_id
+                    group_id = row[dn].group_id
+
+                    if group_id in delegations and \
+                       owner in delegations[group_id]:
+                        # Duplicate
                         continue
-                    if group_id in unrestrictable:
-                        realms[group_id] = None
+                    if partner not in pmap:
                         continue
-                    if group_id not in realms:
-                        realms[group_id] = []
-                    realm = realms[group_id]
-                    pe_id = row.pe_id
-                    if pe_id is None:
-                        if default_realm:
-                            realm.extend([e for e in default_realm
-                                            if e not in realm])
-                        if not realm:
-                            del realms[group_id]
-                    elif pe_id is 0:
-                        # Site-wide
-                        realms[group_id] = None
-                    elif pe_id not in realm:
-                        realms[group_id].append(pe_id)
-
-                if self.permission.entity_hierarchy:
-                    # Realms include subsidiaries of the realm entities
-
-                    # Get all entities in realms
-                    all_entities = []
-                    append = all_entities.append
-                    for realm in realms.values():
-                        if realm is not None:
-                            for entity in realm:
-                                if entity not in all_entities:
-                                    append(entity)
-
-                    # Lookup all delegations to any OU ancestor of the user
-                    if self.permission.delegations and self.user.pe_id:
-
-                        ancestors = s3db.pr_get_ancestors(self.user.pe_id)
-
-                        dtable = s3db.pr_delegation
-                        rtable = s3db.pr_role
-                        atable = s3db.pr_affiliation
-
-                        dn = dtable._tablename
-                        rn = rtable._tablename
-                        an = atable._tablename
-
-                        query = (dtable.deleted != True) & \
-                                (atable.role_id == dtable.role_id) & \
-                                (atable.pe_id.belongs(ancestors)) & \
-                                (rtable.id == dtable.role_id)
-                        rows = db(query).select(rtable.pe_id,
-                                                dtable.group_id,
-                                                atable.pe_id)
-
-                        extensions = []
-                        partners = []
-                        for row in rows:
-                            extensions.append(row[rn].pe_id)
-                            partners.append(row[an].pe_id)
-                    else:
-                        rows = []
-                        extensions = []
-                        partners = []
-
-                    # Lookup the subsidiaries of all realms and extensions
-                    entities = all_entities + extensions + partners
-                    descendants = s3db.pr_descendants(entities)
-
-                    pmap = {}
-                    for p in partners:
-                        if p in all_entities:
-                            pmap[p] = [p]
-                        elif p in descendants:
-                            d = descendants[p]
-                            pmap[p] = [e for e in all_entities if e in d] or [p]
-
-                    # Add the subsidiaries to the realms
-                    for group_id in realms:
-                        realm = realms[group_id]
-                        if realm is None:
-                            continue
-                        append = realm.append
-                        for entity in list(realm):
-                            if entity in descendants:
-                                for subsidiary in descendants[entity]:
-                                    if subsidiary not in realm:
-                                        append(subsidiary)
-
-                    # Process the delegations
-                    if self.permission.delegations:
-                        for row in rows:
-
-                            # owner == delegates group_id to ==> partner
-                            owner = row[rn].pe_id
-                            partner = row[an].pe_id
-                            group_id = row[dn].group_id
-
-                            if group_id in delegations and \
-                               owner in delegations[group_id]:
-                                # Duplicate
-                                continue
-                            if partner not in pmap:
-                                continue
-
-                            # Find the realm
-                            if group_id not in delegations:
-                                delegations[group_id] = Storage()
-                            groups = delegations[group_id]
-
-                            r = [owner]
-                            if owner in descendants:
-                                r.extend(descendants[owner])
-
-                            for p in pmap[partner]:
-                                if p not in groups:
-                                    groups[p] = []
-                                realm = groups[p]
-                                realm.extend(r)
-
-                self.user["realms"] = realms
-                self.user["delegations"] = delegations
 
-            if ANONYMOUS:
-                # Anonymous role has no realm
-                self.user["realms"][ANONYMOUS] = None
+                    # Find the realm
+                    if group_id not in delegations:
+                        delegations[group_id] = Storage()
+                    groups = delegations[group_id]
 
-        return
+                    r = [owner]
+                    if owner in descendants:
+                        r.extend(descendants[owner])
+
+                    for p in pmap[partner]:
+                        if p not in groups:
+                            groups[p] = []
+                        realm = groups[p]
+                        realm.extend(r)
+
+        return realms, delegations
 
     # -------------------------------------------------------------------------
     def s3_create_role(self, role, description=None, *acls, **args):
@@ -1959,6 +2003,7 @@ class AuthS3(Auth):
             db(pquery).update(deleted=True)
             # Remove the role
             db(gquery).update(role=None, deleted=True)
+            self.permission.clear_acl_cache()
 
     # -------------------------------------------------------------------------
     def s3_assign_role(self, user_id, group_id, for_pe=None):
@@ -2030,6 +2075,7 @@ class AuthS3(Auth):
                 if for_pe is not None and str(group_id) not in unrestrictable:
                     membership["pe_id"] = for_pe
                 membership_id = mtable.insert(**membership)
+        self.permission.clear_acl_cache()
 
         # Update roles for current user if required
         if self.user and str(user_id) == str(self.user.id):
@@ -2106,6 +2152,7 @@ class AuthS3(Auth):
                             deleted_fk=deleted_fk,
                             user_id=None,
                             group_id=None)
+        self.permission.clear_acl_cache()
 
         # Update roles for current user if required
         if self.user and str(user_id) == str(self.user.id):
@@ -2350,6 +2397,7 @@ class AuthS3(Auth):
         for role_id in roles:
             for group_id in group_ids:
                 dtable.insert(role_id=role_id, group_id=group_id)
+        s3db.pr_clear_hierarchy_version()
 
         # Update roles for current user if required
         self.s3_set_roles()
@@ -2447,6 +2495,7 @@ class AuthS3(Auth):
 
         # Maybe update the current user's delegations?
         if len(rmv):
+            s3db.pr_clear_hierarchy_version()
             self.s3_set_roles()
         return True
 
@@ -3244,6 +3293,17 @@ class S3Permission(object):
                               reduce(lambda x, y: (x[0]&y[0], x[1]&y[1]),
                                      acl, (self.ALL, self.ALL))
 
+    # Process-wide cache of compiled ACLs, valid as long as the
+    # ACL version (see acl_version) does not change
+    ACL_VERSION_KEY = "s3_permission_version"
+    ACL_CACHE_SIZE = 10000
+    _acl_cache = None
+
+    # Realms with more entities than this are reduced to their root
+    # entities and expanded by the database (see realm_query)
+    REALM_ROOTS_MIN = 20
+    _realm_roots = None
+
     # -------------------------------------------------------------------------
     def __init__(self, auth, tablename=None):
         """
@@ -3341,7 +3401,7 @@ class S3Permission(object):
             table_group = "integer" # fallback (doesn't work with requires)
 
         if not self.table:
-            self.table = db.define_table(self.tablename,
+            self.table = S3Model.define_table(self.tablename,
                             Field("group_id", table_group),
                             Field("controller", length=64),
                             Field("function", length=512),
@@ -3400,6 +3460,7 @@ class S3Permission(object):
 
         if "permissions" in current.response.s3:
             del current.response.s3["permissions"]
+        self.clear_acl_cache()
 
         if c is None and f is None and t is None:
             return None
@@ -3742,10 +3803,70 @@ class S3Permission(object):
             public = (table[OENT] == None)
             if len(entities) == 1:
                 return (table[OENT] == entities[0]) | public
-            else:
-                return (table[OENT].belongs(entities)) | public
+            elif self.entity_hierarchy and \
+                 len(entities) > self.REALM_ROOTS_MIN:
+                # Realms include all subsidiaries of their entities,
+                # so let the closure table expand them - but only if
+                # that gives exactly the same set of entities
+                roots = self.realm_roots(entities)
+                if roots is not None:
+                    query = current.s3db.pr_hierarchy_query(table[OENT],
+                                                            roots)
+                    return query | public
+            return (table[OENT].belongs(entities)) | public
         return None
 
+    # -------------------------------------------------------------------------
+    def realm_roots(self, entities):
+        """
+            Reduce a realm (which includes all subsidiaries of its
+            entities) to its root entities, i.e. those which do not
+            have an OU ancestor in the realm; cached per process for
+            the current hierarchy version
+
+            @param entities: list of PE-IDs
+            @returns: list of root PE-IDs, or None if expanding the
+                      roots through the closure table would not give
+                      exactly the original entities (e.g. if a subsidiary
+                      has been dropped from the realm by a more restrictive
+                      ACL, or the realm contains person entities)
+        """
+
+        s3db = current.s3db
+
+        version = s3db.pr_hierarchy_version()
+        cache = S3Permission._realm_roots
+        if cache is None or cache.version != version:
+            cache = Storage(version=version, roots={})
+            S3Permission._realm_roots = cache
+
+        key = frozenset(entities)
+        if key in cache.roots:
+            return cache.roots[key]
+
+        htable = s3db.pr_hierarchy
+        query = (htable.ancestor.belongs(entities))
+        rows = current.db(query).select(htable.ancestor,
+                                        htable.descendant,
+                                        htable.instance_type)
+        subsidiaries = set([row.descendant for row in rows
+                            if row.descendant in key])
+        roots = [e for e in key if e not in subsidiaries]
+
+        # What pr_hierarchy_query would select for these roots
+        expanded = set(roots)
+        for row in rows:
+            if row.ancestor not in subsidiaries and \
+               row.instance_type != "pr_person":
+                expanded.add(row.descendant)
+        if expanded != key:
+            roots = None
+
+        if len(cache.roots) >= self.ACL_CACHE_SIZE:
+            cache.roots.clear()
+        cache.roots[key] = roots
+        return roots
+
     # -------------------------------------------------------------------------
     # Authorization
     # -------------------------------------------------------------------------
@@ -4035,6 +4156,56 @@ class S3Permission(object):
         _debug(str(query))
         return query
 
+    # -------------------------------------------------------------------------
+    def permitted_ids(self, method, table, ids, c=None, f=None):
+        """
+            Filter a list of record IDs for those records which are
+            accessible with method, e.g. the displayed page of a list
+            view, checking ownership and realms in a single query
+
+            @param method: the method as string or a list of methods (AND)
+            @param table: the database table or table name
+            @param ids: list of record IDs
+            @param c: controller name (falls back to current request)
+            @param f: function name (falls back to current request)
+
+            @returns: list of the permitted record IDs (in order of ids)
+        """
+
+        if not hasattr(table, "_tablename"):
+            tablename = table
+            table = current.s3db.table(tablename)
+            if not table:
+                raise AttributeError("undefined table %s" % tablename)
+
+        ids = [i for i in ids if i]
+        if not ids:
+            return []
+
+        auth = self.auth
+        if auth.override:
+            return ids
+
+        if not self.use_cacls:
+            # Simple policies have no accessible_query => check per record
+            return [i for i in ids
+                    if auth.s3_has_permission(method, table,
+                                              record_id=i, c=c, f=f)]
+
+        if not self.ownership_required(method, table, c=c, f=f):
+            # Same permission for all records
+            if self.has_permission(method, c=c, f=f, t=table):
+                return ids
+            else:
+                return []
+
+        query = self.accessible_query(method, table, c=c, f=f) & \
+                (table._id.belongs(ids))
+        rows = current.db(query).select(table._id)
+        pkey = table._id.name
+        permitted = set([str(row[pkey]) for row in rows])
+        return [i for i in ids if str(i) in permitted]
+
     # -------------------------------------------------------------------------
     def accessible_url(self,
                        c=None,
@@ -4134,11 +4305,6 @@ class S3Permission(object):
                       or list of applicable ACLs
         """
 
-        db = current.db
-        table = self.table
-
-        gtable = self.auth.settings.table_group
-
         if not self.use_cacls:
             # We do not use ACLs at all (allow all)
             return None
@@ -4161,37 +4327,38 @@ class S3Permission(object):
             # No roles available (deny all)
             return acls
 
-        # Base query
-        query = (table.deleted != True) & \
-                (table.group_id.belongs(roles))
+        if t is not None and hasattr(t, "_tablename"):
+            t = t._tablename
+
+        # Check the process-wide cache
+        cache = self.compiled_acls()
+        key = (racl, c, f, t, entity or None,
+               self.acl_key(realms),
+               self.acl_key(delegations),
+               self.policy)
+        results = cache.results
+        if key in results:
+            return Storage(results[key])
 
         # Page ACLs
+        rules = []
         if page_restricted:
-            q = (table.function == None)
-            if f and self.use_facls:
-                q = (q | (table.function == f))
-            q &= (table.controller == c)
-        else:
-            q = None
+            use_f = f and self.use_facls
+            rules.extend([rule for rule in cache.pages.get(c, [])
+                          if rule.function is None or \
+                             use_f and rule.function == f])
 
         # Table ACLs
         table_restricted = False
         if t and self.use_tacls:
-            tq = (table.controller == None) & \
-                 (table.function == None) & \
-                 (table.tablename == t)
-            if q:
-                q = q | tq
-            else:
-                q = tq
-            any_acl = db((table.deleted != True) & tq).select(limitby=(0, 1))
-            table_restricted = len(any_acl) > 0
+            table_acls = cache.tables.get(t, [])
+            rules.extend(table_acls)
+            table_restricted = len(table_acls) > 0
 
         # Retrieve the ACLs
-        if q:
-            query &= q
-        query &= (table.group_id == gtable.id)
-        rows = db(query).select(gtable.id, table.ALL)
+        if not page_restricted and not (t and self.use_tacls):
+            rules = cache.rules
+        rows = [rule for rule in rules if rule.group_id in roles]
 
         # Cascade ACLs
         ANY = "ANY"
@@ -4199,9 +4366,6 @@ class S3Permission(object):
         ALL = (self.ALL, self.ALL)
         NONE = (self.NONE, self.NONE)
 
-        atn = table._tablename
-        gtn = gtable._tablename
-
         use_facls = self.use_facls
         def rule_type(r):
             if rule.controller is not None:
@@ -4219,12 +4383,12 @@ class S3Permission(object):
         # Realms
         delegation_rows = []
         append_delegation = delegation_rows.append
-        for row in rows:
+        for rule in rows:
 
             # Get the assigning entities
-            group_id = row[gtn].id
+            group_id = rule.group_id
             if group_id in delegations:
-                append_delegation(row)
+                append_delegation(rule)
             if group_id not in realms:
                 continue
             elif self.entity_realm:
@@ -4233,7 +4397,6 @@ class S3Permission(object):
                 entities = None
 
             # Get the rule type
-            rule = row[atn]
             rtype = rule_type(rule)
             if rtype is None:
                 continue
@@ -4264,16 +4427,15 @@ class S3Permission(object):
 
         # Delegations
         if self.delegations:
-            for row in delegation_rows:
+            for rule in delegation_rows:
 
                 # Get the rule type
-                rule = row[atn]
                 rtype = rule_type(rule)
                 if rtype is None:
                     continue
 
                 # Get the delegation realms
-                group_id = row[gtn].id
+                group_id = rule.group_id
                 if group_id not in delegations:
                     continue
                 else:
@@ -4379,7 +4541,157 @@ class S3Permission(object):
         #for pe in result:
             #print "ACL for PE %s: %04X %04X" % (pe, result[pe][0], result[pe][1])
 
-        return result
+        if len(results) >= self.ACL_CACHE_SIZE:
+            results.clear()
+        results[key] = result
+
+        return Storage(result)
+
+    # -------------------------------------------------------------------------
+    # ACL Cache
+    # -------------------------------------------------------------------------
+    def acl_version(self):
+        """
+            Get the current ACL version, checked once per request
+
+            If memcache is configured, the version is a token shared
+            by all processes; otherwise it is a process-local token
+            combined with the last modification of the ACL table, so
+            that changes by other processes are noticed too.
+        """
+
+        s3 = current.response.s3
+        version = s3.acl_version
+        if version is None:
+            cache = current.cache
+            key = self.ACL_VERSION_KEY
+            memcache = getattr(cache, "memcache", None)
+            if memcache is not None:
+                version = memcache(key, web2py_uuid, time_expire=86400)
+            else:
+                token = cache.ram(key, web2py_uuid, time_expire=86400)
+                table = self.table
+                modified_on = table.modified_on.max()
+                count = table.id.count()
+                row = current.db(table.id > 0).select(modified_on,
+                                                      count).first()
+                version = (token, row[modified_on], row[count])
+            s3.acl_version = version
+        return version
+
+    # -------------------------------------------------------------------------
+    def clear_acl_cache(self):
+        """
+            Invalidate the compiled ACLs in all processes, to be called
+            whenever ACLs or role assignments change
+        """
+
+        cache = current.cache
+        key = self.ACL_VERSION_KEY
+        memcache = getattr(cache, "memcache", None)
+        if memcache is not None:
+            memcache.delete(key)
+        cache.ram(key, None)
+        current.response.s3.acl_version = None
+        S3Permission._acl_cache = None
+        return
+
+    # -------------------------------------------------------------------------
+    def compiled_acls(self):
+        """
+            Get the compiled ACLs for the current ACL version, i.e. all
+            active ACLs indexed by controller and table, loaded in a
+            single query and re-used across requests
+
+            @returns: Storage with
+                      rules   - all ACLs
+                      pages   - {controller: [page ACLs]}
+                      tables  - {tablename: [table ACLs]}
+                      results - {key: result} of applicable_acls
+        """
+
+        version = self.acl_version()
+        cache = S3Permission._acl_cache
+        if cache is not None and cache.version == version:
+            return cache
+
+        table = self.table
+        gtable = self.auth.settings.table_group
+        query = (table.deleted != True) & \
+                (table.group_id == gtable.id)
+        rows = current.db(query).select(table.group_id,
+                                        table.controller,
+                                        table.function,
+                                        table.tablename,
+                                        table.entity,
+                                        table.unrestricted,
+                                        table.uacl,
+                                        table.oacl)
+        rules = []
+        pages = {}
+        tables = {}
+        for row in rows:
+            rule = Storage(row.as_dict())
+            rules.append(rule)
+            if rule.controller is not None:
+                pages.setdefault(rule.controller, []).append(rule)
+            elif rule.function is None and rule.tablename is not None:
+                tables.setdefault(rule.tablename, []).append(rule)
+
+        cache = Storage(version=version,
+                        rules=rules,
+                        pages=pages,
+                        tables=tables,
+                        results={})
+        S3Permission._acl_cache = cache
+        return cache
+
+    # -------------------------------------------------------------------------
+    def cache_key(self):
+        """
+            Hashable key for the permissions of the current user (ACL
+            version, policy, realms and delegations), to cache results
+            of permission checks which do not depend on particular records
+
+            @returns: the key, or None if the results must not be cached
+                      (auth override)
+        """
+
+        auth = self.auth
+        if auth.override:
+            return None
+        if auth.s3_logged_in():
+            realms = auth.user.realms
+            delegations = auth.user.delegations
+        else:
+            sr = auth.get_system_roles()
+            realms = Storage({sr.ANONYMOUS: None})
+            delegations = None
+        return (self.acl_version(),
+                self.policy,
+                self.acl_key(realms),
+                self.acl_key(delegations))
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def acl_key(realms):
+        """
+            Hashable representation of realms or delegations
+
+            @param realms: the realms or delegations (dict)
+        """
+
+        if not realms:
+            return None
+        key = []
+        for k in sorted(realms.keys()):
+            v = realms[k]
+            if isinstance(v, dict):
+                v = S3Permission.acl_key(v)
+            elif isinstance(v, (list, tuple)):
+                v = tuple(sorted(v))
+            key.append((k, v))
+        return tuple(key)
 
     # -------------------------------------------------------------------------
     # Utilities
@@ -4422,22 +4734,25 @@ class S3Permission(object):
             if not roles:
                 hidden_modules = restricted_modules
             else:
-                t = self.table
-                query = (t.deleted != True) & \
-                        (t.controller.belongs(restricted_modules)) & \
-                        (t.tablename == None)
-                if roles:
-                    query = query & (t.group_id.belongs(roles))
-                else:
-                    query = query & (t.group_id == None)
-                rows = current.db(query).select()
+                # Use the compiled ACLs (no DB query)
+                cache = self.compiled_acls()
+                key = ("hidden_modules", tuple(sorted(roles)))
+                results = cache.results
+                if key in results:
+                    return list(results[key])
+                pages = cache.pages
                 acls = dict()
-                for acl in rows:
-                    if acl.controller not in acls:
-                        acls[acl.controller] = self.NONE
-                    acls[acl.controller] |= acl.oacl | acl.uacl
+                for m in restricted_modules:
+                    for acl in pages.get(m, []):
+                        if acl.tablename is not None or \
+                           acl.group_id not in roles:
+                            continue
+                        if m not in acls:
+                            acls[m] = self.NONE
+                        acls[m] |= acl.oacl | acl.uacl
                 hidden_modules = [m for m in restricted_modules
                                     if m not in acls or not acls[m]]
+                results[key] = tuple(hidden_modules)
         return hidden_modules
 
     # -------------------------------------------------------------------------
@@ -4518,7 +4833,17 @@ class S3Permission(object):
 
 # =============================================================================
 class S3Audit(object):
-    """ S3 Audit Trail Writer Class """
+    """
+        S3 Audit Trail Writer Class
+
+        Audit events are buffered in memory and written in bulk: inside
+        a batch (see begin/end, e.g. a REST request or an export) they
+        are flushed at the end of the batch or whenever the buffer is
+        full, outside of a batch they are written immediately.
+    """
+
+    # Maximum number of buffered events before they get flushed
+    BUFFER_SIZE = 500
 
     def __init__(self,
                  tablename="s3_audit",
@@ -4536,7 +4861,7 @@ class S3Audit(object):
         db = current.db
         self.table = db.get(tablename, None)
         if not self.table:
-            self.table = db.define_table(tablename,
+            self.table = S3Model.define_table(tablename,
                             Field("timestmp", "datetime"),
                             Field("person", "integer"),
                             Field("operation"),
@@ -4556,6 +4881,12 @@ class S3Audit(object):
 
         self.diff = None
 
+        # Buffered events
+        self.queue = []
+        self.batch = 0
+        # Aggregated read/list events {(operation, tablename, representation): entry}
+        self.reads = {}
+
     # -------------------------------------------------------------------------
     def __call__(self, operation, prefix, name,
                  form=None,
@@ -4569,7 +4900,8 @@ class S3Audit(object):
             @param prefix: the module prefix of the resource
             @param name: the name of the resource (without prefix)
             @param form: the form
-            @param record: the record ID
+            @param record: the record ID (or, for "delete", the Row
+                           with the values before the deletion)
             @param representation: the representation format
         """
 
@@ -4580,11 +4912,12 @@ class S3Audit(object):
 
         now = datetime.datetime.utcnow()
         db = current.db
-        table = self.table
         tablename = "%s_%s" % (prefix, name)
 
+        row = None
         if record:
             if isinstance(record, Row):
+                row = record
                 record = record.get("id", None)
                 if not record:
                     return True
@@ -4610,12 +4943,30 @@ class S3Audit(object):
 
         if operation in ("list", "read"):
             if settings.get_security_audit_read():
-                table.insert(timestmp = now,
-                             person = self.user,
-                             operation = operation,
-                             tablename = tablename,
-                             record = record,
-                             representation = representation)
+                sample = settings.get_security_audit_read_sample()
+                if sample < 1 and random.random() >= sample:
+                    return True
+                if self.batch and settings.get_security_audit_aggregate():
+                    # Aggregate all reads of this table in one entry
+                    key = (operation, tablename, representation)
+                    entry = self.reads.get(key, None)
+                    if entry is None:
+                        entry = self.reads[key] = Storage(timestmp = now,
+                                                          person = self.user,
+                                                          operation = operation,
+                                                          tablename = tablename,
+                                                          record = record,
+                                                          representation = representation,
+                                                          records = [])
+                    if record and record not in entry.records:
+                        entry.records.append(record)
+                    return True
+                self.write(timestmp = now,
+                           person = self.user,
+                           operation = operation,
+                           tablename = tablename,
+                           record = record,
+                           representation = representation)
 
         elif operation in ("create", "update"):
             if settings.get_security_audit_write():
@@ -4625,34 +4976,100 @@ class S3Audit(object):
                                  for var in form.vars]
                 else:
                     new_value = []
-                table.insert(timestmp = now,
-                             person = self.user,
-                             operation = operation,
-                             tablename = tablename,
-                             record = record,
-                             representation = representation,
-                             new_value = new_value)
+                self.write(timestmp = now,
+                           person = self.user,
+                           operation = operation,
+                           tablename = tablename,
+                           record = record,
+                           representation = representation,
+                           new_value = new_value)
                 self.diff = None
 
         elif operation == "delete":
             if settings.get_security_audit_write():
-                query = db[tablename].id == record
-                row = db(query).select(limitby=(0, 1)).first()
+                if row is None:
+                    query = db[tablename].id == record
+                    row = db(query).select(limitby=(0, 1)).first()
                 old_value = []
                 if row:
                     old_value = ["%s:%s" % (field, row[field])
                                  for field in row]
-                table.insert(timestmp = now,
-                             person = self.user,
-                             operation = operation,
-                             tablename = tablename,
-                             record = record,
-                             representation = representation,
-                             old_value = old_value)
+                self.write(timestmp = now,
+                           person = self.user,
+                           operation = operation,
+                           tablename = tablename,
+                           record = record,
+                           representation = representation,
+                           old_value = old_value)
                 self.diff = None
 
         return True
 
+    # -------------------------------------------------------------------------
+    def write(self, **entry):
+        """
+            Add an entry to the buffer, flush the buffer if it is full
+            or outside of a batch
+
+            @param entry: the audit entry as field=value
+        """
+
+        queue = self.queue
+        queue.append(entry)
+        if not self.batch or len(queue) >= self.BUFFER_SIZE:
+            self.flush()
+
+    # -------------------------------------------------------------------------
+    def begin(self):
+        """ Start a batch (buffer all audit events until end()) """
+
+        self.batch += 1
+
+    # -------------------------------------------------------------------------
+    def end(self, flush=True):
+        """
+            End a batch, write all buffered audit events
+
+            @param flush: False to discard all buffered events (e.g. if
+                          the transaction is going to be rolled back)
+        """
+
+        if not flush:
+            self.batch = 0
+            self.queue = []
+            self.reads = {}
+            return
+        if self.batch:
+            self.batch -= 1
+        if not self.batch:
+            self.flush()
+
+    # -------------------------------------------------------------------------
+    def flush(self):
+        """ Write all buffered audit events in a single INSERT """
+
+        # Aggregated reads
+        reads = self.reads
+        if reads:
+            self.reads = {}
+            for entry in reads.values():
+                records = entry.pop("records")
+                if len(records) > 1:
+                    entry.record = None
+                    entry.new_value = ["id:%s" % r for r in records]
+                self.queue.append(dict(entry))
+
+        queue = self.queue
+        if not queue:
+            return
+        self.queue = []
+
+        table = self.table
+        if len(queue) == 1:
+            table.insert(**queue[0])
+        else:
+            s3_bulk_insert(table, queue)
+
 # =============================================================================
 class S3RoleManager(S3Method):
     """ REST Method to manage ACLs (Role Manager UI for administrators) """
@@ -890,6 +890,7 @@ class S3CRUD(S3Method):
                                       linkto=linkto,
                                       download_url=self.download_url,
                                       format=representation)
+            page_ids = list(resource.page_ids)
 
             # In SSPag, send the first 20 records together with the initial
             # response (avoids the dataTables Ajax request unless the user
@@ -910,6 +911,8 @@ class S3CRUD(S3Method):
                                                   download_url=self.download_url,
                                                   as_page=True,
                                                   format=representation)
+                    page_ids.extend([i for i in resource.page_ids
+                                     if i not in page_ids])
                     aadata = dict(aaData = sqltable or [])
                     aadata.update(iTotalRecords=totalrows,
                                   iTotalDisplayRecords=totalrows)
@@ -917,6 +920,9 @@ class S3CRUD(S3Method):
                     s3.start = 0
                     s3.limit = limit
 
+            # Records on the initial page (for per-row action buttons)
+            s3.dataTable_ids = page_ids
+
             # Title and subtitle
             if r.component:
                 title = crud_string(r.tablename, "title_display")
@@ -1000,6 +1006,11 @@ class S3CRUD(S3Method):
                           iTotalDisplayRecords = displayrows,
                           aaData = items)
 
+            # Per-row permissions for the action buttons on this page
+            restrict = self.restrict(table, resource.page_ids)
+            if restrict:
+                result["restrict"] = restrict
+
             output = json(result)
 
         elif representation == "plain":
@@ -1530,6 +1541,30 @@ class S3CRUD(S3Method):
 
         return output
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def restrict(table, ids):
+        """
+            Check per-row permissions for the records on a page, to
+            restrict the action buttons in SSPag responses
+
+            @param table: the table
+            @param ids: the record IDs on the page
+
+            @returns: dict {permission: [record IDs as strings]} for all
+                      permissions which depend on record ownership, or
+                      None if all records are permitted
+        """
+
+        auth = current.auth
+        if not ids or not auth.s3_has_permission("delete", table):
+            return None
+        permission = auth.permission
+        if not permission.ownership_required("delete", table):
+            return None
+        ids = permission.permitted_ids("delete", table, ids)
+        return dict(delete = [str(row_id) for row_id in ids])
+
     # -------------------------------------------------------------------------
     @staticmethod
     def action_button(label, url, **attr):
@@ -1618,15 +1653,22 @@ class S3CRUD(S3Method):
                 delete_url = URL(args = args + ["delete"])
             if ownership_required("delete", table):
                 # Check which records can be deleted
-                query = auth.s3_accessible_query("delete", table)
-                rows = db(query).select(table._id)
-                restrict = []
-                for row in rows:
-                    row_id = row.get("id", None)
-                    if row_id:
-                        restrict.append(str(row_id))
+                ids = s3.dataTable_ids
+                if ids is not None:
+                    # Only the records on the current page
+                    ids = auth.permission.permitted_ids("delete", table, ids)
+                    restrict = [str(row_id) for row_id in ids]
+                else:
+                    query = auth.s3_accessible_query("delete", table)
+                    rows = db(query).select(table._id)
+                    restrict = []
+                    for row in rows:
+                        row_id = row.get("id", None)
+                        if row_id:
+                            restrict.append(str(row_id))
                 s3crud.action_button(labels.DELETE, delete_url,
-                                     _class="delete-btn", restrict=restrict)
+                                     _class="delete-btn", restrict=restrict,
+                                     permission="delete")
             else:
                 s3crud.action_button(labels.DELETE, delete_url,
                                      _class="delete-btn")
@@ -37,6 +37,7 @@ import os
 import re
 import sys
 import copy
+import threading
 #import logging
 import math             # Needed for greatCircleDistance
 #import random          # Needed when feature_queries are passed in without a name
@@ -47,7 +48,7 @@ try:
     from cStringIO import StringIO    # Faster, where available
 except:
     from StringIO import StringIO
-from datetime import timedelta  # Needed for Feed Refresh checks
+from datetime import timedelta  # Needed for Feed Refresh checks & Location Index
 import zipfile          # Needed to unzip KMZ files
 
 try:
@@ -62,6 +63,7 @@ from gluon import *
 from gluon.dal import Rows
 from gluon.storage import Storage, Messages
 from gluon.tools import fetch
+from gluon.utils import web2py_uuid
 import gluon.contrib.simplejson as json
 from gluon.contrib.simplejson.ordered_dict import OrderedDict
 
@@ -78,6 +80,14 @@ try:
 except ImportError:
     s3_debug("WARNING: %s: Shapely GIS library not installed" % __name__)
 
+RTREE = False
+try:
+    from rtree import index as rtree_index
+    RTREE = True
+except ImportError:
+    # Optional: only needed for settings.gis.spatial_index
+    pass
+
 DEBUG = False
 if DEBUG:
     import datetime
@@ -232,6 +242,36 @@ class GIS(object):
         GIS functions
     """
 
+    # Tolerances (in degrees) of the pre-simplified Location geometries,
+    # coarsest first
+    SIMPLIFY_TOLERANCES = (0.1, 0.01, 0.001, 0.0001)
+    # Tolerance to use when there is no bbox
+    SIMPLIFY_DEFAULT = 0.001
+    # Assumed width of the map (in pixels) when estimating the
+    # tolerance from a bbox (incl. the 1.5 ratio of the BBOX strategy)
+    SIMPLIFY_BBOX_PIXELS = 1500
+
+    # Number of Location paths to write back per UPDATE statement
+    PATH_BATCH_SIZE = 500
+
+    # Process-wide cache of the map configurations (see set_config),
+    # layer definitions and markers (see cache_config)
+    # {(config version, config_id, user): (config, result)}
+    CONFIG_VERSION_KEY = "gis_config_version"
+    CONFIG_CACHE_SIZE = 1000
+    _config_cache = {}
+
+    # Tables which the config version depends on (without memcache), and
+    # the interval (in seconds) to check them for changes by other processes
+    CONFIG_TABLES = ("gis_config",
+                     "gis_layer_config",
+                     "gis_symbology",
+                     "gis_layer_symbology",
+                     "gis_marker",
+                     "gis_projection",
+                     )
+    CONFIG_CHECK_INTERVAL = 60
+
     def __init__(self):
         settings = current.deployment_settings
         if not current.db is not None:
@@ -265,6 +305,10 @@ class GIS(object):
         self.countries_by_code = None
         self.site_countries_by_id = None
         self.site_countries_by_code = None
+        # Spatial query engine, instantiated on demand
+        self.spatial_backend = None
+        # In-process index of Location bounds
+        self.location_index = S3LocationIndex
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -954,7 +998,6 @@ class GIS(object):
             @ToDo: Merge configs for Event
         """
 
-        session = current.session
         s3 = current.response.s3
 
         # If an id has been supplied, try it first. If it matches what's in
@@ -964,6 +1007,47 @@ class GIS(object):
            s3.gis.config.id == config_id:
             return
 
+        # Look up the process-wide cache
+        auth = current.auth
+        if auth.is_logged_in():
+            # Personal and OU configs depend on the user's affiliations
+            user = (auth.user.pe_id, current.s3db.pr_hierarchy_version())
+        else:
+            user = None
+        key = (self.config_version(), config_id, user)
+        configs = GIS._config_cache
+        cached = configs.get(key, None)
+        if cached is None or force_update_cache:
+            cached = self.__read_config(config_id)
+            if len(configs) >= self.CONFIG_CACHE_SIZE:
+                configs.clear()
+            configs[key] = cached
+
+        # Store a copy of the values
+        config, result = cached
+        cache = Storage(config)
+        if "ids" in cache:
+            cache["ids"] = list(cache["ids"])
+        s3.gis.config = cache
+
+        # Let caller know if their id was valid.
+        if result is config:
+            return cache
+        return result
+
+    # -------------------------------------------------------------------------
+    def __read_config(self, config_id=None):
+        """
+            Read a GIS config from the DB (helper for set_config)
+
+            @param config_id: the config ID, 0 for the SITE_DEFAULT
+
+            @returns: tuple (config, result), where result is the ID
+                      of the config used, or config if none was found
+        """
+
+        s3 = current.response.s3
+
         db = current.db
         s3db = current.s3db
 
@@ -987,8 +1071,7 @@ class GIS(object):
             config = db(ctable.uuid == "SITE_DEFAULT").select(limitby=(0, 1)).first()
             if not config:
                 # No configs found at all
-                s3.gis.config = cache
-                return cache
+                return cache, cache
             query = (ctable.id == config.id) & \
                     (mtable.id == stable.marker_id) & \
                     (stable.id == ctable.symbology_id) & \
@@ -1045,8 +1128,10 @@ class GIS(object):
                     if not config_id:
                         config_id = config.id
                     cache["ids"].append(config.id)
+                    # Only the field values (no referencing Sets or
+                    # Row methods, the config is cached across requests)
                     fields = filter(lambda key: key not in exclude,
-                                    config)
+                                    ctable.fields)
                     for key in fields:
                         if key not in cache or cache[key] is None:
                             cache[key] = config[key]
@@ -1079,8 +1164,7 @@ class GIS(object):
             config = db(ctable.uuid == "SITE_DEFAULT").select(limitby=(0, 1)).first()
             if not config:
                 # No configs found at all
-                s3.gis.config = cache
-                return cache
+                return cache, cache
             query = (ctable.id == config.id) & \
                     (mtable.id == stable.marker_id) & \
                     (stable.id == ctable.symbology_id) & \
@@ -1095,7 +1179,7 @@ class GIS(object):
             projection = row["gis_projection"]
             marker = row["gis_marker"]
             fields = filter(lambda key: key not in s3.all_meta_field_names,
-                            config)
+                            ctable.fields)
             for key in fields:
                 cache[key] = config[key]
             for key in ["epsg", "units", "maxResolution", "maxExtent"]:
@@ -1113,11 +1197,110 @@ class GIS(object):
             else:
                 cache["base"] = None
 
-        # Store the values
-        s3.gis.config = cache
-
         # Let caller know if their id was valid.
-        return config_id if row else cache
+        return cache, config_id if row else cache
+
+
+    # -------------------------------------------------------------------------
+    def config_version(self):
+        """
+            Get the current version of the map configurations, checked
+            once per request
+
+            If memcache is configured, the version is a token shared
+            by all processes; otherwise it is a process-local token
+            combined with the last modification of the config tables,
+            so that changes by other processes are noticed too (within
+            CONFIG_CHECK_INTERVAL).
+        """
+
+        s3 = current.response.s3
+        version = s3.gis_config_version
+        if version is None:
+            cache = current.cache
+            key = self.CONFIG_VERSION_KEY
+            memcache = getattr(cache, "memcache", None)
+            if memcache is not None:
+                version = memcache(key, web2py_uuid, time_expire=86400)
+            else:
+                token = cache.ram(key, web2py_uuid, time_expire=86400)
+                stamp = self.table_stamp
+                version = [token]
+                for tablename in self.CONFIG_TABLES:
+                    version.append(stamp(tablename))
+                version = tuple(version)
+            s3.gis_config_version = version
+        return version
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def table_stamp(tablename):
+        """
+            Get the last modification and the number of records of a
+            config table, re-read at most every CONFIG_CHECK_INTERVAL
+            seconds per process (not needed with memcache)
+
+            @param tablename: the table name
+
+            @returns: tuple (max(modified_on), count)
+        """
+
+        def stamp():
+            table = current.s3db[tablename]
+            modified_on = table.modified_on.max()
+            count = table.id.count()
+            row = current.db(table.id > 0).select(modified_on,
+                                                  count).first()
+            return (row[modified_on], row[count])
+
+        return current.cache.ram("%s_%s" % (GIS.CONFIG_VERSION_KEY,
+                                            tablename),
+                                 stamp,
+                                 time_expire=GIS.CONFIG_CHECK_INTERVAL)
+
+    # -------------------------------------------------------------------------
+    def cache_config(self, key, f):
+        """
+            Look up a value (e.g. layer definitions or markers) in the
+            process-wide config cache, under the current config version
+
+            @param key: the key (tuple)
+            @param f: function to produce the value if not in the cache
+
+            @note: the value is shared between requests and must not be
+                   modified by the caller
+        """
+
+        key = (self.config_version(),) + key
+        configs = GIS._config_cache
+        if key in configs:
+            return configs[key]
+        value = f()
+        if len(configs) >= self.CONFIG_CACHE_SIZE:
+            configs.clear()
+        configs[key] = value
+        return value
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def clear_config_cache():
+        """
+            Invalidate the cached map configurations in all processes,
+            to be called whenever configs, layers, markers or projections
+            change
+        """
+
+        cache = current.cache
+        key = GIS.CONFIG_VERSION_KEY
+        memcache = getattr(cache, "memcache", None)
+        if memcache is not None:
+            memcache.delete(key)
+        cache.ram(key, None)
+        for tablename in GIS.CONFIG_TABLES:
+            cache.ram("%s_%s" % (key, tablename), None)
+        current.response.s3.gis_config_version = None
+        GIS._config_cache.clear()
+        return
 
     # -------------------------------------------------------------------------
     def get_config(self):
@@ -1168,6 +1351,7 @@ class GIS(object):
         table = s3db.gis_config
         query = (table.uuid == "SITE_DEFAULT")
         db(query).update(default_location_id=id)
+        GIS.clear_config_cache()
 
     # -------------------------------------------------------------------------
     def get_location_hierarchy(self, level=None, location=None):
@@ -1520,8 +1704,6 @@ class GIS(object):
 
         db = current.db
         s3db = current.s3db
-        session = current.session
-        T = current.T
         locations = db.gis_location
 
         try:
@@ -1529,38 +1711,30 @@ class GIS(object):
             # Check that the location is a polygon
             query = (locations.id == location_id)
             location = db(query).select(locations.wkt,
-                                        locations.lon_min,
-                                        locations.lon_max,
-                                        locations.lat_min,
-                                        locations.lat_max,
                                         limitby=(0, 1)).first()
             if location:
                 wkt = location.wkt
-                if wkt and (wkt.startswith("POLYGON") or \
-                            wkt.startswith("MULTIPOLYGON")):
-                    # ok
-                    lon_min = location.lon_min
-                    lon_max = location.lon_max
-                    lat_min = location.lat_min
-                    lat_max = location.lat_max
-
-                else:
+                if not wkt or not (wkt.startswith("POLYGON") or \
+                                   wkt.startswith("MULTIPOLYGON")):
                     s3_debug("Location searched within isn't a Polygon!")
                     return None
+            else:
+                s3_debug("Location searched within doesn't exist!")
+                return None
         except: # @ToDo: need specific exception
             wkt = location
-            if (wkt.startswith("POLYGON") or wkt.startswith("MULTIPOLYGON")):
-                # ok
-                lon_min = None
-            else:
+            if not (wkt.startswith("POLYGON") or wkt.startswith("MULTIPOLYGON")):
                 s3_debug("This isn't a Polygon!")
                 return None
 
-        try:
-            polygon = wkt_loads(wkt)
-        except: # @ToDo: need specific exception
-            s3_debug("Invalid Polygon!")
-            return None
+        if SHAPELY:
+            try:
+                polygon = wkt_loads(wkt)
+            except: # @ToDo: need specific exception
+                s3_debug("Invalid Polygon!")
+                return None
+        else:
+            polygon = wkt
 
         table = s3db[tablename]
 
@@ -1569,7 +1743,11 @@ class GIS(object):
             s3_debug("This table doesn't have a location_id!")
             return None
 
-        query = (table.location_id == locations.id)
+        spatial_query = self.spatial_query("intersects", polygon)
+        if spatial_query is None:
+            return None
+
+        query = (table.location_id == locations.id) & spatial_query
         if "deleted" in table.fields:
             query = query & (table.deleted == False)
         # @ToDo: Check AAA (do this as a resource filter?)
@@ -1578,62 +1756,7 @@ class GIS(object):
                                     locations.lat,
                                     locations.lon,
                                     table.ALL)
-        output = Rows()
-        # @ToDo: provide option to use PostGIS/Spatialite
-        # settings = current.deployment_settings
-        # if settings.gis.spatialdb and settings.database.db_type == "postgres":
-        if lon_min is None:
-            # We have no BBOX so go straight to the full geometry check
-            for row in features:
-                wkt = row.gis_location.wkt
-                if wkt is None:
-                    lat = row.gis_location.lat
-                    lon = row.gis_location.lon
-                    if lat is not None and lon is not None:
-                        wkt = self.latlon_to_wkt(lat, lon)
-                    else:
-                        continue
-                try:
-                    shape = wkt_loads(wkt)
-                    if shape.intersects(polygon):
-                        # Save Record
-                        output.records.append(row)
-                except shapely.geos.ReadingError:
-                    s3_debug(
-                        "Error reading wkt of location with id",
-                        value=row.id
-                    )
-        else:
-            # 1st check for Features included within the bbox (faster)
-            def in_bbox(row):
-                _location = row.gis_location
-                return (_location.lon > lon_min) & \
-                       (_location.lon < lon_max) & \
-                       (_location.lat > lat_min) & \
-                       (_location.lat < lat_max)
-            for row in features.find(lambda row: in_bbox(row)):
-                # Search within this subset with a full geometry check
-                # Uses Shapely.
-                wkt = row.gis_location.wkt
-                if wkt is None:
-                    lat = row.gis_location.lat
-                    lon = row.gis_location.lon
-                    if lat is not None and lon is not None:
-                        wkt = self.latlon_to_wkt(lat, lon)
-                    else:
-                        continue
-                try:
-                    shape = wkt_loads(wkt)
-                    if shape.intersects(polygon):
-                        # Save Record
-                        output.records.append(row)
-                except shapely.geos.ReadingError:
-                    s3_debug(
-                        "Error reading wkt of location with id",
-                        value = row.id,
-                    )
-
-        return output
+        return features
 
     # -------------------------------------------------------------------------
     def get_features_in_radius(self, lat, lon, radius, tablename=None, category=None):
@@ -1644,64 +1767,35 @@ class GIS(object):
         db = current.db
         settings = current.deployment_settings
 
-        if settings.gis.spatialdb and settings.database.db_type == "postgres":
-            # Use PostGIS routine
+        if settings.get_gis_spatialdb():
+            # Use the spatial database
             # The ST_DWithin function call will automatically include a bounding box comparison that will make use of any indexes that are available on the geometries.
             # @ToDo: Support optional Category (make this a generic filter?)
 
-            import psycopg2
-            import psycopg2.extras
-
-            dbname = settings.database.database
-            username = settings.database.username
-            password = settings.database.password
-            host = settings.database.host
-            port = settings.database.port or "5432"
-
             # Convert km to degrees (since we're using the_geom not the_geog)
-            radius = math.degrees(float(radius) / RADIUS_EARTH)
+            distance = math.degrees(float(radius) / RADIUS_EARTH)
+            point = self.latlon_to_wkt(lat, lon)
+
+            locations = db.gis_location
+            query = self.spatial_query("dwithin", point, distance=distance)
+            if query is None:
+                return None
 
-            connection = psycopg2.connect("dbname=%s user=%s password=%s host=%s port=%s" % (dbname, username, password, host, port))
-            cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            info_string = "SELECT column_name, udt_name FROM information_schema.columns WHERE table_name = 'gis_location' or table_name = '%s';" % tablename
-            cursor.execute(info_string)
-            # @ToDo: Look at more optimal queries for just those fields we need
+            fields = [locations.id,
+                      locations.name,
+                      locations.level,
+                      locations.lat,
+                      locations.lon,
+                      locations.lat_min,
+                      locations.lon_min,
+                      locations.lat_max,
+                      locations.lon_max]
             if tablename:
                 # Lookup the resource
-                query_string = cursor.mogrify("SELECT * FROM gis_location, %s WHERE %s.location_id = gis_location.id and ST_DWithin (ST_GeomFromText ('POINT (%s %s)', 4326), the_geom, %s);" % (tablename, tablename, lat, lon, radius))
-            else:
-                # Lookup the raw Locations
-                query_string = cursor.mogrify("SELECT * FROM gis_location WHERE ST_DWithin (ST_GeomFromText ('POINT (%s %s)', 4326), the_geom, %s);" % (lat, lon, radius))
-
-            cursor.execute(query_string)
-            # @ToDo: Export Rows?
-            features = []
-            for record in cursor:
-                d = dict(record.items())
-                row = Storage()
-                # @ToDo: Optional support for Polygons
-                if tablename:
-                    row.gis_location = Storage()
-                    row.gis_location.id = d["id"]
-                    row.gis_location.lat = d["lat"]
-                    row.gis_location.lon = d["lon"]
-                    row.gis_location.lat_min = d["lat_min"]
-                    row.gis_location.lon_min = d["lon_min"]
-                    row.gis_location.lat_max = d["lat_max"]
-                    row.gis_location.lon_max = d["lon_max"]
-                    row[tablename] = Storage()
-                    row[tablename].id = d["id"]
-                    row[tablename].name = d["name"]
-                else:
-                    row.name = d["name"]
-                    row.id = d["id"]
-                    row.lat = d["lat"]
-                    row.lon = d["lon"]
-                    row.lat_min = d["lat_min"]
-                    row.lon_min = d["lon_min"]
-                    row.lat_max = d["lat_max"]
-                    row.lon_max = d["lon_max"]
-                features.append(row)
+                table = current.s3db[tablename]
+                query = query & (table.location_id == locations.id)
+                fields.insert(0, table.ALL)
+            features = db(query).select(*fields)
 
             return features
 
@@ -1891,42 +1985,49 @@ class GIS(object):
             - called by S3Search
         """
 
-        marker = None
-        if controller and function:
-            # Lookup marker in the gis_feature table
-            db = current.db
-            s3db = current.s3db
-            ftable = s3db.gis_layer_feature
-            ltable = s3db.gis_layer_symbology
-            mtable = s3db.gis_marker
-            try:
-                symbology_id = current.response.s3.gis.config.symbology_id
-            except:
-                # Config not initialised yet
-                config = current.gis.get_config()
-                symbology_id = config.symbology_id
-            query = (ftable.controller == controller) & \
-                    (ftable.function == function) & \
-                    (ftable.id == ltable.layer_id) & \
-                    (ltable.symbology_id == symbology_id) & \
-                    (ltable.marker_id == mtable.id)
-            marker = db(query).select(mtable.image,
-                                      mtable.height,
-                                      mtable.width,
-                                      ltable.gps_marker).first()
-            if marker:
-                _marker = marker["gis_marker"]
-                marker = dict(image=_marker.image,
-                              height=_marker.height,
-                              width=_marker.width,
-                              gps_marker=marker["gis_layer_symbology"].gps_marker
-                              )
-
-        if not marker:
-            # Default
-            marker = Marker().as_dict()
-
-        return marker
+        gis = current.gis
+        try:
+            symbology_id = current.response.s3.gis.config.symbology_id
+        except:
+            # Config not initialised yet
+            config = gis.get_config()
+            symbology_id = config.symbology_id
+
+        def lookup():
+            marker = None
+            if controller and function:
+                # Lookup marker in the gis_feature table
+                db = current.db
+                s3db = current.s3db
+                ftable = s3db.gis_layer_feature
+                ltable = s3db.gis_layer_symbology
+                mtable = s3db.gis_marker
+                query = (ftable.controller == controller) & \
+                        (ftable.function == function) & \
+                        (ftable.id == ltable.layer_id) & \
+                        (ltable.symbology_id == symbology_id) & \
+                        (ltable.marker_id == mtable.id)
+                marker = db(query).select(mtable.image,
+                                          mtable.height,
+                                          mtable.width,
+                                          ltable.gps_marker).first()
+                if marker:
+                    _marker = marker["gis_marker"]
+                    marker = dict(image=_marker.image,
+                                  height=_marker.height,
+                                  width=_marker.width,
+                                  gps_marker=marker["gis_layer_symbology"].gps_marker
+                                  )
+
+            if not marker:
+                # Default
+                marker = dict(Marker().as_dict())
+            return marker
+
+        # Cached under the config version (layers, symbologies, markers)
+        marker = gis.cache_config(("marker", controller, function,
+                                   symbology_id), lookup)
+        return Storage(marker)
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -2100,36 +2201,40 @@ class GIS(object):
                 return None
 
             if polygons:
+                tolerance = gis.get_simplify_tolerance()
                 if current.deployment_settings.get_gis_spatialdb():
                     if format == "geojson":
                         # Do the Simplify & GeoJSON direct from the DB
                         rows = db(query).select(table.id,
-                                                gtable.the_geom.st_simplify(0.001).st_asgeojson(precision=4).with_alias("geojson"))
+                                                gtable.the_geom.st_simplify(tolerance).st_asgeojson(precision=4).with_alias("geojson"))
                         for row in rows:
                             geojsons[row[tablename].id] = row["gis_location"].geojson
                     else:
                         # Do the Simplify direct from the DB
                         rows = db(query).select(table.id,
-                                                gtable.the_geom.st_simplify(0.001).st_astext().with_alias("wkt"))
+                                                gtable.the_geom.st_simplify(tolerance).st_astext().with_alias("wkt"))
                         for row in rows:
                             wkts[row[tablename].id] = row["gis_location"].wkt
                 else:
                     rows = db(query).select(table.id,
-                                            gtable.wkt)
+                                            gtable.id)
+                    # Use the pre-simplified polygons to reduce download size
+                    # (& also to work around the recursion limit in libxslt
+                    # http://blog.gmane.org/gmane.comp.python.lxml.devel/day=20120309)
                     if format == "geojson":
-                        for row in rows:
-                            # Simplify the polygon to reduce download size
-                            geojson = gis.simplify(row["gis_location"].wkt, output="geojson")
-                            if geojson:
-                                geojsons[row[tablename].id] = geojson
+                        output = geojsons
+                        simplify_format = "geojson"
                     else:
-                        for row in rows:
-                            # Simplify the polygon to reduce download size
-                            # & also to work around the recursion limit in libxslt
-                            # http://blog.gmane.org/gmane.comp.python.lxml.devel/day=20120309
-                            wkt = gis.simplify(row["gis_location"].wkt)
-                            if wkt:
-                                wkts[row[tablename].id] = wkt
+                        output = wkts
+                        simplify_format = "wkt"
+                    simplified = gis.get_simplified([row["gis_location"].id
+                                                     for row in rows],
+                                                    tolerance=tolerance,
+                                                    output=simplify_format)
+                    for row in rows:
+                        geometry = simplified.get(row["gis_location"].id, None)
+                        if geometry:
+                            output[row[tablename].id] = geometry
 
             else:
                 # Points
@@ -2292,19 +2397,24 @@ class GIS(object):
                 (table.location_id == gtable.id)
 
         geojsons = {}
+        gis = current.gis
+        tolerance = gis.get_simplify_tolerance()
         if current.deployment_settings.get_gis_spatialdb():
             # Do the Simplify & GeoJSON direct from the DB
             rows = db(query).select(table.id,
-                                    gtable.the_geom.st_simplify(0.001).st_asgeojson(precision=4).with_alias("geojson"))
+                                    gtable.the_geom.st_simplify(tolerance).st_asgeojson(precision=4).with_alias("geojson"))
             for row in rows:
                 geojsons[row[tablename].id] = row["gis_location"].geojson
         else:
             rows = db(query).select(table.id,
-                                    gtable.wkt)
-            gis = current.gis
+                                    gtable.id)
+            # Use the pre-simplified polygons to reduce download size
+            simplified = gis.get_simplified([row["gis_location"].id
+                                             for row in rows],
+                                            tolerance=tolerance,
+                                            output="geojson")
             for row in rows:
-                # Simplify the polygon to reduce download size
-                geojson = gis.simplify(row["gis_location"].wkt, output="geojson")
+                geojson = simplified.get(row["gis_location"].id, None)
                 if geojson:
                     geojsons[row[tablename].id] = geojson
 
@@ -2570,9 +2680,8 @@ class GIS(object):
 
         db = current.db
         s3db = current.s3db
-        cache = s3db.cache
         table = s3db.gis_location
-        table = s3db.gis_location_tag
+        ttable = s3db.gis_location_tag
 
         if level == "L1":
             layer = {
@@ -2809,109 +2918,58 @@ class GIS(object):
         parentSourceCodeField = layer["parentSourceCodeField"]
         parentLevel = layer["parent"]
         parentEdenCodeField = layer["parentEdenCodeField"]
-        parentCodeQuery = (ttable.tag == parentEdenCodeField)
-        count = 0
-        for row in rows:
+
+        importer = S3LocationImporter("gadm1_%s" % level,
+                                      level,
+                                      edenCodeField,
+                                      parent_level=parentLevel,
+                                      parent_tag=parentEdenCodeField)
+        if countries:
+            # Skip the countries which we're not interested in
+            query = (ttable.tag == "ISO2") & \
+                    (ttable.value.belongs(countries)) & \
+                    (table.id == ttable.location_id) & \
+                    (table.level == "L0")
+            parent_ids = [row.id for row in db(query).select(table.id)]
+            if level == "L2":
+                query = (table.level == "L1") & \
+                        (table.parent.belongs(parent_ids))
+                parent_ids = [row.id for row in db(query).select(table.id)]
+            importer.restrict(parent_ids)
+
+        for row in importer.resume(rows):
             # Read Attributes
-            feat = lyr[count]
+            feat = lyr[importer.position - 1]
 
-            parentCode = feat.GetField(parentSourceCodeField)
-            query = (table.level == parentLevel) & \
-                    parentCodeQuery & \
-                    (ttable.value == parentCode)
-            parent = db(query).select(table.id,
-                                      ttable.value,
-                                      limitby=(0, 1),
-                                      cache=cache).first()
-            if not parent:
-                # Skip locations for which we don't have a valid parent
-                s3_debug("Skipping - cannot find parent with key: %s, value: %s" % (parentEdenCodeField, parentCode))
-                count += 1
+            geom = feat.GetGeometryRef()
+            if geom is None:
+                s3_debug("No geometry\n")
                 continue
 
-            if countries:
-                # Skip the countries which we're not interested in
-                if level == "L1":
-                    if parent["gis_location_tag"].value not in countries:
-                        #s3_debug("Skipping %s as not in countries list" % parent["gis_location_tag"].value)
-                        count += 1
-                        continue
-                else:
-                    # Check grandparent
-                    country = self.get_parent_country(parent.id, key_type="code")
-                    if country not in countries:
-                        count += 1
-                        continue
+            parentCode = feat.GetField(parentSourceCodeField)
 
             # This is got from CSV in order to be able to handle the encoding
             name = row.pop(nameField)
-            name.encode("utf8")
 
             code = feat.GetField(sourceCodeField)
-            area = feat.GetField("Shape_Area")
+            #area = feat.GetField("Shape_Area")
 
-            geom = feat.GetGeometryRef()
-            if geom is not None:
-                if geom.GetGeometryType() == ogr.wkbPoint:
-                    lat = geom.GetX()
-                    lon = geom.GetY()
-                    id = table.insert(name=name,
-                                      level=level,
-                                      gis_feature_type=1,
-                                      lat=lat,
-                                      lon=lon,
-                                      parent=parent.id)
-                    ttable.insert(location_id = id,
-                                  tag = edenCodeField,
-                                  value = code)
-                    # ttable.insert(location_id = id,
-                                  # tag = "area",
-                                  # value = area)
-                else:
-                    wkt = geom.ExportToWkt()
-                    if wkt.startswith("LINESTRING"):
-                        gis_feature_type = 2
-                    elif wkt.startswith("POLYGON"):
-                        gis_feature_type = 3
-                    elif wkt.startswith("MULTIPOINT"):
-                        gis_feature_type = 4
-                    elif wkt.startswith("MULTILINESTRING"):
-                        gis_feature_type = 5
-                    elif wkt.startswith("MULTIPOLYGON"):
-                        gis_feature_type = 6
-                    elif wkt.startswith("GEOMETRYCOLLECTION"):
-                        gis_feature_type = 7
-                    id = table.insert(name=name,
-                                      level=level,
-                                      gis_feature_type=gis_feature_type,
-                                      wkt=wkt,
-                                      parent=parent.id)
-                    ttable.insert(location_id = id,
-                                  tag = edenCodeField,
-                                  value = code)
-                    # ttable.insert(location_id = id,
-                                  # tag = "area",
-                                  # value = area)
+            if geom.GetGeometryType() == ogr.wkbPoint:
+                importer.add(code, name,
+                             parent_code=parentCode,
+                             lat=geom.GetY(),
+                             lon=geom.GetX())
             else:
-                s3_debug("No geometry\n")
+                importer.add(code, name,
+                             parent_code=parentCode,
+                             wkt=geom.ExportToWkt())
 
-            count += 1
+        count = importer.finish()
+        s3_debug("%s Locations imported" % count)
 
         # Close the shapefile
         ds.Destroy()
 
-        db.commit()
-
-        s3_debug("Updating Location Tree...")
-        try:
-            self.update_location_tree()
-        except MemoryError:
-            # If doing all L2s, it can break memory limits
-            # @ToDo: Amend function to do in chunks
-            s3_debug("Memory error when trying to update_location_tree()!")
-
-        db.commit()
-
         # Revert back to the working directory as before.
         os.chdir(old_working_directory)
 
@@ -3173,103 +3231,71 @@ class GIS(object):
             finally:
                 fc = "PPL"
 
-        deleted = (table.deleted == False)
-        query = deleted & (table.level == parent_level)
-        # Do the DB query once (outside loop)
-        all_parents = db(query).select(table.wkt,
-                                       table.lon_min,
-                                       table.lon_max,
-                                       table.lat_min,
-                                       table.lat_max,
-                                       table.id)
-        if not all_parents:
-            # No locations in the parent level found
-            # - use the one higher instead
-            parent_level = "L" + str(int(parent_level[1:]) + 1)
-            query = deleted & (table.level == parent_level)
-            all_parents = db(query).select(table.wkt,
-                                           table.lon_min,
-                                           table.lon_max,
-                                           table.lat_min,
-                                           table.lat_max,
-                                           table.id)
+        # Parents are identified by their Geonames admin codes
+        # (country code for L0)
+        depth = int(parent_level[1:])
+        if depth == 0:
+            parent_tag = "ISO2"
+        else:
+            parent_tag = "geonames_code"
+        importer = S3LocationImporter("geonames_%s_%s" % (country, level),
+                                      level,
+                                      "geonames",
+                                      parent_level=parent_level,
+                                      parent_tag=parent_tag)
 
         # Parse File
-        current_row = 0
-        for line in f:
-            current_row += 1
+        for line in importer.resume(f):
             # Format of file: http://download.geonames.org/export/dump/readme.txt
-            geonameid,
-            name,
-            asciiname,
-            alternatenames,
-            lat,
-            lon,
-            feature_class,
-            feature_code,
-            country_code,
-            cc2,
-            admin1_code,
-            admin2_code,
-            admin3_code,
-            admin4_code,
-            population,
-            elevation,
-            gtopo30,
-            timezone,
-            modification_date = line.split("\t")
-
-            if feature_code == fc:
-                # Add WKT
-                lat = float(lat)
-                lon = float(lon)
-                wkt = self.latlon_to_wkt(lat, lon)
-
-                shape = shapely.geometry.point.Point(lon, lat)
-
-                # Add Bounds
-                lon_min = lon_max = lon
-                lat_min = lat_max = lat
-
-                # Locate Parent
-                parent = ""
-                # 1st check for Parents whose bounds include this location (faster)
-                def in_bbox(row):
-                    return (row.lon_min < lon_min) & \
-                           (row.lon_max > lon_max) & \
-                           (row.lat_min < lat_min) & \
-                           (row.lat_max > lat_max)
-                for row in all_parents.find(lambda row: in_bbox(row)):
-                    # Search within this subset with a full geometry check
-                    # Uses Shapely.
-                    # @ToDo provide option to use PostGIS/Spatialite
-                    try:
-                        parent_shape = wkt_loads(row.wkt)
-                        if parent_shape.intersects(shape):
-                            parent = row.id
-                            # Should be just a single parent
-                            break
-                    except shapely.geos.ReadingError:
-                        s3_debug("Error reading wkt of location with id", row.id)
-
-                # Add entry to database
-                new_id = table.insert(name=name,
-                                      level=level,
-                                      parent=parent,
-                                      lat=lat,
-                                      lon=lon,
-                                      wkt=wkt,
-                                      lon_min=lon_min,
-                                      lon_max=lon_max,
-                                      lat_min=lat_min,
-                                      lat_max=lat_max)
-                ttable.insert(location_id=new_id,
-                              tag="geonames",
-                              value=geonames_id)
-            else:
+            try:
+                geonameid, \
+                name, \
+                asciiname, \
+                alternatenames, \
+                lat, \
+                lon, \
+                feature_class, \
+                feature_code, \
+                country_code, \
+                cc2, \
+                admin1_code, \
+                admin2_code, \
+                admin3_code, \
+                admin4_code, \
+                population, \
+                elevation, \
+                gtopo30, \
+                timezone, \
+                modification_date = line.rstrip("\n").split("\t")
+            except ValueError:
+                s3_debug("Skipping malformed line %s" % importer.position)
+                continue
+
+            if feature_code != fc:
                 continue
 
-        s3_debug("All done!")
+            admin_codes = [country_code,
+                           admin1_code,
+                           admin2_code,
+                           admin3_code,
+                           admin4_code]
+            parent_code = ".".join(admin_codes[:depth + 1])
+            tags = []
+            if fc != "PPL":
+                # Allow lower levels to find this as their parent
+                tags.append(("geonames_code",
+                             ".".join(admin_codes[:depth + 2])))
+
+            importer.add(geonameid, name,
+                         parent_code=parent_code,
+                         lat=float(lat),
+                         lon=float(lon),
+                         tags=tags)
+
+        count = importer.finish()
+        f.close()
+
+        s3_debug("All done: %s Locations imported" % count)
         return
 
     # -------------------------------------------------------------------------
@@ -3345,6 +3371,10 @@ class GIS(object):
             http://eden.sahanafoundation.org/wiki/HaitiGISToDo#HierarchicalTrees
             Do a lazy update of a database that does not have location paths.
             For convenience of get_parents, return the path.
+
+            If the path of the location changes, then the paths of its
+            descendants get updated too. Without location_id, the whole tree
+            is rebuilt (see rebuild_location_tree).
         """
 
         db = current.db
@@ -3374,22 +3404,29 @@ class GIS(object):
             else:
                 path = str(location_id)
 
-            db(table.id == location_id).update(path=path)
+            query = (table.id == location_id)
+            location = db(query).select(table.path, limitby=(0, 1)).first()
+            if location and location.path != path:
+                db(query).update(path=path)
+                if location.path:
+                    # Moved within the hierarchy: update the subtree
+                    self._update_subtrees({location_id: path})
 
             return path
 
         else:
             # Do the whole database
-            query = (table.id > 0)
+            self.rebuild_location_tree()
+
+            # Also do the Bounds/Centroids/WKT where these are missing
+            query = (table.deleted != True) & \
+                    ((table.lat_min == None) | (table.lat == None))
             features = db(query).select(table.id,
                                         table.gis_feature_type,
                                         table.lat,
                                         table.lon,
-                                        table.wkt,
-                                        table.parent)
+                                        table.wkt)
             for feature in features:
-                self.update_location_tree(feature.id, feature.parent)
-                # Also do the Bounds/Centroids/WKT
                 form = Storage()
                 form.vars = feature
                 form.errors = Storage()
@@ -3404,6 +3441,156 @@ class GIS(object):
                                                       lat_min = _vars.lat_min,
                                                       lon_min = _vars.lon_min,
                                                       lon_max = _vars.lon_max)
+                    # Also the pre-simplified Geometries
+                    self.update_simplified(feature.id, _vars.wkt)
+
+    # -------------------------------------------------------------------------
+    def rebuild_location_tree(self, location_ids=None):
+        """
+            Bulk-(re)builds the materialized paths of the Location hierarchy
+
+            Computes all paths in a single pass over the hierarchy (in the
+            database using a recursive query on PostgreSQL, otherwise in
+            memory) and writes back only those which have changed, in
+            batches of PATH_BATCH_SIZE.
+
+            @param location_ids: only rebuild the subtrees of these Locations
+                                 (e.g. those whose parent has changed),
+                                 default is to rebuild the whole tree
+        """
+
+        db = current.db
+        s3db = current.s3db
+        table = s3db.gis_location
+
+        if location_ids is not None:
+            # Compute the paths of the subtree roots from their parents
+            query = (table.id.belongs(location_ids))
+            rows = db(query).select(table.id, table.parent)
+            roots = {}
+            for row in rows:
+                roots[row.id] = self.update_location_tree(row.id, row.parent)
+            self._update_subtrees(roots)
+            return
+
+        if current.deployment_settings.get_database_type() == "postgres":
+            # Compute & update all paths in the database
+            tablename = table._tablename
+            sql = \
+"""WITH RECURSIVE tree(id, path) AS (
+SELECT id, CAST(id AS VARCHAR(256)) FROM %(table)s WHERE parent IS NULL
+UNION ALL
+SELECT l.id, CAST(tree.path || '/' || l.id AS VARCHAR(256))
+FROM %(table)s AS l, tree WHERE l.parent = tree.id)
+UPDATE %(table)s SET path=tree.path FROM tree
+WHERE %(table)s.id=tree.id AND %(table)s.path IS DISTINCT FROM tree.path;""" % \
+                dict(table=tablename)
+            db.executesql(sql)
+            return
+
+        # Load the hierarchy
+        rows = db(table.id > 0).select(table.id,
+                                       table.parent,
+                                       table.path,
+                                       cacheable=True)
+        paths = {}
+        for row in rows:
+            paths[row.id] = row.path
+        children = {}
+        roots = []
+        for row in rows:
+            parent = row.parent
+            if parent and parent in paths:
+                if parent in children:
+                    children[parent].append(row.id)
+                else:
+                    children[parent] = [row.id]
+            else:
+                roots.append(row.id)
+        rows = None
+
+        # Compute the paths top-down
+        updates = {}
+        queue = [(location_id, str(location_id)) for location_id in roots]
+        seen = set()
+        while queue:
+            location_id, path = queue.pop()
+            seen.add(location_id)
+            if paths[location_id] != path:
+                updates[location_id] = path
+            for child in children.get(location_id, ()):
+                queue.append((child, "%s/%s" % (path, child)))
+
+        if len(seen) < len(paths):
+            s3_debug("Location hierarchy contains cycles, %s locations skipped" % \
+                     (len(paths) - len(seen)))
+
+        self._update_paths(updates)
+        return
+
+    # -------------------------------------------------------------------------
+    def _update_subtrees(self, roots):
+        """
+            Helper to update the paths of the descendants of Locations
+            level-by-level
+
+            @param roots: dict {location_id: path} of the subtree roots
+        """
+
+        db = current.db
+        table = current.s3db.gis_location
+
+        updates = {}
+        seen = set(roots.keys())
+        frontier = roots
+        while frontier:
+            query = (table.parent.belongs(frontier.keys()))
+            rows = db(query).select(table.id,
+                                    table.parent,
+                                    table.path)
+            level = {}
+            for row in rows:
+                location_id = row.id
+                if location_id in seen:
+                    # Cycle
+                    continue
+                seen.add(location_id)
+                path = "%s/%s" % (frontier[row.parent], location_id)
+                if row.path != path:
+                    updates[location_id] = path
+                level[location_id] = path
+            frontier = level
+
+        self._update_paths(updates)
+        return
+
+    # -------------------------------------------------------------------------
+    def _update_paths(self, updates):
+        """
+            Helper to write back materialized paths in batches
+
+            @param updates: dict {location_id: path}
+        """
+
+        if not updates:
+            return
+
+        db = current.db
+        tablename = current.s3db.gis_location._tablename
+
+        batch_size = self.PATH_BATCH_SIZE
+        location_ids = updates.keys()
+        for i in xrange(0, len(location_ids), batch_size):
+            batch = location_ids[i:i + batch_size]
+            # Paths consist of IDs only, so can be embedded safely
+            cases = " ".join(["WHEN %d THEN '%s'" % (location_id,
+                                                     updates[location_id])
+                              for location_id in batch])
+            sql = "UPDATE %s SET path=CASE id %s END WHERE id IN (%s);" % \
+                  (tablename, cases, ",".join([str(location_id)
+                                               for location_id in batch]))
+            db.executesql(sql)
+        return
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -3498,6 +3685,9 @@ class GIS(object):
                 (table.lat_max >= lat_min) & \
                 (table.lon_min <= lon_max) & \
                 (table.lon_max >= lon_min)
+        # Use the Location Index, if enabled
+        query = S3LocationIndex.restrict(query,
+                                         lon_min, lat_min, lon_max, lat_max)
         return query
 
     # -------------------------------------------------------------------------
@@ -3512,56 +3702,68 @@ class GIS(object):
                                               lat_max)).select()
 
     # -------------------------------------------------------------------------
-    def _get_features_by_shape(self, shape):
+    def get_spatial_backend(self):
+        """
+            Returns the spatial query engine for gis_location:
+                - S3SpatialDBBackend if a spatial database is available
+                - S3SpatialBackend (using Shapely) otherwise
+                - None if neither is available
         """
-            Returns Rows of locations which intersect the given shape.
 
-            Relies on Shapely for wkt parsing and intersection.
-            @ToDo: provide an option to use PostGIS/Spatialite
+        backend = self.spatial_backend
+        if backend is None:
+            if current.deployment_settings.get_gis_spatialdb():
+                backend = S3SpatialDBBackend()
+            elif SHAPELY:
+                backend = S3SpatialBackend()
+            self.spatial_backend = backend
+        return backend
+
+    # -------------------------------------------------------------------------
+    def spatial_query(self, op, shape, distance=None):
         """
+            Returns a query for all Locations which match a spatial predicate,
+            or None if no spatial query engine is available
 
-        db = current.db
-        s3db = current.s3db
-        table = s3db.gis_location
-        in_bbox = self.query_features_by_bbox(*shape.bounds)
-        has_wkt = (table.wkt != None) & (table.wkt != "")
+            @param op: the predicate, "intersects", "within" or "dwithin"
+            @param shape: the shape, either as Shapely geometry or as WKT
+            @param distance: the distance for "dwithin" (in degrees)
+        """
 
-        for loc in db(in_bbox & has_wkt).select():
-            try:
-                location_shape = wkt_loads(loc.wkt)
-                if location_shape.intersects(shape):
-                    yield loc
-            except shapely.geos.ReadingError:
-                s3_debug("Error reading wkt of location with id", loc.id)
+        backend = self.get_spatial_backend()
+        if backend is None:
+            s3_debug("No spatial query engine available: install Shapely or configure a spatial database")
+            return None
+        return backend.query(op, shape, distance=distance)
 
     # -------------------------------------------------------------------------
-    def _get_features_by_latlon(self, lat, lon):
+    def get_features_by_shape(self, shape):
         """
-            Returns a generator of locations whose shape intersects the given LatLon.
+            Returns Rows of locations which intersect the given shape.
 
-            Relies on Shapely.
-            @todo: provide an option to use PostGIS/Spatialite
+            @param shape: the shape, either as Shapely geometry or as WKT
         """
 
-        point = shapely.geometry.point.Point(lon, lat)
-        return self._get_features_by_shape(point)
+        query = self.spatial_query("intersects", shape)
+        if query is None:
+            return None
+        return current.db(query).select()
 
     # -------------------------------------------------------------------------
-    def _get_features_by_feature(self, feature):
+    def get_features_by_latlon(self, lat, lon):
         """
-            Returns all Locations whose geometry intersects the given feature.
-
-            Relies on Shapely.
-            @ToDo: provide an option to use PostGIS/Spatialite
+            Returns Rows of locations whose shape intersects the given LatLon.
         """
-        shape = wkt_loads(feature.wkt)
-        return self.get_features_by_shape(shape)
+
+        return self.get_features_by_shape(self.latlon_to_wkt(lat, lon))
 
     # -------------------------------------------------------------------------
-    if SHAPELY:
-        get_features_by_shape = _get_features_by_shape
-        get_features_by_latlon = _get_features_by_latlon
-        get_features_by_feature = _get_features_by_feature
+    def get_features_by_feature(self, feature):
+        """
+            Returns all Locations whose geometry intersects the given feature.
+        """
+
+        return self.get_features_by_shape(feature.wkt)
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -3643,36 +3845,238 @@ class GIS(object):
         return output
 
     # -------------------------------------------------------------------------
-    def show_map( self,
-                  height = None,
-                  width = None,
-                  bbox = {},
-                  lat = None,
-                  lon = None,
-                  zoom = None,
-                  projection = None,
-                  add_feature = False,
-                  add_feature_active = False,
-                  add_polygon = False,
-                  add_polygon_active = False,
-                  features = [],
-                  feature_queries = [],
-                  feature_resources = [],
-                  wms_browser = {},
-                  catalogue_layers = False,
-                  legend = False,
-                  toolbar = False,
-                  search = False,
-                  googleEarth = False,
-                  googleStreetview = False,
-                  mouse_position = "normal",
-                  print_tool = {},
-                  mgrs = {},
-                  window = False,
-                  window_hide = False,
-                  closable = True,
-                  maximizable = True,
-                  collapsed = False,
+    def get_simplify_tolerance(self):
+        """
+            Returns the tolerance (in degrees) to simplify polygons with for
+            the current map request: the coarsest pre-simplified tolerance
+            which doesn't exceed the size of a pixel, based on the width of
+            the "bbox" URL variable (which the map client sends for
+            BBOX-strategy layers)
+        """
+
+        tolerances = self.SIMPLIFY_TOLERANCES
+
+        pixel = None
+        bbox = current.request.get_vars.get("bbox", None)
+        if bbox:
+            try:
+                lon_min, lat_min, lon_max, lat_max = bbox.split(",")
+                pixel = abs(float(lon_max) - float(lon_min)) / \
+                        self.SIMPLIFY_BBOX_PIXELS
+            except ValueError:
+                pass
+        if pixel is None:
+            return self.SIMPLIFY_DEFAULT
+
+        for tolerance in tolerances:
+            if tolerance <= pixel:
+                return tolerance
+        return tolerances[-1]
+
+    # -------------------------------------------------------------------------
+    def update_simplified(self, location_id, wkt=None, previous=None):
+        """
+            (Re-)generates the pre-simplified geometries of a Location
+
+            Called onaccept of gis_location and by update_location_tree(),
+            not needed with a spatial database (which simplifies on the fly)
+
+            Only polygons and lines have pre-simplified geometries, so
+            other locations are skipped unless they may have replaced a
+            polygon or line.
+
+            @param location_id: the gis_location record ID
+            @param wkt: the WKT of the location (looked up if not given)
+            @param previous: the WKT of the location before the update
+                             ("" for new locations, None if not known)
+
+            @returns: dict {tolerance: (wkt, geojson)}
+        """
+
+        if not SHAPELY or current.deployment_settings.get_gis_spatialdb():
+            return {}
+
+        db = current.db
+        s3db = current.s3db
+
+        if wkt is None:
+            gtable = s3db.gis_location
+            query = (gtable.id == location_id)
+            row = db(query).select(gtable.wkt, limitby=(0, 1)).first()
+            if row:
+                wkt = row.wkt
+
+        simplify = self.simplifiable(wkt)
+        if simplify or previous is None or self.simplifiable(previous):
+            table = s3db.gis_location_simplified
+            db(table.location_id == location_id).delete()
+        if not simplify:
+            # Nothing to simplify
+            return {}
+
+        return self._store_simplified(location_id, wkt)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def simplifiable(wkt):
+        """
+            Check whether a WKT is a geometry which gets pre-simplified,
+            i.e. a polygon or a line (or a collection)
+
+            @param wkt: the WKT
+        """
+
+        if not wkt:
+            return False
+        return wkt.lstrip().upper().startswith(("POLYGON",
+                                                "MULTIPOLYGON",
+                                                "LINESTRING",
+                                                "MULTILINESTRING",
+                                                "GEOMETRYCOLLECTION"))
+
+    # -------------------------------------------------------------------------
+    def _store_simplified(self, location_id, wkt):
+        """
+            Generates and stores the pre-simplified geometries of a Location
+            (without removing existing ones)
+
+            If the WKT can not be read, empty geometries are stored for all
+            tolerances, so that this isn't attempted again until the Location
+            gets updated.
+
+            @param location_id: the gis_location record ID
+            @param wkt: the WKT of the location (not a POINT)
+
+            @returns: dict {tolerance: (wkt, geojson)}
+        """
+
+        table = current.s3db.gis_location_simplified
+        insert = table.insert
+
+        try:
+            shape = wkt_loads(wkt)
+        except:
+            s3_debug("Error reading wkt of location with id", location_id)
+            for tolerance in self.SIMPLIFY_TOLERANCES:
+                insert(location_id = location_id,
+                       tolerance = tolerance,
+                       wkt = None,
+                       geojson = None)
+            return {}
+
+        from ..geojson import dumps
+        simplified = {}
+        for tolerance in self.SIMPLIFY_TOLERANCES:
+            simple = shape.simplify(tolerance, True)
+            _wkt = simple.to_wkt()
+            # Compact Encoding
+            _geojson = dumps(simple, separators=(",", ":"))
+            insert(location_id = location_id,
+                   tolerance = tolerance,
+                   wkt = _wkt,
+                   geojson = _geojson)
+            simplified[tolerance] = (_wkt, _geojson)
+        return simplified
+
+    # -------------------------------------------------------------------------
+    def get_simplified(self, location_ids, tolerance=None, output="wkt"):
+        """
+            Returns the pre-simplified geometries of Locations, generating
+            them where missing
+
+            @param location_ids: list of gis_location record IDs
+            @param tolerance: the tolerance, defaults to get_simplify_tolerance()
+            @param output: "wkt" or "geojson"
+
+            @returns: dict {location_id: geometry}
+        """
+
+        if tolerance is None:
+            tolerance = self.get_simplify_tolerance()
+        if tolerance not in self.SIMPLIFY_TOLERANCES:
+            raise SyntaxError("No pre-simplified geometries for tolerance %s" % tolerance)
+        if output not in ("wkt", "geojson"):
+            raise SyntaxError("Invalid output format: %s" % output)
+
+        db = current.db
+        s3db = current.s3db
+        table = s3db.gis_location_simplified
+
+        location_ids = list(set(location_ids))
+        geometries = {}
+        if not location_ids:
+            return geometries
+
+        query = (table.location_id.belongs(location_ids)) & \
+                (table.tolerance == tolerance)
+        rows = db(query).select(table.location_id, table[output])
+        found = set()
+        for row in rows:
+            location_id = row.location_id
+            found.add(location_id)
+            geometry = row[output]
+            if geometry:
+                # Empty if the WKT could not be read
+                geometries[location_id] = geometry
+
+        missing = [i for i in location_ids if i not in found]
+        if missing:
+            store = SHAPELY and \
+                    not current.deployment_settings.get_gis_spatialdb()
+            gtable = s3db.gis_location
+            query = (gtable.id.belongs(missing))
+            rows = db(query).select(gtable.id, gtable.wkt)
+            index = 1 if output == "geojson" else 0
+            for row in rows:
+                wkt = row.wkt
+                if not wkt:
+                    continue
+                if store and not wkt.startswith("POINT"):
+                    simplified = self._store_simplified(row.id, wkt)
+                    if tolerance not in simplified:
+                        # Invalid WKT
+                        continue
+                    geometry = simplified[tolerance][index]
+                else:
+                    # Points are not stored, or no Shapely
+                    geometry = self.simplify(wkt, tolerance=tolerance,
+                                             output=output)
+                if geometry:
+                    geometries[row.id] = geometry
+
+        return geometries
+
+    # -------------------------------------------------------------------------
+    def show_map( self,
+                  height = None,
+                  width = None,
+                  bbox = {},
+                  lat = None,
+                  lon = None,
+                  zoom = None,
+                  projection = None,
+                  add_feature = False,
+                  add_feature_active = False,
+                  add_polygon = False,
+                  add_polygon_active = False,
+                  features = [],
+                  feature_queries = [],
+                  feature_resources = [],
+                  wms_browser = {},
+                  catalogue_layers = False,
+                  legend = False,
+                  toolbar = False,
+                  search = False,
+                  googleEarth = False,
+                  googleStreetview = False,
+                  mouse_position = "normal",
+                  print_tool = {},
+                  mgrs = {},
+                  window = False,
+                  window_hide = False,
+                  closable = True,
+                  maximizable = True,
+                  collapsed = False,
                   location_selector = False,
                   plugins = None,
                 ):
@@ -4723,6 +5127,725 @@ S3.gis.show_map();""" % ready
 
         return html
 
+# =============================================================================
+class S3LocationImporter(object):
+    """
+        Bulk importer for Locations from geodata sources (GADM, Geonames)
+
+        - resolves parents through an in-memory index of their source codes
+          (with a spatial lookup as fallback)
+        - computes bounds, centroids and paths in the same pass
+        - inserts the Locations and their tags in batches, and commits
+          after every batch
+        - records a checkpoint after every batch, so that an interrupted
+          import can be resumed (Locations which have already been imported
+          are skipped by their source code)
+    """
+
+    BATCH_SIZE = 500
+
+    def __init__(self, name, level, tag,
+                 parent_level=None,
+                 parent_tag=None,
+                 batch_size=None):
+        """
+            Constructor
+
+            @param name: a unique name for the import (for the checkpoint)
+            @param level: the level of the imported Locations
+            @param tag: the gis_location_tag to store the source code of
+                        the imported Locations in
+            @param parent_level: the level of the parents
+            @param parent_tag: the gis_location_tag holding the source code
+                               of the parents
+            @param batch_size: the number of Locations per batch
+        """
+
+        s3db = current.s3db
+        self.table = s3db.gis_location
+        self.ttable = s3db.gis_location_tag
+
+        self.level = level
+        self.tag = tag
+        self.parent_level = parent_level
+        self.batch_size = batch_size or self.BATCH_SIZE
+
+        # Source code => (id, path) of the potential parents
+        if parent_tag:
+            self.parents = self.index(parent_tag, parent_level)
+        else:
+            self.parents = {}
+        # Source codes of the Locations imported before
+        self.imported = set(self.index(tag, level).keys())
+
+        # Restrict to children of these parents (see restrict())
+        self.parent_ids = None
+        # Source codes of the parents excluded by restrict()
+        self.excluded = set()
+
+        self.buffer = []
+        self.count = 0
+
+        # Resume from the checkpoint
+        folder = os.path.join(current.request.folder, "cache")
+        self.checkpoint = os.path.join(folder, "import_%s.checkpoint" % name)
+        self.position = 0
+        self.start = 0
+        if os.path.exists(self.checkpoint):
+            try:
+                f = open(self.checkpoint, "r")
+                self.start = int(f.read().strip())
+                f.close()
+                s3_debug("Resuming import %s after item %s" % (name, self.start))
+            except (IOError, ValueError):
+                pass
+
+    # -------------------------------------------------------------------------
+    def index(self, tag, level):
+        """
+            Builds an index of Locations by their source code
+
+            @param tag: the gis_location_tag holding the source code
+            @param level: the level of the Locations
+
+            @returns: dict {code: (id, path)}
+        """
+
+        db = current.db
+        table = self.table
+        ttable = self.ttable
+
+        query = (ttable.tag == tag) & \
+                (ttable.deleted != True) & \
+                (table.id == ttable.location_id) & \
+                (table.level == level) & \
+                (table.deleted != True)
+        rows = db(query).select(ttable.value,
+                                table.id,
+                                table.parent,
+                                table.path,
+                                cacheable=True)
+        index = {}
+        gis = current.gis
+        for row in rows:
+            location = row.gis_location
+            path = location.path
+            if not path:
+                path = gis.update_location_tree(location.id, location.parent)
+            index[row.gis_location_tag.value] = (location.id, path)
+        return index
+
+    # -------------------------------------------------------------------------
+    def restrict(self, parent_ids):
+        """
+            Restricts the import to children of the given parents
+
+            @param parent_ids: the gis_location record IDs of the parents
+        """
+
+        parent_ids = set(parent_ids)
+        parents = self.parents
+        excluded = self.excluded
+        for code, parent in parents.items():
+            if parent[0] not in parent_ids:
+                del parents[code]
+                excluded.add(code)
+        self.parent_ids = parent_ids
+
+    # -------------------------------------------------------------------------
+    def resume(self, items):
+        """
+            Iterates over the source items, skipping those which have been
+            processed before the checkpoint
+
+            @param items: iterable of source items
+        """
+
+        start = self.start
+        position = 0
+        for item in items:
+            position += 1
+            if position <= start:
+                continue
+            self.position = position
+            yield item
+
+    # -------------------------------------------------------------------------
+    def locate_parent(self, wkt):
+        """
+            Finds the parent of a Location by its geometry
+
+            @param wkt: the WKT of the Location
+            @returns: tuple (id, path), or None if not found
+        """
+
+        parent_level = self.parent_level
+        if not parent_level or not wkt:
+            return None
+        query = current.gis.spatial_query("intersects", wkt)
+        if query is None:
+            return None
+        table = self.table
+        query &= (table.level == parent_level)
+        if self.parent_ids is not None:
+            query &= (table.id.belongs(self.parent_ids))
+        row = current.db(query).select(table.id,
+                                       table.parent,
+                                       table.path,
+                                       limitby=(0, 1)).first()
+        if not row:
+            return None
+        path = row.path
+        if not path:
+            path = current.gis.update_location_tree(row.id, row.parent)
+        return (row.id, path)
+
+    # -------------------------------------------------------------------------
+    def add(self, code, name,
+            parent_code=None,
+            wkt=None,
+            lat=None,
+            lon=None,
+            tags=None):
+        """
+            Adds a Location to the import
+
+            @param code: the source code of the Location
+            @param name: the name of the Location
+            @param parent_code: the source code of the parent
+            @param wkt: the geometry as WKT
+            @param lat: the latitude (if no WKT)
+            @param lon: the longitude (if no WKT)
+            @param tags: list of tuples (tag, value) of additional tags
+
+            @returns: True if the Location has been added, otherwise False
+        """
+
+        if code in self.imported:
+            # Imported before
+            return False
+
+        if parent_code in self.excluded:
+            # Known parent, but not included in the import
+            return False
+
+        parent = self.parents.get(parent_code, None)
+        if parent is None:
+            if not wkt and lat is not None and lon is not None:
+                parent = self.locate_parent(GIS.latlon_to_wkt(lat, lon))
+            else:
+                parent = self.locate_parent(wkt)
+            if parent is None:
+                s3_debug("Skipping %s - cannot find parent %s" % (code, parent_code))
+                return False
+
+        # Bounds & Centroid
+        form = Storage(vars=Storage(wkt=wkt, lat=lat, lon=lon),
+                       errors=Storage())
+        GIS.wkt_centroid(form)
+        if form.errors:
+            s3_debug("Skipping %s - invalid geometry" % code)
+            return False
+        vars = form.vars
+
+        record = dict(name=name,
+                      level=self.level,
+                      parent=parent[0],
+                      gis_feature_type=vars.gis_feature_type,
+                      wkt=vars.wkt,
+                      lat=vars.lat,
+                      lon=vars.lon,
+                      lat_min=vars.lat_min,
+                      lat_max=vars.lat_max,
+                      lon_min=vars.lon_min,
+                      lon_max=vars.lon_max)
+        if "the_geom" in vars:
+            record["the_geom"] = vars.the_geom
+        tags = [(self.tag, code)] + (tags or [])
+        self.buffer.append((record, parent[1], tags))
+        self.imported.add(code)
+
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        return True
+
+    # -------------------------------------------------------------------------
+    def flush(self):
+        """ Writes the buffered Locations to the database """
+
+        db = current.db
+        buffer = self.buffer
+
+        if buffer:
+            ids = self.table.bulk_insert([item[0] for item in buffer])
+
+            paths = {}
+            tags = []
+            for i, location_id in enumerate(ids):
+                record, parent_path, location_tags = buffer[i]
+                if parent_path:
+                    paths[location_id] = "%s/%s" % (parent_path, location_id)
+                else:
+                    paths[location_id] = str(location_id)
+                for tag, value in location_tags:
+                    tags.append(dict(location_id=location_id,
+                                     tag=tag,
+                                     value=value))
+            current.gis._update_paths(paths)
+            self.ttable.bulk_insert(tags)
+            self.count += len(ids)
+            self.buffer = []
+
+        db.commit()
+
+        # Checkpoint
+        try:
+            f = open(self.checkpoint, "w")
+            f.write(str(self.position))
+            f.close()
+        except IOError:
+            s3_debug("Cannot write checkpoint %s" % self.checkpoint)
+
+    # -------------------------------------------------------------------------
+    def finish(self):
+        """
+            Completes the import
+
+            @returns: the number of imported Locations
+        """
+
+        self.flush()
+        try:
+            os.remove(self.checkpoint)
+        except OSError:
+            pass
+        return self.count
+
+# =============================================================================
+class S3SpatialBackend(object):
+    """
+        Spatial query engine for gis_location
+
+        Resolves spatial predicates (intersects, within, dwithin) into
+        DAL queries for gis_location. This default engine pre-filters the
+        candidates by their bounding boxes in the database, and then checks
+        the remaining geometries against a prepared Shapely geometry.
+
+        @requires: U{B{I{shapely}} <http://trac.gispython.org/lab/wiki/Shapely>}
+    """
+
+    OPERATORS = ("intersects", "within", "dwithin")
+
+    def __init__(self):
+
+        self.table = current.s3db.gis_location
+
+    # -------------------------------------------------------------------------
+    def query(self, op, shape, distance=None):
+        """
+            Returns a query for all locations which match a spatial predicate
+
+            @param op: the predicate, "intersects", "within" (location is
+                       within shape) or "dwithin" (location is within
+                       distance of shape)
+            @param shape: the shape, either as Shapely geometry or as WKT
+            @param distance: the distance for "dwithin" (in degrees, as
+                             the_geom uses SRID 4326)
+        """
+
+        if op not in self.OPERATORS:
+            raise SyntaxError("Invalid spatial operator: %s" % op)
+
+        return self.table.id.belongs(self.ids(op, shape, distance=distance))
+
+    # -------------------------------------------------------------------------
+    def ids(self, op, shape, distance=None):
+        """
+            Returns a list of the IDs of all locations which match a
+            spatial predicate (parameters see query())
+        """
+
+        if isinstance(shape, basestring):
+            shape = wkt_loads(shape)
+        if op == "dwithin":
+            shape = shape.buffer(distance)
+            op = "intersects"
+
+        from shapely.prepared import prep
+        prepared = prep(shape)
+        if op == "within":
+            match = prepared.contains
+        else:
+            match = prepared.intersects
+
+        table = self.table
+        lon_min, lat_min, lon_max, lat_max = shape.bounds
+        in_bbox = (table.lat_min <= lat_max) & \
+                  (table.lat_max >= lat_min) & \
+                  (table.lon_min <= lon_max) & \
+                  (table.lon_max >= lon_min)
+        # Points without bounds
+        no_bounds = (table.lon_min == None) & \
+                    (table.lat >= lat_min) & (table.lat <= lat_max) & \
+                    (table.lon >= lon_min) & (table.lon <= lon_max)
+        query = (table.deleted != True) & (in_bbox | no_bounds)
+        rows = current.db(query).select(table.id,
+                                        table.wkt,
+                                        table.lat,
+                                        table.lon)
+
+        Point = shapely.geometry.point.Point
+        ids = []
+        append = ids.append
+        for row in rows:
+            wkt = row.wkt
+            try:
+                if wkt:
+                    location_shape = wkt_loads(wkt)
+                elif row.lat is not None and row.lon is not None:
+                    location_shape = Point(row.lon, row.lat)
+                else:
+                    continue
+            except shapely.geos.ReadingError:
+                s3_debug("Error reading wkt of location with id", row.id)
+                continue
+            if match(location_shape):
+                append(row.id)
+        return ids
+
+# =============================================================================
+class S3SpatialDBBackend(S3SpatialBackend):
+    """
+        Spatial query engine for gis_location using a spatial database
+        (PostGIS or SpatiaLite)
+
+        Pushes the spatial predicates down to the database as operations on
+        the_geom, so that they can use the spatial index on it. Falls back
+        to S3SpatialBackend if the DAL doesn't support the operator.
+    """
+
+    # -------------------------------------------------------------------------
+    def query(self, op, shape, distance=None):
+        """
+            Returns a query for all locations which match a spatial predicate
+            (parameters see S3SpatialBackend.query())
+        """
+
+        if op not in self.OPERATORS:
+            raise SyntaxError("Invalid spatial operator: %s" % op)
+
+        if not isinstance(shape, basestring):
+            shape = shape.wkt
+
+        table = self.table
+        the_geom = table.the_geom
+        try:
+            if op == "intersects":
+                query = the_geom.st_intersects(shape)
+            elif op == "within":
+                query = the_geom.st_within(shape)
+            else:
+                query = the_geom.st_dwithin(shape, distance)
+        except AttributeError:
+            # Old DAL
+            if not SHAPELY:
+                s3_debug("Spatial operator %s not supported by DAL" % op)
+                return None
+            ids = S3SpatialBackend.ids(self, op, shape, distance=distance)
+            return table.id.belongs(ids)
+        return (table.deleted != True) & query
+
+    # -------------------------------------------------------------------------
+    def ids(self, op, shape, distance=None):
+        """
+            Returns a list of the IDs of all locations which match a
+            spatial predicate (parameters see S3SpatialBackend.query())
+        """
+
+        query = self.query(op, shape, distance=distance)
+        if query is None:
+            return []
+        table = self.table
+        rows = current.db(query).select(table.id)
+        return [row.id for row in rows]
+
+# =============================================================================
+class S3LocationIndex(object):
+    """
+        In-process R-tree index over the bounds of gis_location
+
+        Used (if settings.gis.spatial_index is enabled and there is no
+        spatial database) to find candidate locations for bbox queries,
+        point queries and nearest-N queries without having to evaluate the
+        range predicates over the bounds for all locations in the database.
+
+        The index is built on first use in each process, and maintained from
+        gis_location_onaccept. Changes made by other processes are picked up
+        from gis_location.modified_on at most every SYNC_INTERVAL seconds.
+
+        The index may contain stale entries (e.g. old bounds of a location),
+        so its results are candidates only, and the actual predicates must
+        still be applied in the database query.
+
+        @requires: U{B{I{Rtree}} <http://toblerity.github.com/rtree/>}
+    """
+
+    # Minimum interval between two sync queries (seconds)
+    SYNC_INTERVAL = 60
+
+    # Overlap of sync windows to catch changes by concurrent transactions
+    SYNC_MARGIN = timedelta(seconds=10)
+
+    # Maximum number of candidate IDs to return for a bbox query (beyond
+    # that, the range predicates are cheaper than a large belongs())
+    MAX_CANDIDATES = 5000
+
+    # Rebuild the index when stale entries exceed this fraction of its size
+    MAX_STALE = 0.2
+
+    _index = None
+    _size = 0
+    _stale = 0
+    _synced = None
+    _recent = None
+    _lock = threading.RLock()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def enabled():
+        """ Whether the index is enabled and available """
+
+        if not current.deployment_settings.get_gis_spatial_index():
+            return False
+        if not RTREE:
+            s3_debug("WARNING: %s: Rtree library not installed, location index disabled" % __name__)
+            return False
+        return True
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _bounds(row):
+        """
+            Returns the bounds of a location (lon_min, lat_min, lon_max,
+            lat_max), or None if it has neither bounds nor a LatLon
+        """
+
+        if row.lon_min is not None and row.lat_min is not None and \
+           row.lon_max is not None and row.lat_max is not None:
+            return (row.lon_min, row.lat_min, row.lon_max, row.lat_max)
+        elif row.lat is not None and row.lon is not None:
+            return (row.lon, row.lat, row.lon, row.lat)
+        else:
+            return None
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _fields(cls, table):
+        """ The fields to select for indexing """
+
+        return [table.id,
+                table.lat,
+                table.lon,
+                table.lat_min,
+                table.lat_max,
+                table.lon_min,
+                table.lon_max]
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def build(cls):
+        """ (Re-)Builds the index from the database """
+
+        db = current.db
+        table = current.s3db.gis_location
+        bounds = cls._bounds
+
+        with cls._lock:
+            synced = current.request.utcnow
+            query = (table.deleted != True) & \
+                    ((table.lat_min != None) | (table.lat != None))
+            rows = db(query).select(cacheable=True, *cls._fields(table))
+
+            def entries():
+                for row in rows:
+                    b = bounds(row)
+                    if b is not None:
+                        yield (row.id, b, None)
+
+            if rows:
+                # Bulk-loading is much faster than inserting one by one
+                index = rtree_index.Index(entries())
+            else:
+                index = rtree_index.Index()
+
+            cls._index = index
+            cls._size = len(rows)
+            cls._stale = 0
+            cls._synced = synced
+            cls._recent = set()
+        return
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def sync(cls, force=False):
+        """
+            Adds locations which have been modified since the last sync
+
+            @param force: sync regardless of SYNC_INTERVAL
+        """
+
+        index = cls._index
+        if index is None:
+            return
+
+        now = current.request.utcnow
+        synced = cls._synced
+        if not force and \
+           now - synced < timedelta(seconds=cls.SYNC_INTERVAL):
+            return
+
+        db = current.db
+        table = current.s3db.gis_location
+        bounds = cls._bounds
+
+        with cls._lock:
+            query = (table.modified_on > synced - cls.SYNC_MARGIN)
+            rows = db(query).select(table.modified_on,
+                                    table.deleted,
+                                    cacheable=True,
+                                    *cls._fields(table))
+            recent = cls._recent
+            seen = set()
+            for row in rows:
+                key = (row.id, row.modified_on)
+                seen.add(key)
+                if key in recent:
+                    continue
+                # Previous entries of this location become stale
+                cls._stale += 1
+                if row.deleted:
+                    continue
+                b = bounds(row)
+                if b is not None:
+                    index.insert(row.id, b)
+            cls._recent = seen
+            cls._synced = now
+
+            if cls._stale > cls.MAX_STALE * max(cls._size, 1):
+                cls.build()
+        return
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def update(cls, location_id):
+        """
+            Updates the index for a location (onaccept)
+
+            @param location_id: the gis_location record ID
+        """
+
+        index = cls._index
+        if index is None:
+            # Not built in this process (yet)
+            return
+
+        table = current.s3db.gis_location
+        row = current.db(table.id == location_id).select(limitby=(0, 1),
+                                                         *cls._fields(table)).first()
+        if row:
+            b = cls._bounds(row)
+            if b is not None:
+                with cls._lock:
+                    index.insert(row.id, b)
+                    cls._stale += 1
+        return
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def get_index(cls):
+        """ Returns the (synchronized) index, building it if necessary """
+
+        if cls._index is None:
+            cls.build()
+        else:
+            cls.sync()
+        return cls._index
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def bbox(cls, lon_min, lat_min, lon_max, lat_max):
+        """
+            Returns the IDs of all candidate locations intersecting a bbox,
+            or None if the index is not enabled or the bbox contains too
+            many candidates to be useful
+        """
+
+        if not cls.enabled():
+            return None
+
+        index = cls.get_index()
+        with cls._lock:
+            ids = set()
+            for location_id in index.intersection((lon_min, lat_min,
+                                                   lon_max, lat_max)):
+                ids.add(location_id)
+                if len(ids) > cls.MAX_CANDIDATES:
+                    return None
+        return list(ids)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def point(cls, lat, lon):
+        """
+            Returns the IDs of all candidate locations containing a point,
+            or None if the index is not enabled
+        """
+
+        return cls.bbox(lon, lat, lon, lat)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def nearest(cls, lat, lon, limit=1):
+        """
+            Returns the IDs of the candidate locations whose bounds are
+            nearest to a point, or None if the index is not enabled
+
+            @param lat: the latitude
+            @param lon: the longitude
+            @param limit: the number of locations to return (may return more
+                          than that in case of ties or stale entries)
+        """
+
+        if not cls.enabled():
+            return None
+
+        index = cls.get_index()
+        with cls._lock:
+            ids = []
+            for location_id in index.nearest((lon, lat, lon, lat), limit):
+                if location_id not in ids:
+                    ids.append(location_id)
+        return ids
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def restrict(cls, query, lon_min, lat_min, lon_max, lat_max):
+        """
+            Restricts a bbox query on gis_location to the candidates from
+            the index (if enabled and selective enough)
+
+            @param query: the bbox query
+        """
+
+        ids = cls.bbox(lon_min, lat_min, lon_max, lat_max)
+        if ids is None:
+            return query
+        table = current.s3db.gis_location
+        if not ids:
+            # No candidates
+            return (table.id == 0) & query
+        return table.id.belongs(ids) & query
+
 # =============================================================================
 class Marker(object):
     """
@@ -4746,15 +5869,22 @@ class Marker(object):
                                       cache=s3db.cache).first()
         elif layer_id:
             # Check if we have a Marker for this Layer
-            config = current.gis.get_config()
-            ltable = s3db.gis_layer_symbology
-            query = (ltable.layer_id == layer_id) & \
-                    (ltable.symbology_id == config.symbology_id) & \
-                    (ltable.marker_id == mtable.id)
-            marker = db(query).select(mtable.image,
-                                      mtable.height,
-                                      mtable.width,
-                                      limitby=(0, 1)).first()
+            gis = current.gis
+            config = gis.get_config()
+            symbology_id = config.symbology_id
+            def lookup():
+                ltable = s3db.gis_layer_symbology
+                query = (ltable.layer_id == layer_id) & \
+                        (ltable.symbology_id == symbology_id) & \
+                        (ltable.marker_id == mtable.id)
+                row = db(query).select(mtable.image,
+                                       mtable.height,
+                                       mtable.width,
+                                       limitby=(0, 1)).first()
+                return row and Storage(row) or None
+            # Cached under the config version
+            marker = gis.cache_config(("layer_marker", layer_id,
+                                       symbology_id), lookup)
         if not marker:
             # Default Marker
             if not config:
@@ -4825,42 +5955,27 @@ class Layer(object):
         self.scripts = []
 
         s3 = current.response.s3
-        s3db = current.s3db
+        gis = current.gis
         s3_has_role = current.auth.s3_has_role
 
         # Read the Layers enabled in the Active Configs
         tablename = self.tablename
-        table = s3db[tablename]
-        ctable = s3db.gis_config
-        ltable = s3db.gis_layer_config
+        config_ids = tuple(s3.gis.config.ids)
+        base_only = s3.gis.base == True
+        key = ("layers", tablename, config_ids, base_only)
+        memcache = getattr(current.cache, "memcache", None)
+        if memcache is None:
+            # Layers are not part of the config version
+            key += (gis.table_stamp(tablename),)
+        rows = gis.cache_config(key,
+                                lambda: self.__read_layers(config_ids,
+                                                           base_only))
 
-        fields = table.fields
-        metafields = s3.all_meta_field_names
-        fields = [table[f] for f in fields if f not in metafields]
-        fields.append(ltable.enabled)
-        fields.append(ltable.visible)
-        fields.append(ltable.base)
-        fields.append(ltable.style)
-        fields.append(ctable.pe_type)
-        query = (table.layer_id == ltable.layer_id) & \
-                (ltable.config_id == ctable.id) & \
-                (ltable.config_id.belongs(s3.gis.config.ids))
-        if s3.gis.base == True:
-            # Only show the default base layer
-            if self.tablename == "gis_layer_empty":
-                # Show even if disabled (as fallback)
-                query = (table.id > 0)
-            else:
-                query = query & (ltable.base == True)
-
-        rows = current.db(query).select(orderby=ctable.pe_type,
-                                        *fields)
         layer_ids = []
         # Flag to show whether we've set the default baselayer
         # (otherwise a config higher in the hierarchy can overrule one lower down)
         base = True
-        for _record in rows:
-            record = _record[tablename]
+        for record, _config in rows:
             # Check if we've already seen this layer
             layer_id = record.layer_id
             if layer_id in layer_ids:
@@ -4868,14 +5983,14 @@ class Layer(object):
             # Add layer to list of checked
             layer_ids.append(layer_id)
             # Check if layer is enabled
-            _config = _record["gis_layer_config"]
             if not _config.enabled:
                 continue
             # Check user is allowed to access the layer
             role_required = record.role_required
             if role_required and not s3_has_role(role_required):
                 continue
-            # All OK - add SubLayer
+            # All OK - add SubLayer (copy of the cached record)
+            record = Storage(record)
             record["visible"] = _config.visible
             if base and _config.base:
                 # name can't conflict with OSM/WMS/ArcREST layers
@@ -4890,6 +6005,60 @@ class Layer(object):
             else:
                 append(self.SubLayer(record))
 
+    # -------------------------------------------------------------------------
+    def __read_layers(self, config_ids, base_only):
+        """
+            Read the Layers of this type in the given configs (helper for
+            the constructor, the result is cached under the config version)
+
+            @param config_ids: the gis_config record IDs
+            @param base_only: only the default base layer
+
+            @returns: list of tuples (record, layer_config), with only the
+                      field values of the layer and its layer config
+        """
+
+        s3db = current.s3db
+
+        tablename = self.tablename
+        table = s3db[tablename]
+        ctable = s3db.gis_config
+        ltable = s3db.gis_layer_config
+
+        fields = table.fields
+        metafields = current.response.s3.all_meta_field_names
+        fieldnames = [f for f in fields if f not in metafields]
+        fields = [table[f] for f in fieldnames]
+        fields.append(ltable.enabled)
+        fields.append(ltable.visible)
+        fields.append(ltable.base)
+        fields.append(ltable.style)
+        fields.append(ctable.pe_type)
+        query = (table.layer_id == ltable.layer_id) & \
+                (ltable.config_id == ctable.id) & \
+                (ltable.config_id.belongs(config_ids))
+        if base_only:
+            # Only show the default base layer
+            if tablename == "gis_layer_empty":
+                # Show even if disabled (as fallback)
+                query = (table.id > 0)
+            else:
+                query = query & (ltable.base == True)
+
+        rows = current.db(query).select(orderby=ctable.pe_type,
+                                        *fields)
+        layers = []
+        append = layers.append
+        for row in rows:
+            record = row[tablename]
+            _config = row["gis_layer_config"]
+            append((Storage([(f, record[f]) for f in fieldnames]),
+                    Storage(enabled=_config.enabled,
+                            visible=_config.visible,
+                            base=_config.base,
+                            style=_config.style)))
+        return layers
+
     # -------------------------------------------------------------------------
     def as_javascript(self):
         """
@@ -39,6 +39,7 @@ import sys
 import cPickle
 import tempfile
 from datetime import datetime
+from decimal import Decimal
 from copy import deepcopy
 try:
     from cStringIO import StringIO    # Faster, where available
@@ -60,7 +61,7 @@ from gluon.serializers import json
 from s3tools import SQLTABLES3
 from s3crud import S3CRUD
 from s3xml import S3XML
-from s3utils import s3_mark_required
+from s3utils import s3_mark_required, s3_bulk_insert
 
 DEBUG = False
 if DEBUG:
@@ -474,7 +475,7 @@ class S3Importer(S3CRUD):
             # @todo: restore the error tree from all items?
             error_tip = ""
 
-        rowcount = len(self._get_all_items(upload_id))
+        rowcount = self._count_all_items(upload_id)
         rheader = DIV(TABLE(
             TR(
                 TH("%s: " % self.messages.job_total_records),
@@ -833,18 +834,15 @@ class S3Importer(S3CRUD):
         s3.filter = (self.table.job_id == job_id) & \
                     (self.table.tablename == self.controller_tablename)
 
-        # Get a list of the records that have an error of None
+        # Get a list of the records that have an error (all other records
+        # are selected by default, so that the page size does not depend
+        # on the total number of items)
         query =  (self.table.job_id == job_id) & \
-                 (self.table.tablename == self.controller_tablename)
-        rows = current.db(query).select(self.table.id, self.table.error)
-        select_list = []
-        error_list = []
-        for row in rows:
-            if row.error:
-                error_list.append(str(row.id))
-            else:
-                select_list.append("%s" % row.id)
-        select_id = ",".join(select_list)
+                 (self.table.tablename == self.controller_tablename) & \
+                 (self.table.error != None) & \
+                 (self.table.error != "")
+        rows = current.db(query).select(self.table.id)
+        error_list = [str(row.id) for row in rows]
 
         output = self._dataTable(["id", "element", "error"],
                                  sort_by = [[1, "asc"]],
@@ -859,15 +857,16 @@ class S3Importer(S3CRUD):
         s3.dataTableStyleWarning = error_list
 
         s3.dataTableSelectable = True
+        s3.dataTableSelectAll = True
         s3.dataTablePostMethod = True
         table = output["items"]
         job = INPUT(_type="hidden", _id="importUploadID", _name="job",
                     _value="%s" % upload_id)
         mode = INPUT(_type="hidden", _id="importMode", _name="mode",
-                     _value="Inclusive")
+                     _value="Exclusive")
         # only select the rows with no errors
         selected = INPUT(_type="hidden", _id="importSelected",
-                         _name="selected", _value="[%s]" % select_id)
+                         _name="selected", _value="[%s]" % ",".join(error_list))
         form = FORM(table, job, mode, selected)
         output["items"] = form
         s3.dataTableSelectSubmitURL = "import?job=%s&" % upload_id
@@ -953,6 +952,13 @@ class S3Importer(S3CRUD):
         if mode is not None:
             args.update(mode=mode)
 
+        # Large CSV files get committed in chunks (single-pass only)
+        if commit_job:
+            settings = current.deployment_settings
+            chunk_size = settings.get_base_import_chunk_size()
+        else:
+            chunk_size = None
+
         # Generate the import job
         resource.import_xml(src,
                             format=fmt,
@@ -960,6 +966,7 @@ class S3Importer(S3CRUD):
                             stylesheet=stylesheet,
                             ignore_errors = True,
                             commit_job = commit_job,
+                            chunk_size = chunk_size,
                             **args)
 
         job = resource.job
@@ -1069,14 +1076,16 @@ class S3Importer(S3CRUD):
             # get all the items selected for import
             rows = self._get_all_items(upload_id, as_string=True)
 
-            # loop through each row and delete the items not required
+            # delete the items not required
             self._store_import_details(job_id, "preDelete")
-            for id in rows:
-                if str(id) not in items:
-                    # @todo: replace with a helper method from the API
-                    _debug("Deleting item.id = %s" % id)
-                    query = (itemTable.id == id)
-                    db(query).delete()
+            items = set(items)
+            delete = [id for id in rows if str(id) not in items]
+            chunk_size = S3ImportJob.STORE_CHUNK_SIZE
+            for i in xrange(0, len(delete), chunk_size):
+                # @todo: replace with a helper method from the API
+                _debug("Deleting %s items" % len(delete[i:i + chunk_size]))
+                query = (itemTable.id.belongs(delete[i:i + chunk_size]))
+                db(query).delete()
 
             #****************************************************************
             # EXPERIMENTAL
@@ -1109,10 +1118,8 @@ class S3Importer(S3CRUD):
 
         query = (itemTable.job_id == job_id)  & \
                 (itemTable.tablename == self.controller_tablename)
-        rows = db(query).select(itemTable.data, itemTable.error)
-        items = [dict(data=row.data, error=row.error) for row in rows]
 
-        self.importDetails[key] = items
+        self.importDetails[key] = db(query).count()
 
     # -------------------------------------------------------------------------
     def _update_upload_job(self, upload_id):
@@ -1130,8 +1137,8 @@ class S3Importer(S3CRUD):
         resource = request.resource
         db = current.db
 
-        totalPreDelete = len(self.importDetails["preDelete"])
-        totalPreImport = len(self.importDetails["preImportTree"])
+        totalPreDelete = self.importDetails["preDelete"]
+        totalPreImport = self.importDetails["preImportTree"]
         totalIgnored = totalPreDelete - totalPreImport
 
         if resource.error_tree is None:
@@ -1273,6 +1280,7 @@ class S3Importer(S3CRUD):
             else:
                 start = None # use default
             # Using the sort variables sent from dataTables
+            orderby = None
             if vars.iSortingCols:
                 orderby = self.ssp_orderby(resource, list_fields)
 
@@ -1564,6 +1572,7 @@ class S3Importer(S3CRUD):
                 items = selected
             elif mode == "Exclusive":
                 all_items = self._get_all_items(upload_id, as_string=True)
+                selected = set(selected)
                 items = [i for i in all_items if i not in selected]
         return items
 
@@ -1592,6 +1601,23 @@ class S3Importer(S3CRUD):
 
         return items
 
+    # -------------------------------------------------------------------------
+    def _count_all_items(self, upload_id):
+        """ Count the import items for the given upload ID
+
+            @param upload_id: the upload ID
+        """
+
+        db = current.db
+        item_table = S3ImportJob.define_item_table()
+        upload_table = self.upload_table
+
+        query = (upload_table.id == upload_id) & \
+                (item_table.job_id == upload_table.job_id) & \
+                (item_table.tablename == self.controller_tablename)
+
+        return db(query).count()
+
     # -------------------------------------------------------------------------
     def _use_upload_table(self):
         """
@@ -1834,6 +1860,7 @@ class S3ImportItem(object):
         # Writeback hook for circular references:
         # Items which need a second write to update references
         self.update = []
+        self.resolved = False
 
     # -------------------------------------------------------------------------
     def __repr__(self):
@@ -1881,7 +1908,7 @@ class S3ImportItem(object):
         self.tablename = table._tablename
 
         if original is None:
-            original = manager.original(table, element)
+            original = self.job.original(table, element)
         data = xml.record(table, element,
                           files=files,
                           original=original,
@@ -1930,7 +1957,7 @@ class S3ImportItem(object):
         if self.original is not None:
             original = self.original
         else:
-            original = manager.original(table, self.data)
+            original = self.job.original(table, self.data)
 
         if original is not None:
             self.original = original
@@ -1939,7 +1966,7 @@ class S3ImportItem(object):
                 self.uid = original[xml.UID]
                 self.data.update({xml.UID:self.uid})
             self.method = self.METHOD.UPDATE
-        else:
+        elif not self.job.deduplicate(self):
             resolve = model.get_config(self.tablename, RESOLVER)
             if self.data and resolve:
                 resolve(self)
@@ -2317,7 +2344,11 @@ class S3ImportItem(object):
             onaccept = model.get_config(tablename, key,
                        model.get_config(tablename, "onaccept"))
             if onaccept:
-                callback(onaccept, form, tablename=self.tablename)
+                if self.job.bulk:
+                    # Run after all items have been committed
+                    self.job.deferred.append((onaccept, form, tablename))
+                else:
+                    callback(onaccept, form, tablename=self.tablename)
 
         # Update referencing items
         if self.update and self.id:
@@ -2371,8 +2402,9 @@ class S3ImportItem(object):
         db = current.db
         s3db = current.s3db
 
-        if not self.table:
+        if not self.table or self.resolved:
             return
+        self.resolved = True
 
         items = self.job.items
         for reference in self.references:
@@ -2474,9 +2506,7 @@ class S3ImportItem(object):
             Store this item in the DB
         """
 
-        manager = current.manager
         db = current.db
-        xml = manager.xml
 
         _debug("Storing item %s" % self)
         if item_table is None:
@@ -2487,6 +2517,25 @@ class S3ImportItem(object):
             record_id = row.id
         else:
             record_id = None
+        record = self.dump()
+        if record_id:
+            db(item_table.id == record_id).update(**record)
+        else:
+            record_id = item_table.insert(**record)
+        _debug("Record ID=%s" % record_id)
+        return record_id
+
+    # -------------------------------------------------------------------------
+    def dump(self):
+        """
+            Get the item table record for this item (counterpart to
+            restore)
+
+            @returns: the record as Storage
+        """
+
+        xml = current.manager.xml
+
         record = Storage(job_id = self.job.job_id,
                          item_id = self.item_id,
                          tablename = self.tablename,
@@ -2508,8 +2557,7 @@ class S3ImportItem(object):
                    fieldtype[:14] == "list:reference":
                     continue
                 data.update({f:self.data[f]})
-            data_str = cPickle.dumps(data)
-            record.update(data=data_str)
+            record.update(data=self.dump_data(data))
         ritems = []
         for reference in self.references:
             field = reference.field
@@ -2532,12 +2580,75 @@ class S3ImportItem(object):
             record.update(citems=citems)
         if self.parent:
             record.update(parent=self.parent.item_id)
-        if record_id:
-            db(item_table.id == record_id).update(**record)
-        else:
-            record_id = item_table.insert(**record)
-        _debug("Record ID=%s" % record_id)
-        return record_id
+        return record
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def dump_data(data):
+        """
+            Encode the data of an item as JSON for the item table
+
+            @param data: the data (dict of field values)
+        """
+
+        def encode(value):
+            if isinstance(value, Decimal):
+                return str(value)
+            elif hasattr(value, "isoformat"):
+                # date, time or datetime
+                return value.isoformat()
+            elif isinstance(value, (set, tuple)):
+                return list(value)
+            raise TypeError("%s is not JSON serializable" % repr(value))
+
+        return simplejson.dumps(data, default=encode, separators=(",", ":"))
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def load_data(data_str, table=None):
+        """
+            Decode the data of an item from the item table (counterpart to
+            dump_data), converting the values into the types of the fields
+
+            @param data_str: the data as stored in the item table
+            @param table: the table the data belong to
+        """
+
+        if data_str is None:
+            return Storage()
+        try:
+            data = simplejson.loads(data_str)
+        except ValueError:
+            # Pickled data from items stored by earlier versions
+            return cPickle.loads(data_str)
+
+        def parse_datetime(value):
+            dt = datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+            if value[19:20] == ".":
+                dt = dt.replace(microsecond=int(value[20:26].ljust(6, "0")))
+            return dt
+
+        decode = {"datetime": parse_datetime,
+                  "date": lambda v: datetime.strptime(v, "%Y-%m-%d").date(),
+                  "time": lambda v: parse_datetime("1970-01-01T%s" % v).time(),
+                  "decimal": Decimal,
+                  }
+
+        record = Storage()
+        for f, value in data.items():
+            f = str(f)
+            if table is not None and f in table.fields and \
+               isinstance(value, basestring):
+                fieldtype = str(table[f].type)
+                if fieldtype[:7] == "decimal":
+                    fieldtype = "decimal"
+                if fieldtype in decode:
+                    try:
+                        value = decode[fieldtype](value)
+                    except (ValueError, ArithmeticError):
+                        pass
+            record[f] = value
+        return record
 
     # -------------------------------------------------------------------------
     def restore(self, row):
@@ -2561,10 +2672,11 @@ class S3ImportItem(object):
         tablename = row.tablename
         self.id = None
         self.uid = row.record_uid
-        if row.data is not None:
-            self.data = cPickle.loads(row.data)
-        else:
-            self.data = Storage()
+        try:
+            table = s3db[tablename]
+        except:
+            table = None
+        self.data = self.load_data(row.data, table)
         data = self.data
         if xml.MTIME in data:
             self.mtime = data[xml.MTIME]
@@ -2578,15 +2690,13 @@ class S3ImportItem(object):
         if row.ritems:
             self.load_references = [simplejson.loads(ritem) for ritem in row.ritems]
         self.load_parent = row.parent
-        try:
-            table = s3db[tablename]
-        except:
+        if table is None:
             self.error = self.ERROR.BAD_RESOURCE
             return False
         else:
             self.table = table
             self.tablename = tablename
-        original = manager.original(table, self.data)
+        original = self.job.original(table, self.data)
         if original is not None:
             self.original = original
             self.id = original[table._id.name]
@@ -2603,11 +2713,38 @@ class S3ImportItem(object):
 class S3ImportJob():
     """
         Class to import an element tree into the database
+
+        In bulk mode (for large non-interactive imports, e.g. prepopulate),
+        the job:
+            - prefetches the originals of all items of a table by UID and
+              unique keys, and looks up duplicates in memory,
+            - matches duplicates by the "deduplicate_keys" of a table (if
+              configured) in memory instead of calling the "deduplicate"
+              resolver for every item,
+            - commits the items in batches, each of which only references
+              items of previous batches, so that duplicates can be
+              prefetched for the whole batch,
+            - buffers the audit trail, and runs all onaccept callbacks
+              after the last item has been committed (post_commit)
+
+        For chunked imports (a sequence of jobs for parts of the same
+        source, see S3Resource.import_chunks), the jobs can share a UID
+        cache to resolve references to records committed by previous
+        jobs without looking them up in the database.
     """
 
     JOB_TABLE_NAME = "s3_import_job"
     ITEM_TABLE_NAME = "s3_import_item"
 
+    # Maximum number of items per bulk insert when storing a job
+    STORE_CHUNK_SIZE = 500
+
+    # Maximum size (bytes) of the item data per bulk insert
+    STORE_CHUNK_BYTES = 1000000
+
+    # Maximum number of entries in a shared UID cache
+    UID_CACHE_SIZE = 100000
+
     # -------------------------------------------------------------------------
     def __init__(self, manager, table,
                  tree=None,
@@ -2617,7 +2754,10 @@ class S3ImportJob():
                  update_policy=None,
                  conflict_policy=None,
                  last_sync=None,
-                 onconflict=None):
+                 onconflict=None,
+                 bulk=False,
+                 uid_cache=None,
+                 onprogress=None):
         """
             Constructor
 
@@ -2630,6 +2770,11 @@ class S3ImportJob():
             @param conflict_policy: the conflict resolution policy
             @param last_sync: the last synchronization time stamp (datetime)
             @param onconflict: custom conflict resolver function
+            @param bulk: commit in bulk mode
+            @param uid_cache: UID cache shared with other jobs, a dict
+                              {(tablename, attribute, uid): record ID}
+            @param onprogress: callback function onprogress(job), called
+                               after each batch of items has been committed
         """
 
         db = current.db
@@ -2676,6 +2821,16 @@ class S3ImportJob():
         self.last_sync = last_sync
         self.onconflict = onconflict
 
+        # Bulk mode
+        self.bulk = bulk
+        self.indexes = Storage()
+        self.key_indexes = Storage()
+        self.deferred = []
+
+        # Chunked import
+        self.uid_cache = uid_cache
+        self.onprogress = onprogress
+
         if job_id:
             self.__define_tables()
             jobtable = self.job_table
@@ -2905,14 +3060,27 @@ class S3ImportJob():
             # Find the elements and map to DB records
             relements = []
 
+            # Records committed by previous jobs (direct references only)
+            uid_cache = None
+            if self.uid_cache is not None and tablename == ktablename:
+                uid_cache = self.uid_cache
+
             # Create a UID<->ID map
             id_map = Storage()
             if attr == xml.UID and uids:
                 _uids = map(xml.import_uid, uids)
-                query = ktable[xml.UID].belongs(_uids)
-                records = db(query).select(ktable.id,
-                                           ktable[xml.UID])
-                id_map = dict([(r[xml.UID], r.id) for r in records])
+                if uid_cache is not None:
+                    for _uid in _uids:
+                        key = (tablename, attr, _uid)
+                        if key in uid_cache:
+                            id_map[_uid] = uid_cache[key]
+                    _uids = [_uid for _uid in _uids if _uid not in id_map]
+                if _uids:
+                    query = ktable[xml.UID].belongs(_uids)
+                    records = db(query).select(ktable.id,
+                                               ktable[xml.UID])
+                    for r in records:
+                        id_map[r[xml.UID]] = r.id
 
             if not uids:
                 # Anonymous reference: <resource> inside the element
@@ -2947,6 +3115,11 @@ class S3ImportJob():
                             _uid = xml.import_uid(uid)
                             if _uid and _uid in id_map:
                                 _id = id_map[_uid]
+                            elif attr != xml.UID and uid_cache is not None:
+                                _id = uid_cache.get((tablename, attr, uid))
+                            else:
+                                _id = None
+                            if _id:
                                 entry = Storage(tablename=tablename,
                                                 element=None,
                                                 uid=uid,
@@ -3000,14 +3173,18 @@ class S3ImportJob():
         return item_id
 
     # -------------------------------------------------------------------------
-    def resolve(self, item_id, import_list):
+    def resolve(self, item_id, import_list, imported=None):
         """
             Resolve the reference list of an item
 
             @param item_id: the import item UID
             @param import_list: the ordered list of items (UIDs) to import
+            @param imported: set of the items in import_list (for faster
+                             lookups, will be updated by this function)
         """
 
+        if imported is None:
+            imported = set(import_list)
         item = self.items[item_id]
         if item.lock or item.accepted is False:
             return False
@@ -3017,12 +3194,13 @@ class S3ImportJob():
             if entry.item_id:
                 references.append(entry.item_id)
         for ritem_id in references:
-            if ritem_id in import_list:
+            if ritem_id in imported:
                 continue
             else:
                 item.lock = True
-                if self.resolve(ritem_id, import_list):
+                if self.resolve(ritem_id, import_list, imported):
                     import_list.append(ritem_id)
+                    imported.add(ritem_id)
                 item.lock = False
         return True
 
@@ -3036,17 +3214,61 @@ class S3ImportJob():
         """
 
         manager = current.manager
-        xml = manager.xml
 
         # Resolve references
         import_list = []
+        imported = set()
         for item_id in self.items:
-            self.resolve(item_id, import_list)
-            if item_id not in import_list:
+            self.resolve(item_id, import_list, imported)
+            if item_id not in imported:
                 import_list.append(item_id)
+                imported.add(item_id)
         imports = [self.items[_id] for _id in import_list]
-        # Commit the items
-        for item in imports:
+
+        if not self.bulk:
+            success = self.commit_items(imports, ignore_errors=ignore_errors)
+            if self.onprogress:
+                self.onprogress(self)
+            return success
+
+        audit = manager.audit
+        if audit:
+            audit.begin()
+        success = True
+        try:
+            for batch in self.batches(imports):
+                self.prefetch_items(batch)
+                success = self.commit_items(batch,
+                                            ignore_errors=ignore_errors)
+                if self.onprogress:
+                    self.onprogress(self)
+                if not success:
+                    break
+            # Items committed before a failed batch are kept (as in the
+            # non-bulk mode), so their onaccepts must run as well
+            self.post_commit()
+        except:
+            self.deferred = []
+            if audit:
+                audit.end(flush=False)
+            raise
+        if audit:
+            audit.end()
+        return success
+
+    # -------------------------------------------------------------------------
+    def commit_items(self, items, ignore_errors=False):
+        """
+            Commit items to the DB, in the given order
+
+            @param items: the items
+            @param ignore_errors: skip any items with errors
+                                  (does still report the errors)
+        """
+
+        xml = current.manager.xml
+
+        for item in items:
             error = None
             success = item.commit(ignore_errors=ignore_errors)
             error = item.error
@@ -3061,8 +3283,317 @@ class S3ImportJob():
                     return False
             elif item.tablename == self.table._tablename:
                 self.count += 1
+            if self.bulk:
+                self.update_index(item)
+            if self.uid_cache is not None:
+                self.cache_uid(item)
+        return True
+
+    # -------------------------------------------------------------------------
+    def cache_uid(self, item):
+        """
+            Add the record ID of a committed item to the shared UID cache,
+            under the UID and the tuid of its element
+
+            @param item: the S3ImportItem
+        """
+
+        element = item.element
+        if not item.id or element is None:
+            return
+
+        xml = current.manager.xml
+        uid_cache = self.uid_cache
+        if len(uid_cache) >= self.UID_CACHE_SIZE:
+            uid_cache.clear()
+
+        tablename = item.tablename
+        uid = element.get(xml.UID, None)
+        if uid:
+            uid_cache[(tablename, xml.UID, xml.import_uid(uid))] = item.id
+        tuid = element.get(xml.ATTRIBUTE.tuid, None)
+        if tuid:
+            uid_cache[(tablename, xml.ATTRIBUTE.tuid, tuid)] = item.id
+        return
+
+    # -------------------------------------------------------------------------
+    def post_commit(self):
+        """
+            Run the onaccept callbacks deferred during a bulk commit
+        """
+
+        deferred = self.deferred
+        self.deferred = []
+        for onaccept, form, tablename in deferred:
+            callback(onaccept, form, tablename=tablename)
+        return
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def batches(imports):
+        """
+            Split the ordered list of items into batches, so that items
+            only reference items in previous batches (apart from circular
+            references, which are resolved by writeback anyway)
+
+            @param imports: the items in import order
+            @returns: list of batches (lists of items)
+        """
+
+        levels = {}
+        batches = []
+        for item in imports:
+            level = 0
+            for reference in item.references:
+                entry = reference.entry
+                if entry and entry.item_id in levels:
+                    level = max(level, levels[entry.item_id] + 1)
+            levels[item.item_id] = level
+            while len(batches) <= level:
+                batches.append([])
+            batches[level].append(item)
+        return batches
+
+    # -------------------------------------------------------------------------
+    def original(self, table, record):
+        """
+            Find the original record for a possible duplicate (see
+            S3RequestManager.original), in bulk mode from the index
+            of prefetched records
+
+            @param table: the table
+            @param record: the record as dict or S3XML Element
+        """
+
+        manager = current.manager
+        if not self.bulk:
+            return manager.original(table, record)
+
+        xml = manager.xml
+        UID = xml.UID
+        index = self.index(table)
+
+        original = None
+        matches = Storage()
+        pvalues = manager.original_keys(table, record)
+        for f in pvalues:
+            value = pvalues[f]
+            if f == UID:
+                value = xml.import_uid(value)
+            rows = index.lookup(f, value)
+            if rows is None:
+                # Not prefetched
+                index.fetch(f, [value])
+                rows = index.lookup(f, value)
+            if f == UID:
+                if rows:
+                    original = rows[0]
+            else:
+                for row in rows:
+                    matches[row[table._id.name]] = row
+
+        # Exactly one match by non-UID unique keys, otherwise the UID-match
+        if len(matches) == 1:
+            original = matches.values()[0]
+        if original is not None:
+            original = index.load(original)
+        return original
+
+    # -------------------------------------------------------------------------
+    def deduplicate(self, item):
+        """
+            Find the duplicate of an item by the "deduplicate_keys" of its
+            table in the index of prefetched records (bulk mode only)
+
+            A record is a duplicate if its first key matches, and all other
+            keys which have a value in the item match as well.
+
+            @param item: the S3ImportItem
+            @returns: True if the item has been deduplicated, False if the
+                      deduplicate resolver of the table is to be used
+        """
+
+        if not self.bulk:
+            return False
+        keys = current.manager.model.get_config(item.tablename,
+                                                "deduplicate_keys")
+        if not keys or not item.data:
+            return False
+
+        table = item.table
+        data = item.data
+        value = data.get(keys[0], None)
+        if not value:
+            return True
+
+        index = self.key_index(table, keys)
+        rows = index.lookup(keys[0], value)
+        if rows is None:
+            # Not prefetched
+            index.fetch(keys[0], [value])
+            rows = index.lookup(keys[0], value)
+
+        key = S3ImportIndex.key
+        for row in rows:
+            row = index.load(row)
+            if row is None:
+                continue
+            for k in keys:
+                v = data.get(k, None)
+                if v and key(row[k]) != key(v):
+                    break
+            else:
+                item.id = row[table._id.name]
+                item.original = row
+                item.method = item.METHOD.UPDATE
+                break
         return True
 
+    # -------------------------------------------------------------------------
+    def index(self, table):
+        """
+            Get the index of original records for a table (bulk mode),
+            prefetches the originals for all elements of that table in
+            the import tree when first called
+
+            @param table: the table
+        """
+
+        tablename = table._tablename
+        index = self.indexes.get(tablename, None)
+        if index is None:
+            fields = [f for f in table.fields if table[f].unique]
+            index = self.indexes[tablename] = S3ImportIndex(table, fields)
+            tree = self.tree
+            if tree is not None:
+                xml = current.manager.xml
+                if isinstance(tree, etree._ElementTree):
+                    root = tree.getroot()
+                else:
+                    root = tree
+                expr = './/%s[@%s="%s"]' % (xml.TAG.resource,
+                                            xml.ATTRIBUTE.name,
+                                            tablename)
+                self.prefetch(table, root.xpath(expr))
+        return index
+
+    # -------------------------------------------------------------------------
+    def key_index(self, table, keys):
+        """
+            Get the index of records for a table by its "deduplicate_keys"
+            (bulk mode)
+
+            @param table: the table
+            @param keys: the deduplicate keys
+        """
+
+        tablename = table._tablename
+        index = self.key_indexes.get(tablename, None)
+        if index is None:
+            if "deleted" in table.fields:
+                query = (table.deleted != True)
+            else:
+                query = None
+            index = S3ImportIndex(table, keys[:1], query=query)
+            self.key_indexes[tablename] = index
+        return index
+
+    # -------------------------------------------------------------------------
+    def prefetch(self, table, records):
+        """
+            Fetch the possible originals of records into the index
+
+            @param table: the table
+            @param records: the records (dicts or S3XML Elements)
+        """
+
+        manager = current.manager
+        xml = manager.xml
+        UID = xml.UID
+
+        index = self.index(table)
+        values = Storage()
+        for record in records:
+            if record is None:
+                continue
+            pvalues = manager.original_keys(table, record)
+            for f in pvalues:
+                value = pvalues[f]
+                if f == UID:
+                    value = xml.import_uid(value)
+                if f in values:
+                    values[f].append(value)
+                else:
+                    values[f] = [value]
+        for f in values:
+            index.fetch(f, values[f])
+        return
+
+    # -------------------------------------------------------------------------
+    def prefetch_items(self, items):
+        """
+            Fetch the possible duplicates of a batch of items into the
+            indexes, one query per table and key (bulk mode)
+
+            @param items: the items
+        """
+
+        model = current.manager.model
+
+        tables = Storage()
+        for item in items:
+            if item.id or item.table is None or not item.data:
+                continue
+            # All referenced items have been committed before this batch
+            item._resolve_references()
+            tablename = item.tablename
+            if tablename in tables:
+                tables[tablename].append(item)
+            else:
+                tables[tablename] = [item]
+
+        for tablename in tables:
+            items = tables[tablename]
+            table = items[0].table
+            self.prefetch(table, [item.data for item in items])
+            keys = model.get_config(tablename, "deduplicate_keys")
+            if keys:
+                index = self.key_index(table, keys)
+                index.fetch(keys[0], [item.data.get(keys[0], None)
+                                      for item in items])
+        return
+
+    # -------------------------------------------------------------------------
+    def update_index(self, item):
+        """
+            Update the indexes after an item has been committed (bulk mode)
+
+            @param item: the item
+        """
+
+        if item.skip or not item.id or item.table is None:
+            return
+
+        table = item.table
+        tablename = item.tablename
+        UID = current.manager.xml.UID
+
+        record = Storage()
+        if item.original:
+            record.update(item.original)
+        if item.data:
+            record.update(item.data)
+        record[table._id.name] = item.id
+        if item.uid and UID in table.fields:
+            record[UID] = item.uid
+
+        # The indexes reload the record from the DB when it is needed
+        for indexes in (self.indexes, self.key_indexes):
+            index = indexes.get(tablename, None)
+            if index is not None:
+                index.add(record, stub=True)
+        return
+
     # -------------------------------------------------------------------------
     def __define_tables(self):
         """
@@ -3138,8 +3669,32 @@ class S3ImportJob():
             pass
         else:
             record.update(tablename=tablename)
+
+        # Update the items stored before, insert all others in chunks
+        # (multi-row INSERTs where supported, see s3_bulk_insert)
+        item_table = self.item_table
+        query = item_table.job_id == self.job_id
+        rows = db(query).select(item_table.id, item_table.item_id)
+        stored = dict((row.item_id, row.id) for row in rows)
+        records = []
+        size = 0
         for item in self.items.values():
-            item.store(item_table=self.item_table)
+            item_record = item.dump()
+            item_record_id = stored.get(str(item.item_id), None)
+            if item_record_id:
+                db(item_table.id == item_record_id).update(**item_record)
+                continue
+            records.append(item_record)
+            size += len(item_record.element or "") + \
+                    len(item_record.data or "")
+            if len(records) >= self.STORE_CHUNK_SIZE or \
+               size >= self.STORE_CHUNK_BYTES:
+                s3_bulk_insert(item_table, records)
+                records = []
+                size = 0
+        if records:
+            s3_bulk_insert(item_table, records)
+
         if record_id:
             db(jobtable.id == record_id).update(**record)
         else:
@@ -3245,3 +3800,181 @@ class S3ImportJob():
                 item.load_parent = None
 
 # =============================================================================
+class S3ImportIndex(object):
+    """
+        In-memory index of the records of a table by the values of some
+        fields, to look up the duplicates of import items without a query
+        per item (used by S3ImportJob in bulk mode)
+    """
+
+    # Maximum number of values per query
+    CHUNK_SIZE = 500
+
+    def __init__(self, table, fields, query=None):
+        """
+            Constructor
+
+            @param table: the table
+            @param fields: names of the fields to index
+            @param query: additional query for the records to fetch
+        """
+
+        self.table = table
+        self.fields = fields
+        self.query = query
+
+        # Values which have been fetched, per field
+        self.fetched = dict((f, set()) for f in fields)
+
+        # {(fieldname, value): {record_id: record}}
+        self.records = {}
+
+        # {record_id: [(fieldname, value)]}
+        self.keys = {}
+
+        # IDs of records which need to be reloaded from the DB
+        self.stubs = set()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def key(value):
+        """
+            Normalize a value for the index (XML elements give strings
+            where the DB gives numbers)
+
+            @param value: the value
+        """
+
+        if isinstance(value, str):
+            try:
+                value = value.decode("utf-8")
+            except UnicodeDecodeError:
+                pass
+        elif not isinstance(value, unicode):
+            value = unicode(value)
+        return value
+
+    # -------------------------------------------------------------------------
+    def fetch(self, fieldname, values):
+        """
+            Fetch all records with any of these values in a field (skips
+            values which have already been fetched)
+
+            @param fieldname: the field name
+            @param values: list of values
+        """
+
+        key = self.key
+        fetched = self.fetched[fieldname]
+        values = dict((key(v), v) for v in values
+                      if v is not None and v != "" and
+                         key(v) not in fetched)
+        if not values:
+            return
+
+        db = current.db
+        table = self.table
+        field = table[fieldname]
+        keys = values.keys()
+        size = self.CHUNK_SIZE
+        for i in xrange(0, len(keys), size):
+            query = field.belongs([values[k] for k in keys[i:i+size]])
+            if self.query is not None:
+                query &= self.query
+            rows = db(query).select(table.ALL)
+            for row in rows:
+                self.add(row)
+        fetched.update(keys)
+        return
+
+    # -------------------------------------------------------------------------
+    def add(self, record, stub=False):
+        """
+            Add a record to the index (replaces the previous version)
+
+            @param record: the record
+            @param stub: the record is incomplete, reload it from the
+                         DB when it is needed (see load)
+        """
+
+        record_id = record[self.table._id.name]
+        self.remove(record_id)
+
+        key = self.key
+        keys = []
+        records = self.records
+        for f in self.fields:
+            value = record.get(f, None)
+            if value is None:
+                continue
+            k = (f, key(value))
+            if k in records:
+                records[k][record_id] = record
+            else:
+                records[k] = {record_id: record}
+            keys.append(k)
+        self.keys[record_id] = keys
+        if stub:
+            self.stubs.add(record_id)
+        return
+
+    # -------------------------------------------------------------------------
+    def remove(self, record_id):
+        """
+            Remove a record from the index
+
+            @param record_id: the record ID
+        """
+
+        keys = self.keys.pop(record_id, None)
+        if keys:
+            records = self.records
+            for k in keys:
+                if k in records:
+                    records[k].pop(record_id, None)
+        self.stubs.discard(record_id)
+        return
+
+    # -------------------------------------------------------------------------
+    def lookup(self, fieldname, value):
+        """
+            Look up the records with a value in a field
+
+            @param fieldname: the field name
+            @param value: the value
+            @returns: list of records, or None if the value has not
+                      been fetched
+        """
+
+        k = self.key(value)
+        if k not in self.fetched[fieldname]:
+            return None
+        records = self.records.get((fieldname, k), None)
+        if not records:
+            return []
+        return records.values()
+
+    # -------------------------------------------------------------------------
+    def load(self, record):
+        """
+            Get the complete record, reloads stubs from the DB
+
+            @param record: the record from lookup()
+            @returns: the record, or None if it does no longer match
+        """
+
+        table = self.table
+        record_id = record[table._id.name]
+        if record_id in self.stubs:
+            query = (table._id == record_id)
+            if self.query is not None:
+                query &= self.query
+            record = current.db(query).select(table.ALL,
+                                              limitby=(0, 1)).first()
+            if record:
+                self.add(record)
+            else:
+                self.remove(record_id)
+        return record
+
+# =============================================================================
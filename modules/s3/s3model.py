@@ -34,6 +34,7 @@ import sys
 
 from gluon.storage import Storage
 from gluon import *
+from gluon.dal import Table
 
 from s3validators import IS_ONE_OF
 
@@ -55,6 +56,12 @@ class S3Model(object):
     LOAD = "s3_model_load"
     DELETED = "deleted"
 
+    # Index of the models per module (see model_index)
+    _model_index = {}
+
+    # Tables migrated by this process {(db, tablename): signature}
+    _migrated = {}
+
     def __init__(self, module=None):
         """ Constructor """
 
@@ -167,6 +174,85 @@ class S3Model(object):
         """
         return None
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def model_index(prefix):
+        """
+            Get the index of the models in the eden.<prefix> module,
+            built once per process (and re-built if the module has
+            been reloaded)
+
+            @param prefix: the module prefix
+
+            @returns: Storage with
+                      module    - the module
+                      names     - {tablename or name: model class}
+                      generic   - [model classes without names]
+                      models    - [all S3Model subclasses]
+                      functions - {name: object} for other prefix_* names
+                      or None if there is no such module
+        """
+
+        models = current.models
+        if models is None or not hasattr(models, prefix):
+            return None
+        module = models.__dict__[prefix]
+
+        registry = S3Model._model_index
+        index = registry.get(prefix, None)
+        if index is not None and index.module is module:
+            return index
+
+        names = {}
+        generic = []
+        classes = []
+        functions = {}
+        for n in module.__all__:
+            model = module.__dict__[n]
+            if type(model).__name__ == "type":
+                if hasattr(model, "names"):
+                    for name in model.names:
+                        if name not in names:
+                            names[name] = model
+                else:
+                    generic.append(model)
+                if issubclass(model, S3Model):
+                    classes.append(model)
+            elif n.startswith("%s_" % prefix):
+                functions[n] = model
+
+        index = Storage(module=module,
+                        names=names,
+                        generic=generic,
+                        models=classes,
+                        functions=functions)
+        registry[prefix] = index
+        return index
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def load_model(prefix, name):
+        """
+            Load the model defining name (a tablename or a response.s3
+            name) from the eden.<prefix> module, or all generic models
+            of this module if no model defines this name
+
+            @param prefix: the module prefix
+            @param name: the tablename or name
+        """
+
+        index = S3Model.model_index(prefix)
+        if index is None:
+            return
+        model = index.names.get(name, None)
+        if model is not None:
+            model(prefix)
+        else:
+            for model in index.generic:
+                model(prefix)
+        current.response.s3.update(index.functions)
+        return
+
     # -------------------------------------------------------------------------
     @staticmethod
     def table(tablename, default=None):
@@ -178,34 +264,12 @@ class S3Model(object):
             response.s3 = Storage()
         s3 = response.s3
         db = current.db
-        settings = current.deployment_settings
 
         if tablename in db:
             return db[tablename]
         else:
-            prefix, name = tablename.split("_", 1)
-            models = current.models
-            if hasattr(models, prefix):
-                module = models.__dict__[prefix]
-                loaded = False
-                generic = []
-                for n in module.__all__:
-                    model = module.__dict__[n]
-                    if type(model).__name__ == "type":
-                        if loaded:
-                            continue
-                        if hasattr(model, "names"):
-                            if tablename in model.names:
-                                model(prefix)
-                                loaded = True
-                                generic = []
-                            else:
-                                continue
-                        else:
-                            generic.append(n)
-                    elif n.startswith("%s_" % prefix):
-                        s3[n] = model
-                [module.__dict__[n](prefix) for n in generic]
+            prefix = tablename.split("_", 1)[0]
+            S3Model.load_model(prefix, tablename)
         if tablename not in db:
             # Backward compatiblity
             manager = current.manager
@@ -234,28 +298,7 @@ class S3Model(object):
             return response.s3[name]
         elif "_" in name:
             prefix = name.split("_", 1)[0]
-            models = current.models
-            if hasattr(models, prefix):
-                module = models.__dict__[prefix]
-                loaded = False
-                generic = []
-                for n in module.__all__:
-                    model = module.__dict__[n]
-                    if type(model).__name__ == "type":
-                        if loaded:
-                            continue
-                        if hasattr(model, "names"):
-                            if name in model.names:
-                                model(prefix)
-                                loaded = True
-                                generic = []
-                            else:
-                                continue
-                        else:
-                            generic.append(n)
-                    elif n.startswith("%s_" % prefix):
-                        s3[n] = model
-                [module.__dict__[n](prefix) for n in generic]
+            S3Model.load_model(prefix, name)
         if name in s3:
             return s3[name]
         elif isinstance(default, Exception):
@@ -274,17 +317,12 @@ class S3Model(object):
         if "s3" not in response:
             response.s3 = Storage()
         s3 = response.s3
-        models = current.models
 
-        if models is not None and hasattr(models, name):
-            module = models.__dict__[name]
-            for n in module.__all__:
-                model = module.__dict__[n]
-                if type(model).__name__ == "type" and \
-                   issubclass(model, S3Model):
-                    model(name)
-                elif n.startswith("%s_" % name):
-                    s3[n] = model
+        index = S3Model.model_index(name)
+        if index is not None:
+            for model in index.models:
+                model(name)
+            s3.update(index.functions)
         return
 
     # -------------------------------------------------------------------------
@@ -312,15 +350,62 @@ class S3Model(object):
         """
             Same as db.define_table except that it does not repeat
             a table definition if the table is already defined.
+
+            Migration checks are run only once per process and table
+            definition: if the same definition has already been migrated
+            by this process, the table is defined with migrate=False
+            (skips reading the .table file and comparing the schema).
         """
 
         db = current.db
         if tablename in db:
             table = db[tablename]
         else:
+            key = signature = None
+            if getattr(db, "_migrate_enabled", True) and \
+               args.get("migrate", getattr(db, "_migrate", True)):
+                key = (getattr(db, "_uri_hash", None), tablename)
+                signature = S3Model.table_signature(fields, args)
+                if S3Model._migrated.get(key, None) == signature:
+                    args["migrate"] = False
+                    key = None
             table = db.define_table(tablename, *fields, **args)
+            if key is not None:
+                S3Model._migrated[key] = signature
         return table
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def table_signature(fields, args):
+        """
+            Get a hashable representation of the schema-relevant parts
+            of a table definition
+
+            @param fields: the fields (Fields, Tables or lists of these)
+            @param args: the table arguments
+        """
+
+        signature = []
+        append = signature.append
+        for field in fields:
+            if isinstance(field, Table):
+                signature.extend(S3Model.table_signature(list(field), {}))
+            elif isinstance(field, (list, tuple)):
+                signature.extend(S3Model.table_signature(field, {}))
+            elif isinstance(field, Field):
+                append((field.name,
+                        str(field.type),
+                        field.length,
+                        field.notnull,
+                        field.unique,
+                        field.ondelete))
+            else:
+                append(str(field))
+        for name in ("primarykey", "sequence_name", "polymodel"):
+            if name in args:
+                append((name, str(args[name])))
+        return tuple(signature)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def super_entity(tablename, key, types, *fields, **args):
@@ -688,6 +773,35 @@ class S3ModelExtensions(object):
             components[alias] = component
         return components
 
+    # -------------------------------------------------------------------------
+    def get_component_names(self, table):
+        """
+            Get the names (aliases) of the components of a table, without
+            loading the component models
+
+            @param table: the table or table name
+        """
+
+        if hasattr(table, "_tablename"):
+            tablename = table._tablename
+        else:
+            tablename = table
+        names = []
+        h = self.components.get(tablename, None)
+        if h:
+            names.extend(h.keys())
+        supertables = self.get_config(tablename, "super_entity")
+        if supertables:
+            if not isinstance(supertables, (list, tuple)):
+                supertables = [supertables]
+            for s in supertables:
+                if not isinstance(s, str):
+                    s = s._tablename
+                h = self.components.get(s, None)
+                if h:
+                    names.extend([alias for alias in h if alias not in names])
+        return names
+
     # -------------------------------------------------------------------------
     def has_components(self, table):
         """
@@ -882,7 +996,7 @@ class S3ModelExtensions(object):
         else:
             sequence_name = None
 
-        table = current.db.define_table(tablename,
+        table = S3Model.define_table(tablename,
                                      Field(key, "id",
                                            readable=False,
                                            writable=False),
@@ -935,7 +1049,9 @@ class S3ModelExtensions(object):
                    default=DEFAULT,
                    ondelete="CASCADE",
                    readable=False,
-                   writable=False):
+                   writable=False,
+                   lazy=False,
+                   cache_tables=None):
         """
             Get a foreign key field for a super-entity
 
@@ -944,6 +1060,9 @@ class S3ModelExtensions(object):
             @param comment: comment for the field
             @param readable: set the field readable
             @param represent: set a representation function for the field
+            @param lazy: validate by existence check (see IS_ONE_OF)
+            @param cache_tables: tables read by the representation
+                                 function (see IS_ONE_OF)
         """
 
         if isinstance(supertable, str):
@@ -967,7 +1086,9 @@ class S3ModelExtensions(object):
                                  sort=sort,
                                  groupby=groupby,
                                  filterby=filterby,
-                                 filter_opts=filter_opts)
+                                 filter_opts=filter_opts,
+                                 lazy=lazy,
+                                 cache_tables=cache_tables)
             if empty:
                 requires = IS_EMPTY_OR(requires)
 
@@ -86,6 +86,11 @@ class S3NavigationItem(object):
         For more details, see the S3Navigation wiki page.
     """
 
+    # Results of permission checks, re-used across requests
+    # {permission cache key: {item key: authorized}}
+    _permissions = {}
+    PERMISSION_CACHE_SIZE = 1000
+
     # -------------------------------------------------------------------------
     # Construction
     #
@@ -316,6 +321,29 @@ class S3NavigationItem(object):
         """
 
         auth = current.auth
+
+        # Look up the result for the current user's permissions
+        permissions = None
+        cache_key = auth.permission.cache_key()
+        if cache_key is not None:
+            cache = S3NavigationItem._permissions
+            permissions = cache.get(cache_key, None)
+            if permissions is None:
+                if len(cache) >= self.PERMISSION_CACHE_SIZE:
+                    cache.clear()
+                permissions = cache[cache_key] = {}
+            restrict = self.restrict
+            key = (restrict and tuple(restrict) or None,
+                   self.link,
+                   self.get("application"),
+                   self.get("controller"),
+                   self.get("function"),
+                   tuple(self.args),
+                   self.extension,
+                   self.p)
+            if key in permissions:
+                return permissions[key]
+
         has_role = auth.s3_has_role
 
         authorized = False
@@ -329,8 +357,11 @@ class S3NavigationItem(object):
         else:
             authorized = True
 
-        if self.accessible_url() == False:
+        if authorized and self.accessible_url() == False:
             authorized = False
+
+        if permissions is not None:
+            permissions[key] = authorized
         return authorized
 
     # -------------------------------------------------------------------------
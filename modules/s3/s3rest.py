@@ -45,6 +45,7 @@ import sys
 import datetime
 import time
 import HTMLParser
+import tempfile
 try:
     from cStringIO import StringIO    # Faster, where available
 except:
@@ -94,6 +95,10 @@ class S3RequestManager(object):
 
     MAX_DEPTH = 10
 
+    # Number of master records per page in streaming exports, and
+    # per window of component records in export_tree
+    EXPORT_PAGESIZE = 500
+
     # Prefixes of resources that must not be manipulated from remote
     # Can be amended from CLI using: s3mgr.PROTECTED = []
     PROTECTED = ("admin",)
@@ -470,19 +475,16 @@ class S3RequestManager(object):
         return text
 
     # -------------------------------------------------------------------------
-    def original(self, table, record):
+    def original_keys(self, table, record):
         """
-            Find the original record for a possible duplicate:
-                - if the record contains a UUID, then only that UUID is used
-                  to match the record with an existing DB record
-                - otherwise, if the record contains some values for unique
-                  fields, all of them must match the same existing DB record
+            Get the values of the unique fields (including the UUID) of
+            a record, to find its original (see original())
 
             @param table: the table
             @param record: the record as dict or S3XML Element
-        """
 
-        db = current.db
+            @returns: Storage {fieldname: value}
+        """
 
         xml = self.xml
         xml_decode = xml.xml_decode
@@ -519,6 +521,26 @@ class S3RequestManager(object):
         else:
             raise TypeError
 
+        return pvalues
+
+    # -------------------------------------------------------------------------
+    def original(self, table, record):
+        """
+            Find the original record for a possible duplicate:
+                - if the record contains a UUID, then only that UUID is used
+                  to match the record with an existing DB record
+                - otherwise, if the record contains some values for unique
+                  fields, all of them must match the same existing DB record
+
+            @param table: the table
+            @param record: the record as dict or S3XML Element
+        """
+
+        db = current.db
+        UID = self.xml.UID
+
+        pvalues = self.original_keys(table, record)
+
         # Build match query
         query = None
         for f in pvalues:
@@ -910,14 +932,10 @@ class S3Request(object):
 
         representation = self.extension
 
-        # Get the names of all components
+        # Get the names of all components (without loading their models)
         model = manager.model
         tablename = "%s_%s" % (self.prefix, self.name)
-        components = model.get_components(tablename)
-        if components:
-            components = components.keys()
-        else:
-            components = []
+        components = model.get_component_names(tablename)
 
         # Map request args, catch extensions
         f = []
@@ -1063,14 +1081,31 @@ class S3Request(object):
                 handler = self.__DELETE()
             else:
                 self.error(405, self.ERROR.BAD_METHOD)
-            # Invoke the method handler
-            if handler is not None:
-                output = handler(self, **attr)
-            elif self.method == "search":
-                output = self.resource.search(self, **attr)
-            else:
-                # Fall back to CRUD
-                output = self.resource.crud(self, **attr)
+            # Buffer the audit trail during the request
+            audit = manager.audit
+            if audit:
+                audit.begin()
+            try:
+                # Invoke the method handler
+                if handler is not None:
+                    output = handler(self, **attr)
+                elif self.method == "search":
+                    output = self.resource.search(self, **attr)
+                else:
+                    # Fall back to CRUD
+                    output = self.resource.crud(self, **attr)
+            except HTTP:
+                # Redirect or error response => transaction gets committed
+                if audit:
+                    audit.end()
+                raise
+            except:
+                # Transaction gets rolled back
+                if audit:
+                    audit.end(flush=False)
+                raise
+            if audit:
+                audit.end()
 
         # Post-process
         if hooks is not None:
@@ -1344,6 +1379,32 @@ class S3Request(object):
             default = "text/xml"
         headers["Content-Type"] = content_type.get(representation, default)
 
+        # Native S3XML and S3JSON (identity transformation) get streamed
+        if stylesheet is None:
+            stream = True
+        elif representation == "s3json":
+            import os
+            filename = "export.%s" % r.XSLT_EXTENSION
+            native = os.path.join(r.folder, r.XSLT_PATH, "s3json", filename)
+            stream = stylesheet == native
+        else:
+            stream = False
+
+        if stream:
+            chunks = resource.export_stream(start=start,
+                                            limit=limit,
+                                            msince=msince,
+                                            fields=fields,
+                                            dereference=True,
+                                            references=references,
+                                            mcomponents=mcomponents,
+                                            rcomponents=rcomponents,
+                                            as_json=as_json)
+            # Spool to disk while the DB connection is still open,
+            # then stream from the file
+            from gluon.streamer import streamer
+            return streamer(xml.spool(chunks))
+
         # Export the resource
         output = resource.export_xml(start=start,
                                      limit=limit,
@@ -2001,11 +2062,16 @@ class S3Resource(object):
         # The Rows
         self._rows = None
         self._rowindex = None
+        self._fkindex = None
+        self._reflookup = None
         self.rfields = None
         self.dfields = None
         self._ids = []
         self._uids = []
         self._length = None
+        self._wquery = None
+        # IDs of the records in the last sqltable
+        self.page_ids = []
 
         # Request attributes
         self.vars = None # set during build_query
@@ -2407,8 +2473,10 @@ class S3Resource(object):
         # Reset error
         manager.error = None
 
-        # Get all rows
-        if "uuid" in table.fields:
+        # Get all rows (with all fields for the audit trail)
+        if current.deployment_settings.get_security_audit_write():
+            rows = self.select(table.ALL)
+        elif "uuid" in table.fields:
             rows = self.select(table._id, table.uuid)
         else:
             rows = self.select(table._id)
@@ -2559,7 +2627,7 @@ class S3Resource(object):
                         clear_session(prefix=prefix, name=name)
                     # Audit
                     audit("delete", prefix, name,
-                          record=row[pkey], representation=format)
+                          record=row, representation=format)
                     # Delete super-entity
                     delete_super(table, row)
                     # On-delete hook
@@ -2590,7 +2658,7 @@ class S3Resource(object):
                         clear_session(prefix=prefix, name=name)
                     # Audit
                     audit("delete", prefix, name,
-                          record=row[pkey], representation=format)
+                          record=row, representation=format)
                     # Delete super-entity
                     delete_super(table, row)
                     # On-delete hook
@@ -2632,6 +2700,8 @@ class S3Resource(object):
 
         self._rows = None
         self._rowindex = None
+        self._fkindex = None
+        self._reflookup = None
         self._length = None
         self._ids = []
         self._uids = []
@@ -2717,16 +2787,86 @@ class S3Resource(object):
                 raise AttributeError("Undefined component %s" % component)
             if c._rows is None:
                 c.load()
-            rows = c._rows
-            pkey, fkey = c.pkey, c.fkey
-            master_id = master[pkey]
-            if c.link:
-                lkey, rkey = c.lkey, c.rkey
-                lids = [r[rkey] for r in c.link if master_id == r[lkey]]
-                rows = [record for record in rows if record[fkey] in lids]
+            index = c._fkindex
+            if index is None:
+                index = c._fkindex = c.__index_components()
+            master_id = master[c.pkey]
+            if master_id in index:
+                return list(index[master_id])
             else:
-                rows = [record for record in rows if master_id == record[fkey]]
-            return rows
+                return []
+
+    # -------------------------------------------------------------------------
+    def __index_components(self):
+        """
+            Groups the loaded records of this component by the primary
+            key of their master record (resolving the link table, if any),
+            so that __call__ doesn't need to scan all rows per master
+
+            @returns: a dict {master ID: [records]}
+        """
+
+        index = dict()
+        fkey = self.fkey
+        link = self.link
+        if link is not None:
+            # Masters per linked record
+            lkey, rkey = self.lkey, self.rkey
+            masters = dict()
+            for r in link:
+                rid = r[rkey]
+                if rid in masters:
+                    masters[rid].add(r[lkey])
+                else:
+                    masters[rid] = set([r[lkey]])
+            for record in self._rows:
+                rid = record[fkey]
+                if rid not in masters:
+                    continue
+                for master_id in masters[rid]:
+                    if master_id in index:
+                        index[master_id].append(record)
+                    else:
+                        index[master_id] = [record]
+        else:
+            for record in self._rows:
+                master_id = record[fkey]
+                if master_id in index:
+                    index[master_id].append(record)
+                else:
+                    index[master_id] = [record]
+        return index
+
+    # -------------------------------------------------------------------------
+    def __window(self, ids=None):
+        """
+            Restricts the components of this resource to a subset of the
+            master records, so that component records get loaded window
+            by window rather than all at once (memory-bounded exports)
+
+            @param ids: the master record IDs, None to remove the restriction
+        """
+
+        rfilter = self.rfilter
+        if rfilter is None:
+            return
+        query = self._wquery
+        if ids is None:
+            if query is not None:
+                rfilter.query = query
+                self._wquery = None
+        else:
+            if query is None:
+                query = self._wquery = rfilter.query
+            rfilter.query = query & self.table._id.belongs(ids)
+
+        # Component filters are built from the master query
+        for c in self.components.values():
+            c.clear()
+            c.rfilter = None
+            if c.link is not None:
+                c.link.clear()
+                c.link.rfilter = None
 
     # -------------------------------------------------------------------------
     def get_id(self):
@@ -2952,6 +3092,282 @@ class S3Resource(object):
 
         return output
 
+    # -------------------------------------------------------------------------
+    def export_stream(self,
+                      start=0,
+                      limit=None,
+                      skip=[],
+                      msince=None,
+                      fields=None,
+                      dereference=True,
+                      mcomponents=[],
+                      rcomponents=None,
+                      references=None,
+                      as_json=False,
+                      pagesize=None):
+        """
+            Export this resource as S3XML (or S3JSON) page by page, without
+            building the complete element tree in memory. Referenced records
+            are exported after the master records, each of them only once.
+
+            @param start: index of the first record to export (slicing)
+            @param limit: maximum number of records to export (slicing)
+            @param skip: list of fieldnames to skip
+            @param msince: export only records which have been modified
+                            after this datetime
+            @param fields: data fields to include (default: all)
+            @param dereference: include referenced resources
+            @param mcomponents: components of the master resource to
+                                include (list of tablenames), empty list
+                                for all
+            @param rcomponents: components of referenced resources to
+                                include (list of tablenames), empty list
+                                for all
+            @param references: foreign keys to include (default: all)
+            @param as_json: represent the output as S3JSON
+            @param pagesize: number of master records per page
+
+            @note: for GIS formats, the locations are looked up page by
+                   page (as in export_tree for the whole resource)
+
+            @returns: a generator of strings
+
+            @note: the "results" attribute of the root element is the
+                   number of matching master records, i.e. not reduced
+                   by records which are skipped due to msince
+            @note: in S3JSON, master records are streamed, while referenced
+                   records of other tables are spooled to temporary files
+                   and written at the end of the output (in order to group
+                   them by table)
+        """
+
+        manager = current.manager
+        xml = manager.xml
+        gis = current.gis
+        request = current.request
+
+        if pagesize is None:
+            pagesize = manager.EXPORT_PAGESIZE
+        if start is None:
+            start = 0
+
+        if manager.show_urls:
+            base_url = manager.s3.base_url
+        else:
+            base_url = None
+
+        # Filter for MCI >= 0 (setting)
+        table = self.table
+        if xml.filter_mci and "mci" in table.fields:
+            mci_filter = (table.mci >= 0)
+            self.add_filter(mci_filter)
+
+        # Split reference/data fields
+        (rfields, dfields) = self.split_fields(skip=skip,
+                                               data=fields,
+                                               references=references)
+
+        # Total number of results
+        results = self.count()
+        if limit is None:
+            end = results
+        else:
+            end = min(results, start + limit)
+
+        marker = gis.get_marker(request.controller, request.function)
+        locations = None
+        geo = current.auth.permission.format in ("geojson", "georss", "kml")
+
+        # Root element (attributes only)
+        root = xml.tree(None,
+                        root=etree.Element(xml.TAG.root),
+                        domain=manager.domain,
+                        url=base_url,
+                        results=results,
+                        start=start,
+                        limit=limit).getroot()
+        root.set(xml.ATTRIBUTE.success, json.dumps(results > 0))
+
+        tablename = self.tablename
+        if as_json:
+            PREFIX = xml.PREFIX
+            attributes = dict([("%s%s" % (PREFIX.attribute, k), v)
+                               for k, v in root.attrib.items()])
+            key = lambda tn: json.dumps("%s_%s" % (PREFIX.resource, tn))
+            yield "%s, %s: [" % (json.dumps(attributes)[:-1], key(tablename))
+            serialize = xml.resource2json
+            tail = "}"
+        else:
+            root.text = "\n"
+            head, tail = xml.tostring(root).rsplit("</%s>" % root.tag, 1)
+            yield head
+            serialize = lambda e: etree.tostring(e,
+                                                 xml_declaration=False,
+                                                 encoding="utf-8",
+                                                 pretty_print=True)
+            tail = "</%s>%s" % (root.tag, tail)
+
+        # Compact map of all exported records {tablename: set of IDs}
+        exported = dict()
+        def mark_exported(export_map):
+            for tn in export_map:
+                if tn in exported:
+                    exported[tn] |= export_map[tn]
+                else:
+                    exported[tn] = export_map[tn]
+
+        # Map of referenced records {tablename: set of IDs}
+        referenced = dict()
+        def add_references(reference_map):
+            for ref in reference_map:
+                if "table" in ref and "id" in ref:
+                    ids = ref["id"]
+                    if not isinstance(ids, list):
+                        ids = [ids]
+                    tn = ref["table"]
+                    if tn in referenced:
+                        referenced[tn].update(ids)
+                    else:
+                        referenced[tn] = set(ids)
+
+        # Master records (and their components), page by page
+        prefix = self.prefix
+        name = self.name
+        if base_url:
+            url = "%s/%s/%s" % (base_url, prefix, name)
+        else:
+            url = "/%s/%s" % (prefix, name)
+        buffers = dict()
+        first = True
+        window = self.__window
+        export_resource = self.__export_resource
+        try:
+            for page_start in xrange(start, end, pagesize):
+                window(None)
+                self.load(start=page_start,
+                          limit=min(pagesize, end - page_start))
+                if not self._rows:
+                    break
+                # Load the components of this page's master records only
+                window(self._ids)
+                if geo:
+                    # Look up the locations of this page's records
+                    marker, locations = self.__export_locations()
+                page = etree.Element(xml.TAG.root)
+                export_map = Storage()
+                reference_map = []
+                for record in self._rows:
+                    export_resource(record,
+                                    rfields=rfields,
+                                    dfields=dfields,
+                                    parent=page,
+                                    base_url=url,
+                                    reference_map=reference_map,
+                                    export_map=export_map,
+                                    components=mcomponents,
+                                    skip=skip,
+                                    msince=msince,
+                                    marker=marker,
+                                    locations=locations)
+                mark_exported(export_map)
+                add_references(reference_map)
+                chunks = [serialize(e) for e in page]
+                if chunks:
+                    if as_json:
+                        if not first:
+                            yield ","
+                        first = False
+                        yield ",".join(chunks)
+                    else:
+                        yield "".join(chunks)
+                self.clear()
+        finally:
+            window(None)
+
+        # Referenced records
+        REF = xml.ATTRIBUTE.ref
+        depth = dereference and manager.MAX_DEPTH or 0
+        try:
+            while referenced and depth:
+                depth -= 1
+                load_map = referenced
+                referenced = dict()
+                for tn in load_map:
+                    ids = load_map[tn]
+                    if tn in exported:
+                        ids = ids - exported[tn]
+                    ids.discard(None)
+                    if not ids:
+                        continue
+                    ids = sorted(ids)
+                    prefix, name = tn.split("_", 1)
+                    if manager.s3.base_url:
+                        url = "%s/%s/%s" % (manager.s3.base_url, prefix, name)
+                    else:
+                        url = "/%s/%s" % (prefix, name)
+                    for i in xrange(0, len(ids), pagesize):
+                        rresource = manager.define_resource(prefix, name,
+                                                            id=ids[i:i+pagesize],
+                                                            components=[])
+                        rfields, dfields = rresource.split_fields(skip=skip,
+                                                                  data=fields,
+                                                                  references=references)
+                        rresource.load()
+                        page = etree.Element(xml.TAG.root)
+                        export_map = Storage()
+                        reference_map = []
+                        export_resource = rresource.__export_resource
+                        for record in rresource:
+                            element = export_resource(record,
+                                                      rfields=rfields,
+                                                      dfields=dfields,
+                                                      parent=page,
+                                                      base_url=url,
+                                                      reference_map=reference_map,
+                                                      export_map=export_map,
+                                                      components=rcomponents,
+                                                      skip=skip,
+                                                      marker=marker,
+                                                      locations=locations)
+                            # Mark as referenced element (for XSLT)
+                            if element is not None:
+                                element.set(REF, "True")
+                        mark_exported(export_map)
+                        add_references(reference_map)
+                        chunks = [serialize(e) for e in page]
+                        if not chunks:
+                            continue
+                        if not as_json:
+                            yield "".join(chunks)
+                        elif tn == tablename:
+                            if not first:
+                                yield ","
+                            first = False
+                            yield ",".join(chunks)
+                        elif tn in buffers:
+                            buffers[tn].write(",%s" % ",".join(chunks))
+                        else:
+                            spool = tempfile.TemporaryFile()
+                            spool.write(",".join(chunks))
+                            buffers[tn] = spool
+
+            if as_json:
+                yield "]"
+                for tn in buffers:
+                    spool = buffers[tn]
+                    spool.seek(0)
+                    yield ", %s: [" % key(tn)
+                    while True:
+                        block = spool.read(65536)
+                        if not block:
+                            break
+                        yield block
+                    yield "]"
+        finally:
+            for spool in buffers.values():
+                spool.close()
+        yield tail
+
     # -------------------------------------------------------------------------
     def export_tree(self,
                     start=0,
@@ -2982,7 +3398,6 @@ class S3Resource(object):
         """
 
         db = current.db
-        gis = current.gis
 
         manager = current.manager
         model = manager.model
@@ -3011,8 +3426,166 @@ class S3Resource(object):
         # Load slice
         self.load(start=start, limit=limit)
 
-        format = current.auth.permission.format
+        # Markers and locations (GIS formats)
+        marker, locations = self.__export_locations()
+
+        # Buffer the audit trail of the exported records
+        if audit:
+            audit.begin()
+
+        try:
+            # Build the tree
+            if DEBUG:
+                _start = datetime.datetime.now()
+            root = etree.Element(xml.TAG.root)
+            export_map = Storage()
+            reference_map = []
+            prefix = self.prefix
+            name = self.name
+            if base_url:
+                url = "%s/%s/%s" % (base_url, prefix, name)
+            else:
+                url = "/%s/%s" % (prefix, name)
+            rows = self._rows
+            numrows = len(rows)
+            pagesize = manager.EXPORT_PAGESIZE
+            if mcomponents is not None and numrows > pagesize:
+                # Load the components window by window (memory-bounded)
+                window = self.__window
+            else:
+                window = None
+                pagesize = max(numrows, 1)
+            pkey = table._id.name
+            export_resource = self.__export_resource
+            try:
+                for i in xrange(0, numrows, pagesize):
+                    j = min(i + pagesize, numrows)
+                    if window is not None:
+                        window([rows[k][pkey] for k in xrange(i, j)])
+                    for k in xrange(i, j):
+                        element = export_resource(rows[k],
+                                                  rfields=rfields,
+                                                  dfields=dfields,
+                                                  parent=root,
+                                                  base_url=url,
+                                                  reference_map=reference_map,
+                                                  export_map=export_map,
+                                                  components=mcomponents,
+                                                  skip=skip,
+                                                  msince=msince,
+                                                  marker=marker,
+                                                  locations=locations)
+                        if element is None:
+                            results -= 1
+            finally:
+                if window is not None:
+                    window(None)
+            if DEBUG:
+                end = datetime.datetime.now()
+                duration = end - _start
+                duration = '{:.2f}'.format(duration.total_seconds())
+                _debug("export_resource of primary resource and components completed in %s seconds" % \
+                    duration)
+
+            # Add referenced resources to the tree
+            if DEBUG:
+                _start = datetime.datetime.now()
+            depth = dereference and manager.MAX_DEPTH or 0
+            while reference_map and depth:
+                depth -= 1
+                load_map = dict()
+                for ref in reference_map:
+                    if "table" in ref and "id" in ref:
+                        tname = ref["table"]
+                        ids = ref["id"]
+                        if not isinstance(ids, list):
+                            ids = [ids]
+                        # Collect the new ids in load_map[tname]
+                        if tname in load_map:
+                            load_map[tname].update(ids)
+                        else:
+                            load_map[tname] = set(ids)
+
+                reference_map = []
+                REF = xml.ATTRIBUTE.ref
+                for tablename in load_map:
+                    # Exclude records which are already in the tree
+                    load_set = load_map[tablename]
+                    if tablename in export_map:
+                        load_set -= export_map[tablename]
+                    load_set.discard(None)
+                    if not load_set:
+                        continue
+                    load_list = sorted(load_set)
+                    prefix, name = tablename.split("_", 1)
+                    rresource = manager.define_resource(prefix, name,
+                                                        id=load_list,
+                                                        components=[])
+                    table = rresource.table
+                    if manager.s3.base_url:
+                        url = "%s/%s/%s" % (manager.s3.base_url, prefix, name)
+                    else:
+                        url = "/%s/%s" % (prefix, name)
+                    rfields, dfields = rresource.split_fields(skip=skip,
+                                                              data=fields,
+                                                              references=references)
+                    rresource.load()
+                    export_resource = rresource.__export_resource
+                    for record in rresource:
+                        element = export_resource(record,
+                                                  rfields=rfields,
+                                                  dfields=dfields,
+                                                  parent=root,
+                                                  base_url=url,
+                                                  reference_map=reference_map,
+                                                  export_map=export_map,
+                                                  components=rcomponents,
+                                                  skip=skip,
+                                                  marker=marker,
+                                                  locations=locations)
+
+                        # Mark as referenced element (for XSLT)
+                        if element is not None:
+                            element.set(REF, "True")
+            if DEBUG:
+                end = datetime.datetime.now()
+                duration = end - _start
+                duration = '{:.2f}'.format(duration.total_seconds())
+                _debug("export_resource of referenced resources and their components completed in %s seconds" % \
+                    duration)
+        except:
+            # Discard the audit trail
+            if audit:
+                audit.end(flush=False)
+            raise
+
+        # Write the audit trail
+        if audit:
+            audit.end()
+
+        # Complete the tree
+        tree = xml.tree(None,
+                        root=root,
+                        domain=manager.domain,
+                        url=base_url,
+                        results=results,
+                        start=start,
+                        limit=limit)
+        return tree
+
+    # -------------------------------------------------------------------------
+    def __export_locations(self):
+        """
+            Get the marker and the locations (for GIS formats) for the
+            export of the currently loaded records
+
+            @returns: tuple (marker, locations)
+        """
+
+        gis = current.gis
         request = current.request
+
+        format = current.auth.permission.format
         if format == "geojson":
             # Marker will be added in show_map()
             marker = None
@@ -3037,118 +3610,7 @@ class S3Resource(object):
             marker = gis.get_marker(request.controller,
                                     request.function)
             locations = None
-
-        # Build the tree
-        if DEBUG:
-            _start = datetime.datetime.now()
-        root = etree.Element(xml.TAG.root)
-        export_map = Storage()
-        reference_map = []
-        prefix = self.prefix
-        name = self.name
-        if base_url:
-            url = "%s/%s/%s" % (base_url, prefix, name)
-        else:
-            url = "/%s/%s" % (prefix, name)
-        export_resource = self.__export_resource
-        for record in self._rows:
-            element = export_resource(record,
-                                      rfields=rfields,
-                                      dfields=dfields,
-                                      parent=root,
-                                      base_url=url,
-                                      reference_map=reference_map,
-                                      export_map=export_map,
-                                      components=mcomponents,
-                                      skip=skip,
-                                      msince=msince,
-                                      marker=marker,
-                                      locations=locations)
-            if element is None:
-                results -= 1
-        if DEBUG:
-            end = datetime.datetime.now()
-            duration = end - _start
-            duration = '{:.2f}'.format(duration.total_seconds())
-            _debug("export_resource of primary resource and components completed in %s seconds" % \
-                duration)
-
-        # Add referenced resources to the tree
-        if DEBUG:
-            _start = datetime.datetime.now()
-        depth = dereference and manager.MAX_DEPTH or 0
-        while reference_map and depth:
-            depth -= 1
-            load_map = dict()
-            get_exported = export_map.get
-            for ref in reference_map:
-                if "table" in ref and "id" in ref:
-                    tname = ref["table"]
-                    ids = ref["id"]
-                    if not isinstance(ids, list):
-                        ids = [ids]
-                    # Exclude records which are already in the tree
-                    exported = get_exported(tname, [])
-                    ids = [x for x in ids if x not in exported]
-                    if not ids:
-                        continue
-                    # Append the new ids to load_map[tname]
-                    if tname in load_map:
-                        ids = [x for x in ids if x not in load_map[tname]]
-                        load_map[tname] += ids
-                    else:
-                        load_map[tname] = ids
-
-            reference_map = []
-            REF = xml.ATTRIBUTE.ref
-            for tablename in load_map:
-                load_list = load_map[tablename]
-                prefix, name = tablename.split("_", 1)
-                rresource = manager.define_resource(prefix, name,
-                                                    id=load_list,
-                                                    components=[])
-                table = rresource.table
-                if manager.s3.base_url:
-                    url = "%s/%s/%s" % (manager.s3.base_url, prefix, name)
-                else:
-                    url = "/%s/%s" % (prefix, name)
-                rfields, dfields = rresource.split_fields(skip=skip,
-                                                          data=fields,
-                                                          references=references)
-                rresource.load()
-                export_resource = rresource.__export_resource
-                for record in rresource:
-                    element = export_resource(record,
-                                              rfields=rfields,
-                                              dfields=dfields,
-                                              parent=root,
-                                              base_url=url,
-                                              reference_map=reference_map,
-                                              export_map=export_map,
-                                              components=rcomponents,
-                                              skip=skip,
-                                              marker=marker,
-                                              locations=locations)
-
-                    # Mark as referenced element (for XSLT)
-                    if element is not None:
-                        element.set(REF, "True")
-        if DEBUG:
-            end = datetime.datetime.now()
-            duration = end - _start
-            duration = '{:.2f}'.format(duration.total_seconds())
-            _debug("export_resource of referenced resources and their components completed in %s seconds" % \
-                duration)
-
-        # Complete the tree
-        tree = xml.tree(None,
-                        root=root,
-                        domain=manager.domain,
-                        url=base_url,
-                        results=results,
-                        start=start,
-                        limit=limit)
-        return tree
+        return (marker, locations)
 
     # -------------------------------------------------------------------------
     def __export_resource(self,
@@ -3177,6 +3639,7 @@ class S3Resource(object):
             @param base_url: the base URL of the resource
             @param reference_map: the reference map of the request
             @param export_map: the export map of the request
+                              ({tablename: set of record IDs})
             @param components: list of components to include from referenced
                                resources (tablenames)
             @param skip: fields to skip
@@ -3342,8 +3805,14 @@ class S3Resource(object):
             audit("read", prefix, name,
                   record=record[table._id], representation="xml")
 
+        # Resolve the references of all loaded records at once
+        lookup = self._reflookup
+        if lookup is None and self._rows:
+            lookup = xml.lookup(table, self._rows, rfields)
+            self._reflookup = lookup
+
         # Reference map for this record
-        rmap = xml.rmap(table, record, rfields)
+        rmap = xml.rmap(table, record, rfields, lookup=lookup)
 
         # Generate the element
         element = xml.resource(parent, table, record,
@@ -3370,6 +3839,7 @@ class S3Resource(object):
             @param rmap: the reference map of the record
             @param reference_map: the reference map of the request
             @param export_map: the export map of the request
+                              ({tablename: set of record IDs})
         """
 
         tablename = self.tablename
@@ -3378,9 +3848,9 @@ class S3Resource(object):
         if rmap:
             reference_map.extend(rmap)
         if tablename in export_map:
-            export_map[tablename].append(record_id)
+            export_map[tablename].add(record_id)
         else:
-            export_map[tablename] = [record_id]
+            export_map[tablename] = set([record_id])
         return
 
     # -------------------------------------------------------------------------
@@ -3401,6 +3871,9 @@ class S3Resource(object):
                    conflict_policy=None,
                    last_sync=None,
                    onconflict=None,
+                   bulk=False,
+                   chunk_size=None,
+                   onprogress=None,
                    **args):
         """
             XML Importer
@@ -3422,6 +3895,12 @@ class S3Resource(object):
             @param conflict_policy: policy for conflict resolution (sync)
             @param last_sync: last synchronization datetime (sync)
             @param onconflict: callback hook for conflict resolution (sync)
+            @param bulk: commit in bulk mode (see S3ImportJob)
+            @param chunk_size: for CSV imports, import and commit the source
+                               in chunks of this number of rows (see
+                               import_chunks)
+            @param onprogress: callback function onprogress(job), called
+                               after each batch of committed items
             @param args: parameters to pass to the transformation stylesheet
         """
 
@@ -3430,6 +3909,7 @@ class S3Resource(object):
         permit = manager.permit
 
         tree = None
+        chunks = None
 
         self.job = None
 
@@ -3456,6 +3936,10 @@ class S3Resource(object):
                         name=name,
                         utcnow=utcnow)
 
+            # CSV sources can be imported in chunks
+            if chunk_size and format == "csv" and commit_job:
+                chunks = []
+
             # Build import tree
             if not isinstance(source, (list, tuple)):
                 source = [source]
@@ -3464,6 +3948,10 @@ class S3Resource(object):
                     resourcename, s = item[:2]
                 else:
                     resourcename, s = None, item
+                if chunks is not None and \
+                   not isinstance(s, etree._ElementTree):
+                    chunks.append((resourcename, s))
+                    continue
                 if isinstance(s, etree._ElementTree):
                     t = s
                 elif format == "json":
@@ -3502,16 +3990,35 @@ class S3Resource(object):
             # job ID given
             pass
 
-        success = self.import_tree(id, tree,
-                                   ignore_errors=ignore_errors,
-                                   job_id=job_id,
-                                   commit_job=commit_job,
-                                   delete_job=delete_job,
-                                   strategy=strategy,
-                                   update_policy=update_policy,
-                                   conflict_policy=conflict_policy,
-                                   last_sync=last_sync,
-                                   onconflict=onconflict)
+        if chunks:
+            if tree is not None:
+                # Import the element tree sources first
+                chunks.insert(0, (None, etree.ElementTree(tree)))
+            success = self.import_chunks(id, chunks, chunk_size,
+                                         stylesheet=stylesheet,
+                                         extra_data=extra_data,
+                                         ignore_errors=ignore_errors,
+                                         strategy=strategy,
+                                         update_policy=update_policy,
+                                         conflict_policy=conflict_policy,
+                                         last_sync=last_sync,
+                                         onconflict=onconflict,
+                                         bulk=bulk,
+                                         onprogress=onprogress,
+                                         **args)
+        else:
+            success = self.import_tree(id, tree,
+                                       ignore_errors=ignore_errors,
+                                       job_id=job_id,
+                                       commit_job=commit_job,
+                                       delete_job=delete_job,
+                                       strategy=strategy,
+                                       update_policy=update_policy,
+                                       conflict_policy=conflict_policy,
+                                       last_sync=last_sync,
+                                       onconflict=onconflict,
+                                       bulk=bulk,
+                                       onprogress=onprogress)
 
         self.files = Storage()
 
@@ -3543,7 +4050,10 @@ class S3Resource(object):
                     update_policy=None,
                     conflict_policy=None,
                     last_sync=None,
-                    onconflict=None):
+                    onconflict=None,
+                    bulk=False,
+                    uid_cache=None,
+                    onprogress=None):
         """
             Import data from an S3XML element tree.
 
@@ -3554,6 +4064,9 @@ class S3Resource(object):
             @param job_id: restore a job from the job table (ID or UID)
             @param delete_job: delete the import job from the job table
             @param commit_job: commit the job (default)
+            @param bulk: commit in bulk mode (see S3ImportJob)
+            @param uid_cache: UID cache shared between chunks (see S3ImportJob)
+            @param onprogress: progress callback (see S3ImportJob)
 
             @todo: update for link table support
         """
@@ -3578,7 +4091,9 @@ class S3Resource(object):
                                          update_policy=update_policy,
                                          conflict_policy=conflict_policy,
                                          last_sync=last_sync,
-                                         onconflict=onconflict)
+                                         onconflict=onconflict,
+                                         bulk=bulk,
+                                         onprogress=onprogress)
             except:
                 self.error = self.ERROR.BAD_SOURCE
                 return False
@@ -3690,7 +4205,10 @@ class S3Resource(object):
                                      update_policy=update_policy,
                                      conflict_policy=conflict_policy,
                                      last_sync=last_sync,
-                                     onconflict=onconflict)
+                                     onconflict=onconflict,
+                                     bulk=bulk,
+                                     uid_cache=uid_cache,
+                                     onprogress=onprogress)
             add_item = import_job.add_item
             for element in elements:
                 success = add_item(element=element,
@@ -3720,6 +4238,92 @@ class S3Resource(object):
 
         return self.error is None or ignore_errors
 
+    # -------------------------------------------------------------------------
+    def import_chunks(self, id, sources, chunk_size,
+                      stylesheet=None,
+                      extra_data=None,
+                      ignore_errors=False,
+                      **args):
+        """
+            Import CSV sources in chunks of rows: every chunk is transformed,
+            imported and committed on its own, so that neither the source
+            tree nor the import job ever hold more than one chunk. References
+            to records of previous chunks are resolved via a UID cache shared
+            by all chunks.
+
+            NB: chunks which have been committed remain in the database if
+                a later chunk fails
+
+            @param id: record ID or list of record IDs to update
+            @param sources: list of tuples (resourcename, source), where
+                            source is a CSV file-like object or an ElementTree
+                            (which is imported as-is)
+            @param chunk_size: the number of rows per chunk
+            @param stylesheet: stylesheet to transform the chunks
+            @param extra_data: dict of extra cols to add to each row
+            @param ignore_errors: skip invalid records
+
+            @param args: parameters for import_tree and the stylesheet
+        """
+
+        db = current.db
+        xml = current.manager.xml
+
+        import_args = {}
+        for k in ("strategy",
+                  "update_policy",
+                  "conflict_policy",
+                  "last_sync",
+                  "onconflict",
+                  "bulk",
+                  "onprogress"):
+            if k in args:
+                import_args[k] = args.pop(k)
+
+        def chunks():
+            for resourcename, source in sources:
+                if isinstance(source, etree._ElementTree):
+                    yield source
+                    continue
+                for t in xml.csv2trees(source,
+                                       resourcename=resourcename,
+                                       extra_data=extra_data,
+                                       chunk_size=chunk_size):
+                    if not len(t.getroot()):
+                        continue
+                    if stylesheet is not None:
+                        t = xml.transform(t, stylesheet, **args)
+                        _debug(t)
+                        if not t:
+                            raise SyntaxError(xml.error)
+                    yield t
+
+        uid_cache = {}
+        error = None
+        error_tree = None
+        success = True
+        for t in chunks():
+            success = self.import_tree(id, t.getroot(),
+                                       ignore_errors=ignore_errors,
+                                       uid_cache=uid_cache,
+                                       **import_args)
+            if self.error:
+                error = self.error
+            if self.error_tree is not None:
+                if error_tree is None:
+                    error_tree = self.error_tree
+                else:
+                    error_tree.extend(list(self.error_tree))
+            if success:
+                db.commit()
+            else:
+                db.rollback()
+                break
+
+        self.error = error
+        self.error_tree = error_tree
+        return success
+
     # -------------------------------------------------------------------------
     # XML introspection
     # -------------------------------------------------------------------------
@@ -4542,6 +5146,8 @@ class S3Resource(object):
         manager = current.manager
         table = self.table
 
+        self.page_ids = []
+
         # Get the query and filters
         query = self.get_query()
         vfltr = self.get_filter()
@@ -4662,6 +5268,17 @@ class S3Resource(object):
         if not rows:
             # No records found
             return None
+
+        # Remember the record IDs (e.g. for per-row permission checks)
+        tablename = table._tablename
+        pkey = table._id.name
+        page_ids = []
+        for row in rows:
+            if tablename in row and isinstance(row[tablename], Row):
+                row = row[tablename]
+            page_ids.append(row.get(pkey, None))
+        self.page_ids = page_ids
+
         if as_rows:
             # No rendering - return bare Rows
             return rows
@@ -5246,6 +5863,14 @@ class S3ResourceFilter:
                                           (gtable.lon < float(maxLon)) & \
                                           (gtable.lat > float(minLat)) & \
                                           (gtable.lat < float(maxLat))
+                            if gtable._tablename == "gis_location":
+                                # Use the Location Index, if enabled
+                                index = current.gis.location_index
+                                bbox_filter = index.restrict(bbox_filter,
+                                                             float(minLon),
+                                                             float(minLat),
+                                                             float(maxLon),
+                                                             float(maxLat))
                         if fname is not None:
                             # Need a join
                             join = (gtable.id == table[fname])
@@ -910,43 +910,26 @@ class S3SearchLocationWidget(S3SearchWidget):
             @param value: the value returned from the widget: WKT format
         """
 
-        #gis = current.gis
-        # table = resource.table
-        # s3db = current.s3db
-        # locations = s3db.gis_location
-
-        # Get master query and search fields
-        #self.build_master_query(resource)
-        #master_query = self.master_query
-
         if value:
             # @ToDo: Turn this into a Resource filter
-            #features = gis.get_features_in_polygon(value,
-            #                                       tablename=resource.tablename)
+            gis = current.gis
+            shape = value
+            if SHAPELY:
+                try:
+                    shape = wkt_loads(value)
+                except:
+                    s3_debug("WARNING: s3search: Invalid WKT")
+                    return None
 
-            # @ToDo: A PostGIS routine, where-available
-            #        - requires a Spatial DAL?
-            try:
-                shape = wkt_loads(value)
-            except:
-                s3_debug("WARNING: s3search: Invalid WKT")
+            # Return all locations which have a part of themselves inside
+            # the shape (evaluated by the spatial database where available)
+            query = gis.spatial_query("intersects", shape)
+            if query is None:
                 return None
-
-            bounds = shape.bounds
-            lon_min = bounds[0]
-            lat_min = bounds[1]
-            lon_max = bounds[2]
-            lat_max = bounds[3]
-
-            # Return all locations which have a part of themselves inside the BBOX
-            # This requires the locations to have their bounds set properly
-            # This can be done globally using:
-            # gis.update_location_tree()
-            query = (S3FieldSelector("location_id$lat_min") <= lat_max) & \
-                    (S3FieldSelector("location_id$lat_max") >= lat_min) & \
-                    (S3FieldSelector("location_id$lon_min") <= lon_max) & \
-                    (S3FieldSelector("location_id$lon_max") >= lon_min)
-            return query
+            # Sub-select rather than a list of IDs
+            table = current.s3db.gis_location
+            locations = current.db(query)._select(table.id)
+            return S3FieldSelector("location_id").belongs(locations)
         else:
             return None
 
@@ -1438,6 +1421,7 @@ $('#%s').live('click', function() {
                                   linkto=linkto,
                                   download_url=self.download_url,
                                   format=representation)
+        page_ids = list(resource.page_ids)
 
         # Remove the dataTables search box to avoid confusion
         s3.dataTable_NobFilter = True
@@ -1460,6 +1444,8 @@ $('#%s').live('click', function() {
                                                  download_url=self.download_url,
                                                  as_page=True,
                                                  format=representation)
+                    page_ids.extend([i for i in resource.page_ids
+                                     if i not in page_ids])
 
                     aadata = dict(aaData=sqltable or [])
                     aadata.update(iTotalRecords=totalrows,
@@ -1471,6 +1457,9 @@ $('#%s').live('click', function() {
         elif not items:
             items = self.crud_string(tablename, "msg_no_match")
 
+        # Records on the initial page (for per-row action buttons)
+        s3.dataTable_ids = page_ids
+
         output["items"] = items
         output["sortby"] = sortby
 
@@ -33,9 +33,13 @@
 __all__ = ["S3Sync", "S3SyncLog"]
 
 import sys
+import gzip
 import json
+import shutil
+import urllib
 import urllib2
 import datetime
+import tempfile
 import time
 
 try:
@@ -64,6 +68,13 @@ else:
 class S3Sync(S3Method):
     """ S3 Synchronization Toolkit """
 
+    # Version of the protocol extensions (paging, compression), sent to
+    # peers in the X-Sync-Protocol header
+    PROTOCOL = "1"
+
+    # Number of master records per page
+    PAGESIZE = 500
+
     # -------------------------------------------------------------------------
     def __init__(self):
         """
@@ -193,6 +204,7 @@ class S3Sync(S3Method):
         tasks = db(query).select()
         for task in tasks:
             now = datetime.datetime.utcnow()
+            error = None
             if task.mode in (1, 3):
                 error = self.__pull(repository, task)
             if error:
@@ -206,7 +218,9 @@ class S3Sync(S3Method):
                                     (task.resource_name, error))
                 continue
             _debug("S3Sync.synchronize: %s success" % task.resource_name)
-            task.update_record(last_sync=now)
+            task.update_record(last_sync=now,
+                               pull_cursor=None,
+                               push_cursor=None)
 
         # Success
         return xml.json_message()
@@ -216,11 +230,18 @@ class S3Sync(S3Method):
         """
             Outgoing pull
 
+            The data are requested page by page (see page()), and every
+            page is committed after import. The cursor of the last page
+            is stored in the task, so that an interrupted pull resumes
+            after the last committed page. Peers which do not support
+            paging send all data in response to the first request.
+
             @param repository: the repository (sync_repository row)
             @param task: the task (sync_task row)
         """
 
         ignore_errors = True
+        db = current.db
         manager = current.manager
         xml = manager.xml
 
@@ -231,12 +252,9 @@ class S3Sync(S3Method):
 
         # Construct the URL
         config = self.__get_config()
-        proxy = repository.proxy or config.proxy or None
         url = "%s/sync/sync.xml?resource=%s&repository=%s" % \
               (repository.url, resource_name, config.uuid)
 
-        username = repository.username
-        password = repository.password
         last_sync = task.last_sync
 
         # Get the target resource for this task
@@ -247,121 +265,104 @@ class S3Sync(S3Method):
             url += "&msince=%s" % xml.encode_iso_datetime(last_sync)
         url += "&include_deleted=True"
 
-        _debug("...pull from URL %s" % url)
+        # Request paging (ignored by peers which do not support it)
+        url += "&pagesize=%s" % self.PAGESIZE
 
-        response = None
-        url_split = url.split("://", 1)
-        if len(url_split) == 2:
-            protocol, path = url_split
-        else:
-            protocol, path = "http", None
+        # Get import strategy and update policy
+        strategy = task.strategy
+        update_policy = task.update_policy
+        conflict_policy = task.conflict_policy
+        onconflict = lambda item: \
+                     self.__resolve_conflict(item,
+                                             repository,
+                                             resource)
 
-        # Prepare the request
-        import urllib2
-        req = urllib2.Request(url=url)
-        handlers = []
+        remote = False
+        output = None
+        result = self.log.SUCCESS
+        message = ""
 
-        # Proxy handling
-        if proxy:
-            _debug("using proxy=%s" % proxy)
-            proxy_handler = urllib2.ProxyHandler({protocol: proxy})
-            handlers.append(proxy_handler)
+        # Resume after the last committed page
+        cursor = task.pull_cursor
+        while True:
 
-        # Authentication handling
-        if username and password:
-            # Send auth data unsolicitedly (the only way with Eden instances):
-            import base64
-            base64string = base64.encodestring('%s:%s' %
-                                               (username, password))[:-1]
-            req.add_header("Authorization", "Basic %s" % base64string)
-            # Just in case the peer does not accept that, add a 401 handler:
-            passwd_manager = urllib2.HTTPPasswordMgrWithDefaultRealm()
-            passwd_manager.add_password(realm=None,
-                                        uri=url,
-                                        user=username,
-                                        passwd=password)
-            auth_handler = urllib2.HTTPBasicAuthHandler(passwd_manager)
-            handlers.append(auth_handler)
+            page_url = url
+            if cursor:
+                page_url += "&cursor=%s" % urllib.quote(cursor)
 
-        # Install all handlers
-        if handlers:
-            opener = urllib2.build_opener(*handlers)
-            urllib2.install_opener(opener)
+            _debug("...pull from URL %s" % page_url)
 
-        remote = False
-        output = None
-        response = None
-
-        # Execute the request
-        try:
-            f = urllib2.urlopen(req)
-        except urllib2.HTTPError, e:
-            result = self.log.ERROR
-            remote = True # Peer error
-            code = e.code
-            message = e.read()
+            # Execute the request
+            response = None
             try:
-                # Sahana-Eden would send a JSON message,
-                # try to extract the actual error message:
-                message_json = json.loads(message)
-                message = message_json.get("message", message)
+                f = self.__urlopen(repository, page_url,
+                                   headers={"Accept-Encoding": "gzip"})
+            except urllib2.HTTPError, e:
+                result = self.log.ERROR
+                remote = True # Peer error
+                code = e.code
+                message = e.read()
+                try:
+                    # Sahana-Eden would send a JSON message,
+                    # try to extract the actual error message:
+                    message_json = json.loads(message)
+                    message = message_json.get("message", message)
+                except:
+                    pass
+                # Prefix as peer error and strip XML markup from the message
+                # @todo: better method to do this?
+                message = "<message>%s</message>" % message
+                try:
+                    markup = etree.XML(message)
+                    message = markup.xpath(".//text()")
+                    if message:
+                        message = " ".join(message)
+                    else:
+                        message = ""
+                except etree.XMLSyntaxError:
+                    pass
+                output = xml.json_message(False, code, message, tree=None)
             except:
-                pass
-            # Prefix as peer error and strip XML markup from the message
-            # @todo: better method to do this?
-            message = "<message>%s</message>" % message
-            try:
-                markup = etree.XML(message)
-                message = markup.xpath(".//text()")
-                if message:
-                    message = " ".join(message)
-                else:
-                    message = ""
-            except etree.XMLSyntaxError:
-                pass
-            output = xml.json_message(False, code, message, tree=None)
-        except:
-            result = self.log.FATAL
-            code = 400
-            message = sys.exc_info()[1]
-            output = xml.json_message(False, code, message)
-        else:
-            result = self.log.SUCCESS
-            response = f
+                result = self.log.FATAL
+                code = 400
+                message = sys.exc_info()[1]
+                output = xml.json_message(False, code, message)
+            else:
+                response = f
 
-        # Get import strategy and update policy
-        strategy = task.strategy
-        update_policy = task.update_policy
-        conflict_policy = task.conflict_policy
+            if not response:
+                if result == self.log.SUCCESS:
+                    result = self.log.ERROR
+                    remote = True
+                    message = "no data received from peer"
+                break
 
-        # Try to import the response
-        count = 0
-        if response:
+            # Try to import the response
             success = True
-            message = ""
+            info = response.info()
+            if info.getheader("Content-Encoding") == "gzip":
+                source = self.decompress(response)
+            else:
+                source = response
             try:
-                import_xml = resource.import_xml
-                onconflict = lambda item: \
-                             self.__resolve_conflict(item,
-                                                     repository,
-                                                     resource)
-                success = import_xml(response,
-                                     ignore_errors=ignore_errors,
-                                     strategy=strategy,
-                                     update_policy=update_policy,
-                                     conflict_policy=conflict_policy,
-                                     last_sync=last_sync,
-                                     onconflict=onconflict)
-                count = resource.import_count
+                success = resource.import_xml(source,
+                                              ignore_errors=ignore_errors,
+                                              strategy=strategy,
+                                              update_policy=update_policy,
+                                              conflict_policy=conflict_policy,
+                                              last_sync=last_sync,
+                                              onconflict=onconflict)
             except IOError, e:
                 result = self.log.FATAL
                 message = "%s" % e
                 output = xml.json_message(False, 400, message)
+                break
 
             if resource.error_tree is not None:
                 # Validation error (log in any case)
                 result = self.log.WARNING
-                message = "%s" % resource.error
+                if not message:
+                    message = "%s" % resource.error
                 for element in resource.error_tree.findall("resource"):
                     for field in element.findall("data[@error]"):
                         error_msg = field.get("error", None)
@@ -380,14 +381,23 @@ class S3Sync(S3Method):
                     error = manager.error
                     message = "%s" % error
                 output = xml.json_message(False, 400, message)
+                break
 
-            elif not message:
-                message = "data imported successfully (%s records)" % count
+            # Commit the page, and remember where to resume
+            if info.getheader("X-Sync-Protocol"):
+                cursor = info.getheader("X-Sync-Cursor")
+            else:
+                cursor = None
+            # (last_sync would be reset by any update without it)
+            task.update_record(pull_cursor=cursor,
+                               last_sync=task.last_sync)
+            db.commit()
+            if not cursor:
+                break
 
-        elif result == self.log.SUCCESS:
-            result = self.log.ERROR
-            remote = True
-            message = "no data received from peer"
+        if result == self.log.SUCCESS:
+            message = "data imported successfully (%s records)" % \
+                      resource.import_count
 
         # log the operation
         self.log.write(repository_id=repository.id,
@@ -407,10 +417,17 @@ class S3Sync(S3Method):
         """
             Outgoing push
 
+            The data are sent page by page (see page()), the cursor of
+            the last page accepted by the peer is stored in the task, so
+            that an interrupted push resumes with the next page. Pages
+            are compressed once the peer has confirmed that it supports
+            this.
+
            @param repository: a sync_repository row
            @param task: a sync_task row
          """
 
+        db = current.db
         manager = current.manager
         xml = manager.xml
 
@@ -421,13 +438,9 @@ class S3Sync(S3Method):
 
         # Construct the URL
         config = self.__get_config()
-        proxy = repository.proxy or config.proxy or None
         url = "%s/sync/sync.xml?resource=%s&repository=%s" % \
               (repository.url, resource_name, config.uuid)
 
-        username = repository.username
-        password = repository.password
-
         strategy = task.strategy
         if strategy:
             url += "&strategy=%s" % ",".join(strategy)
@@ -445,59 +458,45 @@ class S3Sync(S3Method):
 
         _debug("...push to URL %s" % url)
 
-        # Export the resource as S3XML
-        prefix, name = task.resource_name.split("_", 1)
-        resource = manager.define_resource(prefix, name,
-                                           include_deleted=True)
-        data = resource.export_xml(msince=last_sync)
-        count = resource.count()
-
         remote = False
         output = None
+        count = 0
+        compress = False
+
+        # Resume after the last page accepted by the peer
+        cursor = task.push_cursor
+        while True:
+
+            # Export the next page of the resource as S3XML
+            resource = manager.define_resource(prefix, name,
+                                               include_deleted=True)
+            if last_sync:
+                self.changed(resource, last_sync)
+            next_cursor = self.page(resource, cursor)
+            records = resource.count()
+            if not records:
+                # Nothing (more) to send
+                task.update_record(push_cursor=None,
+                                   last_sync=task.last_sync)
+                db.commit()
+                result = self.log.SUCCESS
+                message = "data sent successfully (%s records)" % count
+                break
+            data = xml.spool(resource.export_stream(msince=last_sync))
 
-        if data:
-            # Find the protocol
-            url_split = url.split("://", 1)
-            if len(url_split) == 2:
-                protocol, path = url_split
-            else:
-                protocol, path = "http", None
-
-            # Generate the request
-            import urllib2
-            req = urllib2.Request(url=url, data=data)
-            req.add_header('Content-Type', "text/xml")
-
-            handlers = []
-            if proxy:
-                # Proxy handling
-                _debug("using proxy=%s" % proxy)
-                proxy_handler = urllib2.ProxyHandler({protocol: proxy})
-                handlers.append(proxy_handler)
-            if username and password:
-                # Authentication handling:
-                # send auth credentials unsolicitedly
-                import base64
-                base64string = base64.encodestring('%s:%s' %
-                                                   (username, password))[:-1]
-                req.add_header("Authorization", "Basic %s" % base64string)
-                # Just in case the peer does not accept that
-                # => add a 401 handler:
-                passwd_manager = urllib2.HTTPPasswordMgrWithDefaultRealm()
-                passwd_manager.add_password(realm=None,
-                                            uri=url,
-                                            user=username,
-                                            passwd=password)
-                auth_handler = urllib2.HTTPBasicAuthHandler(passwd_manager)
-                handlers.append(auth_handler)
-            # Install all handlers
-            if handlers:
-                opener = urllib2.build_opener(*handlers)
-                urllib2.install_opener(opener)
+            headers = {"Content-Type": "text/xml"}
+            if compress:
+                data = self.compress(data)
+                headers["Content-Encoding"] = "gzip"
+            data.seek(0, 2)
+            headers["Content-Length"] = str(data.tell())
+            data.seek(0)
 
             # Execute the request
             try:
-                f = urllib2.urlopen(req)
+                f = self.__urlopen(repository, url,
+                                   data=data,
+                                   headers=headers)
             except urllib2.HTTPError, e:
                 result = self.log.FATAL
                 remote = True # Peer error
@@ -511,18 +510,27 @@ class S3Sync(S3Method):
                 except:
                     pass
                 output = xml.json_message(False, code, message)
+                break
             except:
                 result = self.log.FATAL
                 code = 400
                 message = sys.exc_info()[1]
                 output = xml.json_message(False, code, message)
-            else:
+                break
+
+            count += records
+            compress = f.info().getheader("X-Sync-Protocol") is not None
+
+            # Remember where to resume
+            # (last_sync would be reset by any update without it)
+            task.update_record(push_cursor=next_cursor,
+                               last_sync=task.last_sync)
+            db.commit()
+            if not next_cursor:
                 result = self.log.SUCCESS
                 message = "data sent successfully (%s records)" % count
-        else:
-            # No data to send
-            result = self.log.WARNING
-            message = "No data to sent"
+                break
+            cursor = next_cursor
 
         # log the operation
         self.log.write(repository_id=repository.id,
@@ -536,6 +544,234 @@ class S3Sync(S3Method):
 
         return output
 
+    # -------------------------------------------------------------------------
+    def __urlopen(self, repository, url, data=None, headers=None):
+        """
+            Send a request to a repository
+
+            @param repository: the repository (sync_repository row)
+            @param url: the URL
+            @param data: the request body (file-like object), None for GET
+            @param headers: dict of additional request headers
+
+            @returns: the response (file-like object)
+            @raises: urllib2.HTTPError for errors reported by the peer
+        """
+
+        config = self.__get_config()
+        proxy = repository.proxy or config.proxy or None
+        username = repository.username
+        password = repository.password
+
+        # Find the protocol
+        url_split = url.split("://", 1)
+        if len(url_split) == 2:
+            protocol, path = url_split
+        else:
+            protocol, path = "http", None
+
+        # Prepare the request
+        req = urllib2.Request(url=url, data=data)
+        if headers:
+            for k, v in headers.items():
+                req.add_header(k, v)
+        handlers = []
+
+        # Proxy handling
+        if proxy:
+            _debug("using proxy=%s" % proxy)
+            proxy_handler = urllib2.ProxyHandler({protocol: proxy})
+            handlers.append(proxy_handler)
+
+        # Authentication handling
+        if username and password:
+            # Send auth data unsolicitedly (the only way with Eden instances):
+            import base64
+            base64string = base64.encodestring('%s:%s' %
+                                               (username, password))[:-1]
+            req.add_header("Authorization", "Basic %s" % base64string)
+            # Just in case the peer does not accept that, add a 401 handler:
+            passwd_manager = urllib2.HTTPPasswordMgrWithDefaultRealm()
+            passwd_manager.add_password(realm=None,
+                                        uri=url,
+                                        user=username,
+                                        passwd=password)
+            auth_handler = urllib2.HTTPBasicAuthHandler(passwd_manager)
+            handlers.append(auth_handler)
+
+        # Install all handlers
+        if handlers:
+            opener = urllib2.build_opener(*handlers)
+            urllib2.install_opener(opener)
+
+        return urllib2.urlopen(req)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def changed(resource, msince):
+        """
+            Restrict a resource to the master records which have been
+            modified after msince, or which have components that have
+            been modified after msince (i.e. the records which the export
+            with msince contains), so that incremental synchronizations
+            do not have to page through the whole table
+
+            @param resource: the S3Resource
+            @param msince: the datetime
+        """
+
+        db = current.db
+        xml = current.manager.xml
+
+        table = resource.table
+        MTIME = xml.MTIME
+        if MTIME not in table.fields:
+            return
+
+        query = (table[MTIME] > msince)
+        for component in resource.components.values():
+            if component.link is not None:
+                c = component.link
+            else:
+                c = component
+            ctable = c.table
+            if MTIME not in ctable.fields:
+                continue
+            subselect = db(ctable[MTIME] > msince)._select(ctable[c.fkey])
+            query |= (table[c.pkey].belongs(subselect))
+        resource.add_filter(query)
+        return
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def page(cls, resource, cursor=None, pagesize=None):
+        """
+            Restrict a resource to the next page of master records after
+            a cursor, in the order of their modification date and UID (so
+            that records which are modified during the synchronization
+            move to the end rather than shifting the pages)
+
+            @param resource: the S3Resource
+            @param cursor: the cursor of the last record of the previous
+                           page (None for the first page)
+            @param pagesize: the maximum number of records per page
+
+            @note: for incremental synchronizations, restrict the resource
+                   with changed() first, so that the pages only contain
+                   the records to export
+
+            @returns: the cursor of the last record in this page, or None
+                      if this is the last page
+        """
+
+        db = current.db
+        xml = current.manager.xml
+
+        table = resource.table
+        MTIME = xml.MTIME
+        UID = xml.UID
+        if MTIME not in table.fields or UID not in table.fields:
+            # Can not page this resource
+            return None
+        if pagesize is None:
+            pagesize = cls.PAGESIZE
+
+        mtime = table[MTIME]
+        uid = table[UID]
+
+        # Records after the cursor
+        after = cls.decode_cursor(cursor)
+        if after:
+            m, u = after
+            resource.add_filter((mtime > m) | ((mtime == m) & (uid > u)))
+
+        # Find the last record of the page
+        query = resource.get_query() & (mtime != None)
+        row = db(query).select(mtime, uid,
+                               orderby=mtime|uid,
+                               limitby=(pagesize - 1, pagesize)).first()
+        if not row:
+            # Last page
+            return None
+
+        # Records up to the last record of the page (records without
+        # modification date go into the first page)
+        m, u = row[MTIME], row[UID]
+        resource.add_filter((mtime < m) | \
+                            ((mtime == m) & (uid <= u)) | \
+                            (mtime == None))
+        return cls.encode_cursor(m, u)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def encode_cursor(mtime, uid):
+        """
+            Encode a page cursor
+
+            @param mtime: the modification date of the last record
+            @param uid: the UID of the last record
+        """
+
+        return "%s|%s" % (mtime.isoformat(), uid)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def decode_cursor(cursor):
+        """
+            Decode a page cursor
+
+            @param cursor: the cursor
+            @returns: tuple (mtime, uid), or None for an invalid cursor
+        """
+
+        if not cursor:
+            return None
+        try:
+            mtime, uid = cursor.split("|", 1)
+            dt = datetime.datetime.strptime(mtime[:19], "%Y-%m-%dT%H:%M:%S")
+            if mtime[19:20] == ".":
+                dt = dt.replace(microsecond=int(mtime[20:26].ljust(6, "0")))
+        except ValueError:
+            return None
+        return (dt, uid)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def compress(source):
+        """
+            Compress data with gzip
+
+            @param source: the data, a file-like object or an iterable
+                           of strings
+            @returns: a temporary file with the compressed data, rewound
+        """
+
+        output = tempfile.TemporaryFile()
+        gz = gzip.GzipFile(fileobj=output, mode="wb")
+        if hasattr(source, "read"):
+            shutil.copyfileobj(source, gz)
+        else:
+            for chunk in source:
+                gz.write(chunk)
+        gz.close()
+        output.seek(0)
+        return output
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def decompress(source):
+        """
+            Decompress gzip-compressed data
+
+            @param source: the compressed data (file-like object)
+            @returns: a file-like object to read the decompressed data from
+        """
+
+        data = tempfile.TemporaryFile()
+        shutil.copyfileobj(source, data)
+        data.seek(0)
+        return gzip.GzipFile(fileobj=data, mode="rb")
+
     # -------------------------------------------------------------------------
     def __register(self, r, **attr):
         """
@@ -750,15 +986,44 @@ class S3Sync(S3Method):
             except ValueError:
                 msince = None
 
-        # Export the resource
+        # Only the records which have changed since msince (or have
+        # changed components)
         resource = r.resource
-        output = resource.export_xml(start=start,
-                                     limit=limit,
-                                     msince=msince)
-        count = len(resource)
+        if msince is not None:
+            self.changed(resource, msince)
 
-        # Set content type header
+        # Paging (protocol extension)
         headers = current.response.headers
+        headers["X-Sync-Protocol"] = self.PROTOCOL
+        pagesize = _vars.get("pagesize", None)
+        if pagesize is not None:
+            try:
+                pagesize = int(pagesize)
+            except ValueError:
+                pagesize = None
+        if pagesize:
+            cursor = self.page(resource,
+                               cursor=_vars.get("cursor", None),
+                               pagesize=pagesize)
+            if cursor:
+                headers["X-Sync-Cursor"] = cursor
+
+        # Export the resource
+        chunks = resource.export_stream(start=start,
+                                        limit=limit,
+                                        msince=msince)
+        from gluon.streamer import streamer
+        accept_encoding = r.env.http_accept_encoding or ""
+        if "gzip" in accept_encoding:
+            output = streamer(self.compress(chunks))
+            headers["Content-Encoding"] = "gzip"
+        else:
+            output = streamer(xml.spool(chunks))
+        count = max(resource.count() - (start or 0), 0)
+        if limit is not None:
+            count = min(count, limit)
+
+        # Set content type header
         headers["Content-Type"] = "text/xml"
 
         # Log the operation
@@ -855,6 +1120,9 @@ class S3Sync(S3Method):
 
         # Get the source
         source = r.read_body()
+        if r.env.http_content_encoding == "gzip":
+            source = [self.decompress(s) for s in source]
+        current.response.headers["X-Sync-Protocol"] = self.PROTOCOL
 
         # Import resource
         resource = r.resource
@@ -41,6 +41,8 @@ import datetime
 import re
 import urllib
 import warnings
+import select
+import subprocess
 from cgi import escape
 from xml.sax.saxutils import unescape
 
@@ -50,6 +52,7 @@ from gluon.storage import Storage, Messages
 from gluon.sql import Field, Row, Query
 from gluon.sqlhtml import SQLFORM, SQLTABLE
 from gluon.tools import Crud
+from gluon.settings import global_settings
 
 import gluon.contrib.simplejson as json
 
@@ -482,10 +485,14 @@ class S3BulkImporter(object):
                     pass
             try:
                 # @todo: add extra_data and file attachments
+                settings = current.deployment_settings
+                chunk_size = settings.get_base_import_chunk_size()
                 result = resource.import_xml(csv,
                                              format="csv",
                                              stylesheet=task[4],
-                                             extra_data=extra_data)
+                                             extra_data=extra_data,
+                                             bulk=True,
+                                             chunk_size=chunk_size)
             except SyntaxError, e:
                 self.errorList.append("WARNING: import error - %s" % e)
                 return
@@ -650,12 +657,351 @@ class S3BulkImporter(object):
             that are listed in the descriptor file
         """
         self.load_descriptor(path)
+        workers = current.deployment_settings.get_base_prepopulate_workers()
+        if workers > 1 and self.parallel():
+            self.perform_tasks_parallel(workers)
+            return
         for task in self.tasks:
             if task[0] == 1:
                 self.execute_import_task(task)
             elif task[0] == 2:
                 self.execute_special_task(task)
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def parallel():
+        """
+            Check whether import tasks can run in worker processes: needs
+            a database server (not SQLite), and a Python interpreter to run
+            web2py in (not inside a web server process) on a POSIX system
+        """
+
+        if current.db._dbname == "sqlite" or os.name != "posix":
+            return False
+        return "python" in os.path.basename(sys.executable)
+
+    # -------------------------------------------------------------------------
+    def perform_tasks_parallel(self, workers):
+        """
+            Execute the import tasks in worker processes, running tasks
+            which do not depend on each other at the same time. Special
+            tasks run in this process, after all previous tasks and before
+            all subsequent tasks.
+
+            @param workers: the maximum number of worker processes
+        """
+
+        db = current.db
+        tasks = self.tasks
+
+        # Workers must see everything written so far
+        db.commit()
+
+        # Task graph
+        tables = [task[0] == 1 and self.task_tables(task) or None
+                  for task in tasks]
+        depends = []
+        for i in xrange(len(tasks)):
+            depends.append([j for j in xrange(i)
+                            if self.conflict(tables[j], tables[i])])
+
+        start = datetime.datetime.now()
+        pool = []
+        running = {}
+        pending = range(len(tasks))
+        done = set()
+        try:
+            while pending or running:
+
+                # Start all tasks which are ready
+                for i in list(pending):
+                    if [j for j in depends[i] if j not in done]:
+                        continue
+                    task = tasks[i]
+                    if task[0] == 2:
+                        if running:
+                            continue
+                        self.execute_special_task(task)
+                        db.commit()
+                        pending.remove(i)
+                        done.add(i)
+                        continue
+                    idle = [w for w in pool if w not in running]
+                    if idle:
+                        worker = idle[0]
+                    elif len(pool) < workers:
+                        worker = S3BulkImportWorker()
+                        pool.append(worker)
+                    else:
+                        break
+                    worker.send(task)
+                    running[worker] = i
+                    pending.remove(i)
+
+                if not running:
+                    continue
+
+                # Wait for results
+                readable = select.select(running.keys(), [], [])[0]
+                for worker in readable:
+                    result = worker.receive()
+                    if result is None:
+                        continue
+                    i = running.pop(worker)
+                    done.add(i)
+                    if result is False:
+                        # Worker died
+                        pool.remove(worker)
+                        worker.close()
+                        self.errorList.append("prepopulate error: "
+                                              "worker failed in %s" %
+                                              tasks[i][3])
+                    else:
+                        self.errorList.extend(result["errors"])
+                        self.resultList.extend(result["results"])
+        finally:
+            for worker in pool:
+                worker.close()
+
+        duration = datetime.datetime.now() - start
+        try:
+            # Python-2.7
+            duration = '{:.2f}'.format(duration.total_seconds()/60)
+            msg = "%s import jobs completed in %s mins with %s workers" % \
+                  (len(tasks), duration, workers)
+        except AttributeError:
+            # older Python
+            msg = "%s import jobs completed in %s with %s workers" % \
+                  (len(tasks), duration, workers)
+        self.resultList.append(msg)
+
+    # -------------------------------------------------------------------------
+    def task_tables(self, task):
+        """
+            Find the tables an import task writes to and reads from
+
+            @param task: the import task
+            @returns: Storage(writes, supers, reads) of sets of tablenames,
+                      or None if the tables can not be determined
+        """
+
+        s3 = current.response.s3
+        s3db = current.s3db
+        model = current.manager.model
+
+        prefix = task[1]
+        name = task[2]
+        tablename = "%s_%s" % (prefix, name)
+        if tablename in self.alternateTables:
+            details = self.alternateTables[tablename]
+            prefix = details.get("prefix", prefix)
+            name = details.get("name", name)
+            tablename = "%s_%s" % (prefix, name)
+
+        # Tables of the resources in the stylesheet output
+        writes = self.stylesheet_tables(task[4])
+        if writes is None:
+            return None
+        writes.add(tablename)
+
+        supers = set()
+        reads = set()
+        meta = s3.all_meta_field_names or []
+        for tn in list(writes):
+            try:
+                table = s3db[tn]
+            except:
+                return None
+            super_entity = model.get_config(tn, "super_entity")
+            if super_entity:
+                if isinstance(super_entity, (list, tuple)):
+                    supers.update(super_entity)
+                else:
+                    supers.add(super_entity)
+            for field in table:
+                if field.name in meta:
+                    continue
+                fieldtype = str(field.type)
+                if fieldtype[:10] == "reference ":
+                    reads.add(fieldtype[10:])
+                elif fieldtype[:15] == "list:reference ":
+                    reads.add(fieldtype[15:])
+        return Storage(writes=writes, supers=supers, reads=reads)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def stylesheet_tables(cls, path, included=None):
+        """
+            Find the names of the resources a stylesheet produces (incl.
+            the included stylesheets)
+
+            @param path: the path of the stylesheet
+            @param included: set of the paths of already included stylesheets
+            @returns: set of tablenames, or None if the stylesheet creates
+                      resource names dynamically
+        """
+
+        if included is None:
+            included = set()
+        path = os.path.abspath(path)
+        if path in included:
+            return set()
+        included.add(path)
+        try:
+            source = open(path, "r")
+            xsl = source.read()
+            source.close()
+        except IOError:
+            return None
+
+        if re.search(r'<xsl:attribute\s+name="name"', xsl):
+            return None
+        tables = set(re.findall(r'<resource\s+name="([a-z0-9_]+)"', xsl))
+        directory = os.path.dirname(path)
+        for href in re.findall(r'<xsl:(?:include|import)\s+href="([^"]+)"', xsl):
+            itables = cls.stylesheet_tables(os.path.join(directory, href),
+                                            included)
+            if itables is None:
+                return None
+            tables |= itables
+        return tables
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def conflict(first, second):
+        """
+            Check whether two import tasks must run one after another,
+            i.e. either of them writes to a table the other one uses,
+            or reads instance records of a super-entity the other one
+            writes to
+
+            @param first: the tables of the first task (from task_tables)
+            @param second: the tables of the second task
+        """
+
+        if first is None or second is None:
+            return True
+        if first.writes & (second.writes | second.reads) or \
+           second.writes & first.reads:
+            return True
+        if first.supers & second.reads or second.supers & first.reads:
+            return True
+        return False
+
+    # -------------------------------------------------------------------------
+    def serve(self, stdin, stdout):
+        """
+            Run as worker process for parallel imports (see
+            static/scripts/tools/prepopulate_worker.py): reads the tasks
+            from stdin, writes the results to stdout
+
+            @param stdin: the input stream
+            @param stdout: the output stream
+        """
+
+        auth = current.auth
+        manager = current.manager
+        request = current.request
+
+        # Same settings as in zzz_1st_run
+        auth.override = True
+        manager.PROTECTED = []
+        manager.configure("auth_user",
+                          onaccept = lambda form: \
+                            auth.s3_link_to_person(user=form.vars))
+        manager.model.add_component("auth_membership", auth_user="user_id")
+        if not request.env.request_method:
+            request.env.request_method = "GET"
+
+        for line in iter(stdin.readline, ""):
+            task = json.loads(line)
+            self.errorList = []
+            self.resultList = []
+            self.execute_import_task(task)
+            result = dict(errors=self.errorList, results=self.resultList)
+            stdout.write("%s%s\n" % (S3BulkImportWorker.MARKER,
+                                     json.dumps(result)))
+            stdout.flush()
+
+# =============================================================================
+class S3BulkImportWorker(object):
+    """
+        Worker process for parallel prepopulate imports (runs web2py with
+        static/scripts/tools/prepopulate_worker.py), keeps its models and
+        compiled stylesheets between tasks
+    """
+
+    MARKER = "S3BULKIMPORT:"
+
+    def __init__(self):
+        """ Start the worker process """
+
+        request = current.request
+        path = global_settings.gluon_parent
+        script = os.path.join(request.folder,
+                              "static", "scripts", "tools",
+                              "prepopulate_worker.py")
+        self.process = subprocess.Popen([sys.executable,
+                                         os.path.join(path, "web2py.py"),
+                                         "-S", request.application,
+                                         "-M", "-R", script],
+                                        cwd=path,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        close_fds=True)
+        self.buffer = ""
+
+    # -------------------------------------------------------------------------
+    def fileno(self):
+        """ File descriptor of the worker output (for select) """
+
+        return self.process.stdout.fileno()
+
+    # -------------------------------------------------------------------------
+    def send(self, task):
+        """
+            Send an import task to the worker
+
+            @param task: the task
+        """
+
+        stdin = self.process.stdin
+        stdin.write("%s\n" % json.dumps(task))
+        stdin.flush()
+
+    # -------------------------------------------------------------------------
+    def receive(self):
+        """
+            Read the available output of the worker (skips anything but
+            the task results, e.g. the web2py banner)
+
+            @returns: the task result (dict), None if not yet complete,
+                      or False if the worker has terminated
+        """
+
+        data = os.read(self.fileno(), 65536)
+        if not data:
+            return False
+        self.buffer += data
+        marker = self.MARKER
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            if line.startswith(marker):
+                return json.loads(line[len(marker):])
+        return None
+
+    # -------------------------------------------------------------------------
+    def close(self):
+        """ Terminate the worker process """
+
+        process = self.process
+        if process.returncode is None:
+            try:
+                process.stdin.close()
+            except IOError:
+                pass
+            process.wait()
+
 # =============================================================================
 class S3DateTime(object):
     """
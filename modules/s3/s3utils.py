@@ -35,6 +35,7 @@ __all__ = ["URL2",
            "s3_debug",
            "s3_dev_toolbar",
            "s3_mark_required",
+           "s3_bulk_insert",
            "s3_truncate",
            "s3_split_multi_value",
            "s3_get_db_field_value",
@@ -258,6 +259,70 @@ def s3_dev_toolbar():
         SCRIPT("$('.dbg_hidden').hide()")
         )
 
+# =============================================================================
+# Database backends which support multi-row INSERTs
+MULTIROW_INSERT = ("postgres", "mysql")
+
+def s3_bulk_insert(table, records):
+    """
+        Insert multiple records into a table with a single multi-row
+        INSERT where the database backend supports it, otherwise with
+        DAL bulk_insert (one INSERT per record)
+
+        @param table: the table
+        @param records: list of dicts {fieldname: value}
+
+        @note: fills in field defaults, but does not run computed
+               fields or return the new record IDs
+    """
+
+    if not records:
+        return
+    db = table._db
+    if len(records) == 1 or not s3_multirow_insert(db):
+        table.bulk_insert(records)
+        return
+
+    represent = db._adapter.represent
+    fields = [table[fn] for fn in table.fields if fn != "id"]
+    defaults = {}
+    for f in fields:
+        default = f.default
+        if callable(default):
+            default = default()
+        defaults[f.name] = default
+
+    values = ["(%s)" % ",".join([represent(record.get(f.name,
+                                                      defaults[f.name]),
+                                           f.type)
+                                 for f in fields])
+              for record in records]
+    sql = "INSERT INTO %s(%s) VALUES %s;" % \
+          (table._tablename,
+           ",".join([f.name for f in fields]),
+           ",".join(values))
+    db.executesql(sql)
+    return
+
+# =============================================================================
+def s3_multirow_insert(db):
+    """
+        Check whether the database backend supports multi-row INSERTs
+
+        @param db: the database
+    """
+
+    dbname = db._dbname
+    if dbname in MULTIROW_INSERT:
+        return True
+    elif dbname == "sqlite":
+        try:
+            from sqlite3 import sqlite_version_info
+        except ImportError:
+            return False
+        return sqlite_version_info >= (3, 7, 11)
+    return False
+
 # =============================================================================
 def s3_mark_required(fields,
                      mark_required=None,
@@ -341,8 +341,26 @@ class IS_ONE_OF_EMPTY(Validator):
             No 'options' method as designed to be called next to an
             Autocomplete field so don't download a large dropdown
             unnecessarily.
+
+        The option sets are cached per process, keyed by the key table,
+        its last modification, the permissions of the current user, the
+        filter and the language, so that any insert, update or delete in
+        the key table invalidates them. Option sets with label functions
+        are only cached if cache_tables lists the other tables the label
+        function reads (may be empty), so that changes in these tables
+        invalidate them as well.
+
+        With lazy=True, values are validated by an existence check for
+        the given key(s) (with the same filters and access restrictions
+        as the option set) rather than against the option set.
     """
 
+    # Maximum number of option sets in the process cache
+    OPTIONS_CACHE_SIZE = 200
+
+    # Process cache of option sets {key: (theset, labels)}
+    _options_cache = {}
+
     def __init__(self,
                  dbset,
                  field,
@@ -359,6 +377,8 @@ class IS_ONE_OF_EMPTY(Validator):
                  zero="",
                  sort=False,
                  _and=None,
+                 lazy=False,
+                 cache_tables=None,
                 ):
 
         if hasattr(dbset, "define_table"):
@@ -399,6 +419,8 @@ class IS_ONE_OF_EMPTY(Validator):
         self.zero = zero
         self.sort = sort
         self._and = _and
+        self.lazy = lazy
+        self.cache_tables = cache_tables
 
         self.filterby = filterby
         self.filter_opts = filter_opts
@@ -434,7 +456,6 @@ class IS_ONE_OF_EMPTY(Validator):
         if self.ktable in db:
 
             table = db[self.ktable]
-            auth = current.auth
 
             if self.fields == "all":
                 fields = [f for f in table if isinstance(f, Field)]
@@ -442,21 +463,25 @@ class IS_ONE_OF_EMPTY(Validator):
                 fieldnames = [f.split(".")[1] if "." in f else f for f in self.fields]
                 fields = [table[k] for k in fieldnames if k in table.fields]
             if db._dbname not in ("gql", "gae"):
+                query = self.options_query(table)
+                # Cached option set?
+                key = self.cache_key(table, query)
+                if key is not None:
+                    cached = self._options_cache.get(key, None)
+                    if cached is not None:
+                        theset, labels = cached
+                        self.theset = list(theset)
+                        self.labels = list(labels)
+                        return
                 orderby = self.orderby or reduce(lambda a, b: a|b, fields)
                 groupby = self.groupby
-                # Caching breaks Colorbox dropdown refreshes
-                #dd = dict(orderby=orderby, groupby=groupby, cache=(current.cache.ram, 60))
+                # NB the process cache is invalidated by any change in the
+                # key table, so Colorbox dropdown refreshes see new records
                 dd = dict(orderby=orderby, groupby=groupby)
-                query = auth.s3_accessible_query("read", table)
-                if "deleted" in table:
-                    query = ((table["deleted"] == False) & query)
                 if self.filterby and self.filterby in table:
-                    if self.filter_opts:
-                        query = query & (table[self.filterby].belongs(self.filter_opts))
                     if not self.orderby:
                         dd.update(orderby=table[self.filterby])
                 if self.not_filterby and self.not_filterby in table and self.not_filter_opts:
-                    query = query & (~(table[self.not_filterby].belongs(self.not_filter_opts)))
                     if not self.orderby:
                         dd.update(orderby=table[self.filterby])
                 if self.left is not None:
@@ -470,6 +495,7 @@ class IS_ONE_OF_EMPTY(Validator):
                 #dd = dict(orderby=orderby, cache=(current.cache.ram, 60))
                 dd = dict(orderby=orderby)
                 records = dbset.select(db[self.ktable].ALL, **dd)
+                key = None
             self.theset = [str(r[self.kfield]) for r in records]
             #labels = []
             label = self.label
@@ -490,10 +516,168 @@ class IS_ONE_OF_EMPTY(Validator):
                 else:
                     labels = map(lambda r: r[self.kfield], records)
             self.labels = labels
+            if key is not None:
+                cache = IS_ONE_OF_EMPTY._options_cache
+                if len(cache) >= self.OPTIONS_CACHE_SIZE:
+                    cache.clear()
+                cache[key] = (tuple(self.theset), tuple(labels))
         else:
             self.theset = None
             self.labels = None
 
+    # -------------------------------------------------------------------------
+    def options_query(self, table):
+        """
+            Query for the accessible, non-deleted records of the key
+            table which match the filter
+
+            @param table: the key table
+        """
+
+        query = current.auth.s3_accessible_query("read", table)
+        if "deleted" in table:
+            query = ((table["deleted"] == False) & query)
+        if self.filterby and self.filterby in table and self.filter_opts:
+            query = query & (table[self.filterby].belongs(self.filter_opts))
+        if self.not_filterby and self.not_filterby in table and self.not_filter_opts:
+            query = query & (~(table[self.not_filterby].belongs(self.not_filter_opts)))
+        return query
+
+    # -------------------------------------------------------------------------
+    def cache_key(self, table, query):
+        """
+            Key for the option set in the process cache
+
+            @param table: the key table
+            @param query: the options query (incl. the accessible query
+                          for the current user)
+            @returns: the key, or None if the option set can not be cached
+
+            @note: the accessible query is part of the key rather than
+                   the user and the request, so that users with the same
+                   permissions share the option set (it contains the user
+                   ID only if the access is restricted to owned records)
+            @note: option sets with label functions are only cached
+                   if cache_tables is set, since label functions may read
+                   other tables
+        """
+
+        if "modified_on" not in table.fields:
+            return None
+
+        if current.auth.override:
+            return None
+
+        versions = [self.table_version(table)]
+
+        label = self.label
+        if isinstance(label, (list, tuple)):
+            label = tuple(label)
+        elif not isinstance(label, basestring):
+            cache_tables = self.cache_tables
+            if cache_tables is None:
+                return None
+            s3db = current.s3db
+            for tablename in cache_tables:
+                ctable = s3db.table(tablename)
+                if ctable is None or "modified_on" not in ctable.fields:
+                    return None
+                versions.append(self.table_version(ctable))
+
+        key = (table._tablename,
+               tuple(versions),
+               str(query),
+               current.T.accepted_language,
+               label,
+               self.key_of(self.dbset.query),
+               self.key_of(self.fields),
+               self.key_of(self.orderby),
+               self.key_of(self.groupby),
+               self.key_of(self.left),
+               self.filterby,
+               self.key_of(self.filter_opts),
+               self.not_filterby,
+               self.key_of(self.not_filter_opts),
+               )
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def key_of(obj):
+        """
+            Hashable representation of a query, expression or option list
+
+            @param obj: the object
+        """
+
+        if obj is None or isinstance(obj, (basestring, int, long, float, bool)):
+            return obj
+        elif isinstance(obj, (list, tuple, set)):
+            return tuple(IS_ONE_OF_EMPTY.key_of(o) for o in obj)
+        else:
+            return str(obj)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def table_version(table):
+        """
+            Last modification and record count of a table, checked for
+            every option set (not memoized per request, so that writes
+            earlier in the same request, e.g. during imports, are seen)
+
+            @param table: the table
+        """
+
+        modified_on = table.modified_on.max()
+        count = table._id.count()
+        row = current.db(table._id > 0).select(modified_on, count).first()
+        return (row[modified_on], row[count])
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def clear_cache(tablename=None):
+        """
+            Remove the cached option sets from the process cache
+
+            @param tablename: remove only the option sets for this key
+                              table (default: all)
+        """
+
+        cache = IS_ONE_OF_EMPTY._options_cache
+        if tablename is None:
+            cache.clear()
+        else:
+            for key in cache.keys():
+                if key[0] == tablename:
+                    del cache[key]
+        return
+
+    # -------------------------------------------------------------------------
+    def exists(self, table, values):
+        """
+            Check whether all values are keys of accessible, non-deleted
+            records matching the filter (used in lazy mode)
+
+            @param table: the key table
+            @param values: list of values
+        """
+
+        kfield = table[self.kfield]
+        values = set(values)
+        if len(values) == 1:
+            query = (kfield == list(values)[0])
+        else:
+            query = (kfield.belongs(list(values)))
+        query &= self.options_query(table)
+        rows = self.dbset(query).select(kfield,
+                                        distinct=True,
+                                        limitby=(0, len(values)))
+        return len(rows) == len(values)
+
     # Removed as we don't want any options downloaded unnecessarily
     #def options(self):
 
@@ -518,12 +702,18 @@ class IS_ONE_OF_EMPTY(Validator):
                 else:
                     values = []
 
-                if self.theset:
+                if self.lazy:
+                    if not values or self.exists(table, values):
+                        return (values, None)
+                    else:
+                        return (value, self.error_message)
+                elif self.theset:
                     if not [x for x in values if not x in self.theset]:
                         return (values, None)
                     else:
                         return (value, self.error_message)
                 else:
+                    query = None
                     for v in values:
                         q = (table[self.kfield] == v)
                         query = query is not None and query | q or q
@@ -536,6 +726,12 @@ class IS_ONE_OF_EMPTY(Validator):
                     if self.dbset(query).count() < 1:
                         return (value, self.error_message)
                     return (values, None)
+            elif self.lazy:
+                if self.exists(table, [value]):
+                    if self._and:
+                        return self._and(value)
+                    else:
+                        return (value, None)
             elif self.theset:
                 if value in self.theset:
                     if self._and:
@@ -41,10 +41,12 @@ import os
 import sys
 import csv
 import datetime
+import threading
 import urllib2
 
 from gluon import *
 from gluon.storage import Storage
+from gluon.contrib.simplejson.ordered_dict import OrderedDict
 import gluon.contrib.simplejson as json
 
 from s3codec import S3Codec
@@ -66,6 +68,10 @@ class S3XML(S3Codec):
 
     CACHE_TTL = 20 # time-to-live of RAM cache for field representations
 
+    # Per-thread caches of compiled XSLT stylesheets
+    XSLT_CACHE = threading.local()
+    XSLT_CACHE_SIZE = 32 # maximum number of cached transformers per thread
+
     UID = "uuid"
     MCI = "mci"
     DELETED = "deleted"
@@ -229,25 +235,76 @@ class S3XML(S3Codec):
             _args = dict([(k, "'%s'" % args[k]) for k in args])
         else:
             _args = None
-        stylesheet = self.parse(stylesheet_path)
 
-        if stylesheet:
+        transformer = self.xslt(stylesheet_path)
+        if transformer is None:
+            # Error parsing or compiling the XSL stylesheet
+            return None
+
+        try:
+            if _args:
+                result = transformer(tree, **_args)
+            else:
+                result = transformer(tree)
+            return result
+        except:
+            e = sys.exc_info()[1]
+            self.error = e
+            return None
+
+    # -------------------------------------------------------------------------
+    def xslt(self, stylesheet_path):
+        """
+            Get the compiled XSLT transformer for a stylesheet
+
+            Transformers for local stylesheet files are kept in a
+            per-thread LRU cache (XSLT objects should not be shared
+            between threads), keyed by the path and invalidated when the
+            modification time of the file changes. Note that changes in
+            imported or included stylesheets are not detected.
+
+            @param stylesheet_path: pathname of the XSLT stylesheet
+                                    (can also be a file-like object or URL)
+        """
+
+        local = self.XSLT_CACHE
+        cache = getattr(local, "transformers", None)
+        if cache is None:
+            cache = local.transformers = OrderedDict()
+
+        key = None
+        if isinstance(stylesheet_path, basestring) and \
+           os.path.isfile(stylesheet_path):
             try:
-                ac = etree.XSLTAccessControl(read_file=True, read_network=True)
-                transformer = etree.XSLT(stylesheet, access_control=ac)
-                if _args:
-                    result = transformer(tree, **_args)
-                else:
-                    result = transformer(tree)
-                return result
-            except:
-                e = sys.exc_info()[1]
-                self.error = e
-                return None
-        else:
-            # Error parsing the XSL stylesheet
+                mtime = os.path.getmtime(stylesheet_path)
+            except OSError:
+                mtime = None
+            else:
+                key = os.path.abspath(stylesheet_path)
+        if key is not None:
+            entry = cache.pop(key, None)
+            if entry is not None and entry[0] == mtime:
+                # Most recently used => re-insert at the end
+                cache[key] = entry
+                return entry[1]
+
+        stylesheet = self.parse(stylesheet_path)
+        if not stylesheet:
+            return None
+        try:
+            ac = etree.XSLTAccessControl(read_file=True, read_network=True)
+            transformer = etree.XSLT(stylesheet, access_control=ac)
+        except:
+            e = sys.exc_info()[1]
+            self.error = e
             return None
 
+        if key is not None:
+            cache[key] = (mtime, transformer)
+            while len(cache) > self.XSLT_CACHE_SIZE:
+                cache.popitem(last=False)
+        return transformer
+
     # -------------------------------------------------------------------------
     def envelope(self, tree, stylesheet_path, **args):
         """
@@ -307,6 +364,24 @@ class S3XML(S3Codec):
                               encoding="utf-8",
                               pretty_print=True)
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def spool(chunks):
+        """
+            Write a streamed export into a temporary file
+
+            @param chunks: iterable of strings (e.g. S3Resource.export_stream)
+            @returns: the temporary file, rewound
+        """
+
+        import tempfile
+        output = tempfile.TemporaryFile()
+        write = output.write
+        for chunk in chunks:
+            write(chunk)
+        output.seek(0)
+        return output
+
     # -------------------------------------------------------------------------
     def tree(self, elements,
              root=None,
@@ -465,13 +540,100 @@ class S3XML(S3Codec):
         return None
 
     # -------------------------------------------------------------------------
-    def rmap(self, table, record, fields):
+    def lookup(self, table, rows, fields):
+        """
+            Resolves the references of a set of records in bulk, so that
+            rmap doesn't need to query the referenced tables per record
+
+            @param table: the database table
+            @param rows: the records
+            @param fields: list of reference field names in this table
+            @returns: a dict {fieldname: {id: Row}}, to be passed to rmap
+        """
+
+        db = current.db
+        lookup = dict()
+        if not rows:
+            return lookup
+
+        UID = self.UID
+        MCI = self.MCI
+        DELETED = self.DELETED
+
+        filter_mci = self.filter_mci
+        table_fields = table.fields
+
+        # Collect all foreign keys per key table
+        keys = dict()
+        ktablenames = dict()
+        for f in fields:
+            if f not in table_fields:
+                continue
+            fieldtype = str(table[f].type)
+            if fieldtype[:9] == "reference":
+                ktablename = fieldtype[10:]
+                multiple = False
+            elif fieldtype[:14] == "list:reference":
+                ktablename = fieldtype[15:]
+                multiple = True
+            else:
+                continue
+            if ktablename in keys:
+                ids = keys[ktablename]
+            else:
+                ids = keys[ktablename] = set()
+            for row in rows:
+                if f not in row:
+                    continue
+                val = row[f]
+                if val is None:
+                    continue
+                if multiple:
+                    ids.update([v for v in val if v is not None])
+                else:
+                    ids.add(val)
+            ktablenames[f] = ktablename
+
+        # One query per key table
+        kmaps = dict()
+        for ktablename, ids in keys.items():
+            if not ids:
+                continue
+            ktable = db[ktablename]
+            ktable_fields = ktable.fields
+            k_id = ktable._id
+            pkey = k_id.name
+            query = k_id.belongs(ids)
+            if pkey != "id" and "instance_type" in ktable_fields:
+                kfields = [k_id, ktable[UID], ktable.instance_type]
+            else:
+                if DELETED in ktable_fields:
+                    query = (ktable.deleted != True) & query
+                if filter_mci and MCI in ktable_fields:
+                    query = (ktable.mci >= 0) & query
+                if UID in ktable_fields:
+                    kfields = [k_id, ktable[UID]]
+                else:
+                    kfields = [k_id]
+            krows = db(query).select(*kfields)
+            kmaps[ktablename] = dict([(r[pkey], r) for r in krows])
+
+        for f, ktablename in ktablenames.items():
+            if ktablename in kmaps:
+                lookup[f] = kmaps[ktablename]
+        return lookup
+
+    # -------------------------------------------------------------------------
+    def rmap(self, table, record, fields, lookup=None):
         """
             Generates a reference map for a record
 
             @param table: the database table
             @param record: the record
             @param fields: list of reference field names in this table
+            @param lookup: pre-resolved references as returned by lookup(),
+                           keys missing in there will be looked up from
+                           the database
         """
 
         db = current.db
@@ -508,6 +670,14 @@ class S3XML(S3Codec):
             k_id = ktable._id
             pkey = k_id.name
 
+            # Pre-resolved references
+            kmap = lookup.get(f, None) if lookup else None
+            if kmap is not None:
+                for i in ids:
+                    if i not in kmap:
+                        kmap = None
+                        break
+
             if multiple:
                 query = k_id.belongs(ids)
                 limitby = None
@@ -521,9 +691,12 @@ class S3XML(S3Codec):
             if pkey != "id" and "instance_type" in ktable_fields:
                 if multiple:
                     continue
-                krecord = db(query).select(ktable[UID],
-                                           ktable.instance_type,
-                                           limitby=(0, 1)).first()
+                if kmap is not None:
+                    krecord = kmap[ids[0]]
+                else:
+                    krecord = db(query).select(ktable[UID],
+                                               ktable.instance_type,
+                                               limitby=(0, 1)).first()
                 if not krecord:
                     continue
                 ktablename = krecord.instance_type
@@ -534,19 +707,24 @@ class S3XML(S3Codec):
                     continue
                 uids = [uid]
             else:
-                if DELETED in ktable_fields:
-                    query = (ktable.deleted != True) & query
-                if filter_mci and MCI in ktable_fields:
-                    query = (ktable.mci >= 0) & query
+                if kmap is None:
+                    if DELETED in ktable_fields:
+                        query = (ktable.deleted != True) & query
+                    if filter_mci and MCI in ktable_fields:
+                        query = (ktable.mci >= 0) & query
                 if UID in ktable_fields:
-                    krecords = db(query).select(ktable[UID], limitby=limitby)
+                    if kmap is not None:
+                        krecords = [kmap[i] for i in ids]
+                    else:
+                        krecords = db(query).select(ktable[UID],
+                                                    limitby=limitby)
                     if krecords:
                         uids = [r[UID] for r in krecords if r[UID]]
                         if ktablename != gtablename:
                             uids = map(export_uid, uids)
                     else:
                         continue
-                else:
+                elif kmap is None:
                     krecord = db(query).select(k_id, limitby=(0, 1)).first()
                     if not krecord:
                         continue
@@ -724,10 +902,11 @@ class S3XML(S3Codec):
                 # - no current case for this
                 if WKTFIELD in fields:
                     query = (ktable.id == r_id)
+                    tolerance = gis.get_simplify_tolerance()
                     if settings.get_gis_spatialdb():
                         if format == "geojson":
                             # Do the Simplify & GeoJSON direct from the DB
-                            geojson = db(query).select(ktable.the_geom.st_simplify(0.001).st_asgeojson(precision=4).with_alias("geojson"),
+                            geojson = db(query).select(ktable.the_geom.st_simplify(tolerance).st_asgeojson(precision=4).with_alias("geojson"),
                                                        limitby=(0, 1)).first().geojson
                             if geojson:
                                 # Output the GeoJSON directly into the XML, so that XSLT can simply drop in
@@ -736,12 +915,30 @@ class S3XML(S3Codec):
                                 polygon = True
                         else:
                             # Do the Simplify direct from the DB
-                            wkt = db(query).select(ktable.the_geom.st_simplify(0.001).st_astext().with_alias("wkt"),
+                            wkt = db(query).select(ktable.the_geom.st_simplify(tolerance).st_astext().with_alias("wkt"),
                                                    limitby=(0, 1)).first().wkt
                             if wkt:
                                 # Convert the WKT in XSLT
                                 attr[ATTRIBUTE.wkt] = wkt
                                 polygon = True
+                    elif r.table == "gis_location":
+                        # Use the pre-simplified geometry
+                        if format == "geojson":
+                            geojson = gis.get_simplified([r_id],
+                                                         tolerance=tolerance,
+                                                         output="geojson").get(r_id, None)
+                            if geojson:
+                                polygon = True
+                                # Output the GeoJSON directly into the XML, so that XSLT can simply drop in
+                                geometry = etree.SubElement(element, "geometry")
+                                geometry.set("value", geojson)
+                        else:
+                            wkt = gis.get_simplified([r_id],
+                                                     tolerance=tolerance).get(r_id, None)
+                            if wkt:
+                                polygon = True
+                                # Convert the WKT in XSLT
+                                attr[ATTRIBUTE.wkt] = wkt
                     else:
                         wkt = db(query).select(ktable[WKTFIELD],
                                                limitby=(0, 1)).first()
@@ -1741,6 +1938,18 @@ class S3XML(S3Codec):
         else:
             return json.dumps(root_dict)
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def resource2json(cls, element):
+        """
+            Converts a single <resource> element into JSON, as it would
+            appear in the list of its table in tree2json (for streaming)
+
+            @param element: the <resource> element
+        """
+
+        return json.dumps(cls.__element2json(element, native=True))
+
     # -------------------------------------------------------------------------
     @staticmethod
     def collect_errors(job):
@@ -1802,12 +2011,47 @@ class S3XML(S3Codec):
             @todo: add a character encoding parameter to skip the guessing
         """
 
+        trees = cls.csv2trees(source,
+                              resourcename=resourcename,
+                              extra_data=extra_data,
+                              delimiter=delimiter,
+                              quotechar=quotechar,
+                              chunk_size=None)
+        return trees.next()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def csv2trees(cls, source,
+                  resourcename=None,
+                  extra_data=None,
+                  delimiter=",",
+                  quotechar='"',
+                  chunk_size=1000):
+        """
+            Convert a table-form CSV source into element trees (as in
+            csv2tree) of up to chunk_size rows each, reading the source
+            only as far as needed for the next tree
+
+            @param source: the source (file-like object)
+            @param resourcename: the resource name
+            @param extra_data: dict of extra cols to add to each row
+            @param delimiter: delimiter for values
+            @param quotechar: quotation character
+            @param chunk_size: the maximum number of rows per tree,
+                               None for a single tree with all rows
+
+            @returns: a generator of element trees (at least one tree,
+                      which may be empty)
+        """
+
         # Increase field sixe to ne able to import WKTs
         csv.field_size_limit(2**20 * 100)  # 100 megs
 
-        root = etree.Element(cls.TAG.table)
-        if resourcename is not None:
-            root.set(cls.ATTRIBUTE.name, resourcename)
+        def new_root():
+            root = etree.Element(cls.TAG.table)
+            if resourcename is not None:
+                root.set(cls.ATTRIBUTE.name, resourcename)
+            return root
 
         def add_col(row, key, value):
             col = etree.SubElement(row, cls.TAG.col)
@@ -1846,6 +2090,10 @@ class S3XML(S3Codec):
                     else:
                         e = encoding
                         break
+
+        root = new_root()
+        rows = 0
+        chunks = 0
         try:
             reader = csv.DictReader(utf_8_encode(source),
                                     delimiter=delimiter,
@@ -1858,6 +2106,12 @@ class S3XML(S3Codec):
                     for key in extra_data:
                         if key not in r:
                             add_col(row, key, extra_data[key])
+                rows += 1
+                if chunk_size and rows == chunk_size:
+                    chunks += 1
+                    yield etree.ElementTree(root)
+                    root = new_root()
+                    rows = 0
         except csv.Error:
             e = sys.exc_info()[1]
             raise HTTP(400, body=cls.json_message(False, 400, e))
@@ -1865,6 +2119,7 @@ class S3XML(S3Codec):
         # Use this to debug the source tree if needed:
         #print >>sys.stderr, cls.tostring(root, pretty_print=True)
 
-        return  etree.ElementTree(root)
+        if rows or not chunks:
+            yield etree.ElementTree(root)
 
 # End =========================================================================
@@ -234,6 +234,18 @@ class S3Config(Storage):
         return self.security.get("audit_read", False)
     def get_security_audit_write(self):
         return self.security.get("audit_write", False)
+    def get_security_audit_read_sample(self):
+        """
+            Fraction of read/list events to record in the audit trail
+            (e.g. 0.1 = every 10th event on average)
+        """
+        return self.security.get("audit_read_sample", 1)
+    def get_security_audit_aggregate(self):
+        """
+            Record only one audit entry per table for all read/list
+            events during a request or an export
+        """
+        return self.security.get("audit_aggregate", False)
     def get_security_policy(self):
         " Default is Simple Security Policy "
         return self.security.get("policy", 1)
@@ -259,6 +271,18 @@ class S3Config(Storage):
     def get_base_prepopulate(self):
         """ Whether to prepopulate the database &, if so, which set of data to use for this """
         return self.base.get("prepopulate", 1)
+    def get_base_prepopulate_workers(self):
+        """
+            Number of worker processes to run independent prepopulate
+            imports in parallel (1 = serial, always serial for SQLite)
+        """
+        return self.base.get("prepopulate_workers", 1)
+    def get_base_import_chunk_size(self):
+        """
+            Number of CSV rows to import and commit at a time in
+            prepopulate and in single-pass imports (None = all at once)
+        """
+        return self.base.get("import_chunk_size", None)
     def get_base_public_url(self):
         return self.base.get("public_url", "http://127.0.0.1:8000")
     def get_base_cdn(self):
@@ -278,7 +302,11 @@ class S3Config(Storage):
         db_type = self.database.get("db_type", "sqlite")
         pool_size = self.database.get("pool_size", 30)
         if (db_type == "sqlite"):
-            db_string = "sqlite://storage.db"
+            if self.get_gis_spatialite():
+                # SpatiaLite
+                db_string = "spatialite://storage.db"
+            else:
+                db_string = "sqlite://storage.db"
         elif (db_type == "mysql"):
             db_string = "mysql://%s:%s@%s:%s/%s" % \
                         (self.database.get("username", "sahana"),
@@ -387,11 +415,34 @@ class S3Config(Storage):
         return self.gis.get("geoserver_password", "")
     def get_gis_spatialdb(self):
         db_type = self.get_database_type()
-        if db_type != "postgres":
-            # Only Postgres supported currently
-            return False
-        else:
+        if db_type == "postgres":
             return self.gis.get("spatialdb", False)
+        elif db_type == "sqlite":
+            return self.get_gis_spatialite()
+        else:
+            # Only PostGIS & SpatiaLite supported currently
+            return False
+    def get_gis_spatialite(self):
+        """
+            Whether the SQLite database is a SpatiaLite database (requires
+            gis.spatialdb, and the SpatiaLite extension for SQLite)
+
+            NB Existing SQLite databases have to be migrated to SpatiaLite
+               (the_geom column and spatial index) before enabling this
+        """
+        if self.get_database_type() != "sqlite":
+            return False
+        return self.gis.get("spatialdb", False) and \
+               self.gis.get("spatialite", False)
+    def get_gis_spatial_index(self):
+        """
+            Whether to use an in-process R-tree index over the bounds of
+            gis_location for bbox queries (requires Rtree)
+        """
+        if self.get_gis_spatialdb():
+            # The spatial database has its own index
+            return False
+        return self.gis.get("spatial_index", False)
 
     # -------------------------------------------------------------------------
     # L10N Settings
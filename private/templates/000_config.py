@@ -42,8 +42,13 @@ settings.base.template = "default"
 #settings.database.password = "password"
 # Uncomment to use a different pool size
 #settings.database.pool_size = 30
-# Do we have a spatial DB available? (currently supports PostGIS. Spatialite to come.)
+# Do we have a spatial DB available? (currently supports PostGIS & SpatiaLite)
 #settings.gis.spatialdb = True
+# Uncomment to use SpatiaLite as spatial DB for SQLite (requires gis.spatialdb)
+# NB Existing SQLite databases must be migrated to SpatiaLite first
+#settings.gis.spatialite = True
+# Uncomment to use an in-process R-tree index of Location bounds for BBOX queries if there is no spatial DB (requires Rtree)
+#settings.gis.spatial_index = True
 
 # Base settings
 #settings.base.system_name = T("Sahana Eden Humanitarian Management Platform")
@@ -57,6 +62,13 @@ settings.base.migrate = True
 # To just create the .table files:
 #settings.base.fake_migrate = True
 
+# Number of worker processes to run independent prepopulate imports in
+# parallel (needs a database server, imports are always serial for SQLite)
+#settings.base.prepopulate_workers = 4
+# Uncomment to import and commit large CSV files in chunks of rows, rather
+# than all at once (prepopulate and single-pass imports)
+#settings.base.import_chunk_size = 1000
+
 # Set this to True to switch to Debug mode
 # Debug mode means that uncompressed CSS/JS files are loaded
 # JS Debug messages are also available in the Console
@@ -153,6 +165,10 @@ settings.frontpage.rss = [
 # NB Auditing (especially Reads) slows system down & consumes diskspace
 #settings.security.audit_write = False
 #settings.security.audit_read = False
+# Record only a random sample of reads (e.g. 0.1 = 10%)
+#settings.security.audit_read_sample = 1
+# Record only one entry per table for all reads during a request
+#settings.security.audit_aggregate = False
 
 # =============================================================================
 # Import the settings from the Template
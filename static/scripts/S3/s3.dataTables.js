@@ -142,6 +142,20 @@ $(document).ready(function() {
                 }
                 $.getJSON(sSource, aoData, function (json) {
                     // Callback processing
+                    if (json.restrict && S3.dataTables.Actions) {
+                        // Add the permitted records of this page to the restricted actions
+                        var Actions = S3.dataTables.Actions;
+                        for (var i=0; i < Actions.length; i++) {
+                            var permitted = json.restrict[Actions[i].permission];
+                            if (permitted && 'restrict' in Actions[i]) {
+                                for (var j=0; j < permitted.length; j++) {
+                                    if (posn_in_List(permitted[j], Actions[i].restrict) == -1) {
+                                        Actions[i].restrict.push(permitted[j]);
+                                    }
+                                }
+                            }
+                        }
+                    }
                     oCache.lastJson = jQuery.extend(true, {}, json);
                     if ( oCache.iCacheLower != oCache.iDisplayStart ) {
                         json.aaData.splice( 0, oCache.iDisplayStart - oCache.iCacheLower );
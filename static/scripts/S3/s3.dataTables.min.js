@@ -140,7 +140,7 @@ $(d).addClass("row_selected"));"Exclusive"==G&&($("#totalSelected").text(parseIn
 S3.dataTables.PostSubmitLabel+'"></div>').insertBefore(place)):(URL=S3.dataTables.SelectURL+"mode="+G+"&selected="+x.join(",")+"&post",$('<div class="actionButton"><a class="action-btn" id="submitSelection" href='+URL+">Submit</a></div>").insertBefore(place))}var d=S3.dataTables.id?document.getElementById(S3.dataTables.id):document.getElementById("list"),n=null!=d?d.getElementsByTagName("th").length:0,d=[];if(S3.dataTables.Actions){var z=[];d[0]={sTitle:" ",bSortable:!1}}else d[0]=null;for(var k=
 1;k<n;k++)d[k]=null;iDisplayLength=S3.dataTables.iDisplayLength?S3.dataTables.iDisplayLength:25;if(S3.dataTables.no_pagination)var k=n=!1,U=null,t=function(d,f,j){$.ajax({url:d,data:f,success:j,dataType:"json",cache:!1,error:function(d,f){"parsererror"==f&&alert("DataTables warning: JSON data from server could not be parsed. This is caused by a JSON formatting error.")}})};else var k=n=!0,U=S3.dataTables.sAjaxSource,p=S3.dataTables.oCache?S3.dataTables.oCache:{iCacheLower:-1},N=function(d,f,j){for(var k=
 0,l=d.length;k<l;k++)d[k].name==f&&(d[k].value=j)},A=function(d,f){for(var j=0,k=d.length;j<k;j++)if(d[j].name==f)return d[j].value;return null},t=function(d,f,j){var k=A(f,"iDisplayLength"),l=k==iDisplayLength?6:49<k||-1==k?2:4,m=!1,n=A(f,"sEcho"),q=A(f,"iDisplayStart");p.iDisplayStart=q;if(-1!==p.iCacheUpper&&(-1==k||0>p.iCacheLower||q<p.iCacheLower||q+k>p.iCacheUpper))m=!0;if(p.lastRequest&&!m)for(var t=0,x=f.length;t<x;t++)if("iDisplayStart"!=f[t].name&&"iDisplayLength"!=f[t].name&&"sEcho"!=f[t].name&&
-f[t].value!=p.lastRequest[t].value){m=!0;break}p.lastRequest=f.slice();m?(q<p.iCacheLower&&(q-=k*(l-1),0>q&&(q=0)),p.iCacheLower=q,p.iDisplayLength=A(f,"iDisplayLength"),-1==k?(p.iCacheUpper=-1,N(f,"iDisplayStart","None"),N(f,"iDisplayLength","None")):(p.iCacheUpper=q+k*l,N(f,"iDisplayStart",q),N(f,"iDisplayLength",k*l)),$.getJSON(d,f,function(d){p.lastJson=jQuery.extend(true,{},d);p.iCacheLower!=p.iDisplayStart&&d.aaData.splice(0,p.iDisplayStart-p.iCacheLower);p.iDisplayLength!==-1&&d.aaData.splice(p.iDisplayLength,
+f[t].value!=p.lastRequest[t].value){m=!0;break}p.lastRequest=f.slice();m?(q<p.iCacheLower&&(q-=k*(l-1),0>q&&(q=0)),p.iCacheLower=q,p.iDisplayLength=A(f,"iDisplayLength"),-1==k?(p.iCacheUpper=-1,N(f,"iDisplayStart","None"),N(f,"iDisplayLength","None")):(p.iCacheUpper=q+k*l,N(f,"iDisplayStart",q),N(f,"iDisplayLength",k*l)),$.getJSON(d,f,function(d){if(d.restrict&&S3.dataTables.Actions)for(var e=S3.dataTables.Actions,g=0;g<e.length;g++){var h=d.restrict[e[g].permission];if(h&&"restrict"in e[g])for(var i=0;i<h.length;i++){for(var r=-1,s=0,u=e[g].restrict.length;s<u;s++)if(h[i]==e[g].restrict[s]){r=s;break}-1==r&&e[g].restrict.push(h[i])}}p.lastJson=jQuery.extend(true,{},d);p.iCacheLower!=p.iDisplayStart&&d.aaData.splice(0,p.iDisplayStart-p.iCacheLower);p.iDisplayLength!==-1&&d.aaData.splice(p.iDisplayLength,
 d.aaData.length);j(d)})):(json=jQuery.extend(!0,{},p.lastJson),json.sEcho=n,-1!==k&&(json.aaData.splice(0,q-p.iCacheLower),json.aaData.splice(k,json.aaData.length)),j(json))};var w=void 0==S3.dataTables.bFilter?!0:S3.dataTables.bFilter,I=S3.dataTables.aaSorting?S3.dataTables.aaSorting:[[1,"asc"]],H=S3.dataTables.group?[[S3.dataTables.group,"asc"]]:null,aa=S3.dataTables.sDom?S3.dataTables.sDom:'fril<"dataTable_table"t>pi',L=S3.dataTables.sPaginationType?S3.dataTables.sPaginationType:"full_numbers";
 if(S3.dataTables.Selectable){var x=jQuery.parseJSON($("#importSelected").val());null==x&&(x=[]);var G="Inclusive";S3.dataTables.SelectAll&&(G="Exclusive")}$(".dataTable").dataTable({sDom:aa,sPaginationType:L,bServerSide:n,bFilter:w,bSort:!0,bDeferRender:!0,aaSorting:I,aoColumns:d,iDisplayLength:iDisplayLength,aLengthMenu:[[25,50,-1],[25,50,S3.i18n.all]],bProcessing:k,sAjaxSource:U,fnServerData:t,fnHeaderCallback:function(d){var f;f='<span class="dataTable-btn" id="modeSelectionNone">Deselect&nbsp;All</span>&nbsp;<span class="dataTable-btn" id="modeSelectionAll">Select&nbsp;All</span>';
 S3.dataTables.ShowAllValidButton&&(f='<span class="dataTable-btn" id="modeSelectionValid">Select&nbsp;Valid</span>&nbsp;'+f);S3.dataTables.Selectable&&(d.getElementsByTagName("th")[0].innerHTML=f);$("#modeSelectionAll").bind("click",q);$("#modeSelectionNone").bind("click",l);$("#modeSelectionValid").bind("click",m)},fnRowCallback:function(d,k){var l=/>(.*)</i,m=l.exec(k[0]),n=null==m?k[0]:m[1];S3.dataTables.Selectable&&($(d).unbind("click"),$(d).click(function(){-1==f(n,x)?x.push(n):x.splice(f(n,
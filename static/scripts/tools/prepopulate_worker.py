@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+
+# Worker process for parallel prepopulate imports, started by
+# S3BulkImporter if settings.base.prepopulate_workers > 1
+#
+# Reads import tasks (JSON, one per line) from stdin, runs them, and
+# writes the results to stdout.
+#
+# Needs to be run in the web2py environment
+# python web2py.py -S eden -M -R applications/eden/static/scripts/tools/prepopulate_worker.py
+
+import sys
+
+s3base.S3BulkImporter().serve(sys.stdin, sys.stdout)
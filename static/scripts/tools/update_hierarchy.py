@@ -0,0 +1,24 @@
+# Script to rebuild the OU hierarchy closure table (pr_hierarchy), e.g.
+# after a bulk import
+#
+# - an empty closure table (e.g. after upgrading an existing database) gets
+#   rebuilt automatically on first use, see pr_check_hierarchy
+#
+# run as python web2py.py -S eden -M -R applications/eden/static/scripts/tools/update_hierarchy.py
+#
+# - to only rebuild the ancestors of certain entities (and their descendants),
+#   pass their pe_ids:
+#   python web2py.py -S eden -M -R applications/eden/static/scripts/tools/update_hierarchy.py -A 123 456
+#
+
+import sys
+import time
+
+secs = time.mktime(time.localtime())
+
+pe_ids = [int(arg) for arg in sys.argv[1:]]
+s3db.pr_update_hierarchy(pe_ids or None)
+
+db.commit()
+
+print "Total Time: %s" % (time.mktime(time.localtime()) - secs)
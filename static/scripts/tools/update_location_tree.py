@@ -0,0 +1,23 @@
+# Script to rebuild the Location hierarchy (materialized paths, and missing
+# bounds/centroids), e.g. after a bulk import of GADM or Geonames data
+#
+# run as python web2py.py -S eden -M -R applications/eden/static/scripts/tools/update_location_tree.py
+#
+# - to only rebuild the subtrees of certain Locations, pass their IDs:
+#   python web2py.py -S eden -M -R applications/eden/static/scripts/tools/update_location_tree.py -A 123 456
+#
+
+import sys
+import time
+
+secs = time.mktime(time.localtime())
+
+location_ids = [int(arg) for arg in sys.argv[1:]]
+if location_ids:
+    gis.rebuild_location_tree(location_ids)
+else:
+    gis.update_location_tree()
+
+db.commit()
+
+print "Total Time: %s" % (time.mktime(time.localtime()) - secs)
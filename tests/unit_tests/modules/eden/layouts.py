@@ -63,6 +63,50 @@ class LayoutTests(unittest.TestCase):
         self.assertTrue(type(output) is str)
         self.assertNotEqual(output, "")
 
+    def testPermissionCache(self):
+
+        item = S3AddResourceLink(c="pr", f="person")
+
+        auth.s3_impersonate(None)
+        s3base.S3NavigationItem._permissions.clear()
+        permitted = item.check_permission()
+        cache_key = auth.permission.cache_key()
+        permissions = s3base.S3NavigationItem._permissions
+        self.assertTrue(cache_key in permissions)
+        self.assertTrue(permitted in permissions[cache_key].values())
+
+        # Same check for a different item hits the cache, i.e. does
+        # not check the URL again
+        other = S3AddResourceLink(c="pr", f="person")
+        calls = []
+        accessible_url = other.accessible_url
+        def count_calls(*args, **kwargs):
+            calls.append(args)
+            return accessible_url(*args, **kwargs)
+        other.accessible_url = count_calls
+        self.assertEqual(other.check_permission(), permitted)
+        self.assertEqual(len(calls), 0)
+        self.assertEqual(len(permissions[cache_key]), 1)
+
+        # A different target is checked (and cached) separately
+        other = S3AddResourceLink(c="pr", f="address")
+        other.check_permission()
+        self.assertEqual(len(permissions[cache_key]), 2)
+
+        # Different user => different results
+        auth.s3_impersonate(1)
+        self.assertNotEqual(auth.permission.cache_key(), cache_key)
+        self.assertTrue(item.check_permission())
+
+        # No caching with override
+        auth.override = True
+        self.assertEqual(auth.permission.cache_key(), None)
+        auth.override = False
+
+    def tearDown(self):
+
+        auth.s3_impersonate(None)
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
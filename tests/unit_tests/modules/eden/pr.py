@@ -109,6 +109,103 @@ class PRTests(unittest.TestCase):
         finally:
             db.rollback()
 
+# =============================================================================
+class PRHierarchyTests(unittest.TestCase):
+    """ OU hierarchy closure table tests """
+
+    def setUp(self):
+
+        auth.override = True
+
+        table = s3db.org_organisation
+        self.orgs = []
+        for i in xrange(4):
+            record_id = table.insert(name="TestHierarchyOrg%s" % i)
+            s3mgr.model.update_super(table, Storage(id=record_id))
+            self.orgs.append(s3db.pr_get_pe_id(table, record_id))
+
+    def testAncestorsAndDescendants(self):
+        """ Test closure maintenance when affiliations change """
+
+        org0, org1, org2, org3 = self.orgs
+
+        # org0 => org1 => org2, org3 separate
+        s3db.pr_add_affiliation(org1, org2, role="TestOrgUnit")
+        s3db.pr_add_affiliation(org0, org1, role="TestOrgUnit")
+
+        self.assertEqual(s3db.pr_get_ancestors(org2), [org1, org0])
+        self.assertEqual(s3db.pr_realm(org2), [org1])
+        descendants = s3db.pr_descendants([org0])
+        self.assertEqual(sorted(descendants[org0]), sorted([org1, org2]))
+
+        # Move org1 under org3
+        s3db.pr_remove_affiliation(org0, org1, role="TestOrgUnit")
+        s3db.pr_add_affiliation(org3, org1, role="TestOrgUnit")
+
+        self.assertEqual(s3db.pr_get_ancestors(org2), [org1, org3])
+        self.assertFalse(org0 in s3db.pr_descendants([org0]))
+
+        # Full rebuild gives the same result
+        s3db.pr_update_hierarchy()
+        self.assertEqual(s3db.pr_get_ancestors(org2), [org1, org3])
+
+    def testSetLookups(self):
+        """ Test multi-entity ancestor/descendant lookups """
+
+        org0, org1, org2, org3 = self.orgs
+
+        s3db.pr_add_affiliation(org0, org1, role="TestOrgUnit")
+        s3db.pr_add_affiliation(org1, org2, role="TestOrgUnit")
+        s3db.pr_add_affiliation(org0, org3, role="TestOrgUnit")
+
+        ancestors = s3db.pr_ancestors([org2, org3])
+        self.assertEqual(ancestors[org2], [org1, org0])
+        self.assertEqual(ancestors[org3], [org0])
+
+        descendants = s3db.pr_get_descendants(org0)
+        self.assertEqual(sorted(descendants), sorted([org1, org2, org3]))
+        descendants = s3db.pr_get_descendants([org0], skip=[org1])
+        self.assertEqual(sorted(descendants), sorted([org1, org3]))
+
+        table = s3db.pr_pentity
+        query = s3db.pr_hierarchy_query(table.pe_id, [org1])
+        rows = db(query).select(table.pe_id)
+        self.assertEqual(sorted([row.pe_id for row in rows]),
+                         sorted([org1, org2]))
+
+    def testHierarchyVersion(self):
+        """ Test that affiliation changes invalidate the version """
+
+        org0, org1 = self.orgs[:2]
+
+        version = s3db.pr_hierarchy_version()
+        self.assertEqual(s3db.pr_hierarchy_version(), version)
+        s3db.pr_add_affiliation(org0, org1, role="TestOrgUnit")
+        self.assertNotEqual(s3db.pr_hierarchy_version(), version)
+
+    def testHierarchyVersionThrottled(self):
+        """ Test that the table stamps are not re-read for every request """
+
+        if getattr(current.cache, "memcache", None) is not None:
+            return
+        org0 = self.orgs[0]
+
+        version = s3db.pr_hierarchy_version()
+        # Writes bypassing pr_clear_hierarchy_version (e.g. in other
+        # processes) are noticed after HIERARCHY_CHECK_INTERVAL only
+        s3db.pr_role.insert(pe_id=org0, role="TestThrottle", role_type=9)
+        current.response.s3.pr_hierarchy_version = None
+        self.assertEqual(s3db.pr_hierarchy_version(), version)
+        current.cache.ram("pr_hierarchy_version_stamps", None)
+        current.response.s3.pr_hierarchy_version = None
+        self.assertNotEqual(s3db.pr_hierarchy_version(), version)
+
+    def tearDown(self):
+
+        db.rollback()
+        s3db.pr_clear_hierarchy_version()
+        auth.override = False
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
@@ -126,6 +223,7 @@ if __name__ == "__main__":
 
     run_suite(
         PRTests,
+        PRHierarchyTests,
     )
 
 # END ========================================================================
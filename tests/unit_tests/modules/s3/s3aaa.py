@@ -924,6 +924,126 @@ class S3PermissionTests(unittest.TestCase):
             auth.s3_delete_role("TESTGROUP")
             db.rollback()
 
+    def testACLCache(self):
+
+        try:
+            acl = auth.permission
+            role = auth.s3_create_role("Test Group", None,
+                                       dict(t="org_office", uacl=acl.READ, oacl=acl.ALL),
+                                       uid="TESTGROUP")
+
+            deployment_settings.security.policy = 5
+            auth.permission = s3base.S3Permission(auth)
+            permission = auth.permission
+
+            realms = Storage({role: None})
+            acls = permission.applicable_acls(acl.READ, realms, Storage(),
+                                              c="org", f="office", t="org_office")
+            self.assertEqual(acls["ANY"], (acl.READ, acl.ALL))
+
+            # Repeated lookups come from the compiled ACLs
+            cache = s3base.S3Permission._acl_cache
+            self.assertNotEqual(cache, None)
+            self.assertEqual(len(cache.results), 1)
+            acls = permission.applicable_acls(acl.READ, realms, Storage(),
+                                              c="org", f="office", t="org_office")
+            self.assertEqual(acls["ANY"], (acl.READ, acl.ALL))
+            self.assertTrue(s3base.S3Permission._acl_cache is cache)
+
+            # Updating the ACL invalidates the cache
+            permission.update_acl(role, t="org_office",
+                                  uacl=acl.READ|acl.UPDATE, oacl=acl.ALL)
+            self.assertEqual(s3base.S3Permission._acl_cache, None)
+            acls = permission.applicable_acls(acl.READ, realms, Storage(),
+                                              c="org", f="office", t="org_office")
+            self.assertEqual(acls["ANY"], (acl.READ|acl.UPDATE, acl.ALL))
+
+        finally:
+            auth.s3_delete_role("TESTGROUP")
+            db.rollback()
+
+    def testRealmRoots(self):
+        """ Test that realm roots are only used when they are exact """
+
+        try:
+            auth.override = True
+
+            # org0 => org1 => org2, org3 separate
+            otable = s3db.org_organisation
+            orgs = []
+            for i in xrange(4):
+                record_id = otable.insert(name="TestRealmOrg%s" % i)
+                s3mgr.model.update_super(otable, Storage(id=record_id))
+                orgs.append(s3db.pr_get_pe_id(otable, record_id))
+            org0, org1, org2, org3 = orgs
+            s3db.pr_add_affiliation(org0, org1, role="TestOrgUnit")
+            s3db.pr_add_affiliation(org1, org2, role="TestOrgUnit")
+
+            # Add the user as OU descendant of org0
+            user_id = auth.s3_get_user_id("normaluser@example.com")
+            user_pe = auth.s3_user_pe_id(user_id)
+            s3db.pr_add_affiliation(org0, user_pe, role="TestStaff")
+
+            # One office per entity
+            table = s3db.org_office
+            offices = {}
+            for pe_id in orgs + [user_pe]:
+                offices[pe_id] = table.insert(name="TestRealmOffice",
+                                              owned_by_entity=pe_id)
+            auth.override = False
+
+            acl = auth.permission
+            page = dict(c="org", f="office", uacl=acl.ALL, oacl=acl.ALL)
+            own = auth.s3_create_role("Test Own", None, page,
+                                      dict(t="org_office",
+                                           uacl=acl.READ, oacl=acl.READ),
+                                      uid="TESTOWN")
+            tight = auth.s3_create_role("Test Tight", None, page,
+                                        dict(t="org_office",
+                                             uacl=acl.CREATE, oacl=acl.CREATE),
+                                        uid="TESTTIGHT")
+            delegated = auth.s3_create_role("Test Delegated", None, page,
+                                            dict(t="org_office",
+                                                 uacl=acl.READ|acl.CREATE,
+                                                 oacl=acl.READ|acl.CREATE),
+                                            uid="TESTDELEGATED")
+
+            deployment_settings.security.policy = 8
+            auth.permission = s3base.S3Permission(auth)
+            permission = auth.permission
+            permission.REALM_ROOTS_MIN = 0
+
+            # A complete realm reduces to its root
+            self.assertEqual(permission.realm_roots([org0, org1, org2]),
+                             [org0])
+
+            # org3 receives the delegated role for org0 and all its
+            # descendants, but the more restrictive ACL for org2 drops
+            # it from the realm; the person entity is not expanded
+            auth.s3_impersonate("normaluser@example.com")
+            auth.user.realms = Storage({own: [org3], tight: [org2]})
+            auth.user.delegations = Storage({delegated:
+                                    {org3: [org0, org1, org2, user_pe]}})
+            self.assertEqual(permission.realm_roots([org3, org0,
+                                                     org1, user_pe]),
+                             None)
+
+            query = permission.accessible_query("read", table,
+                                                c="org", f="office")
+            query &= table.id.belongs(offices.values())
+            rows = db(query).select(table.id)
+            accessible = [row.id for row in rows]
+            for pe_id in (org0, org1, org3, user_pe):
+                self.assertTrue(offices[pe_id] in accessible)
+            self.assertFalse(offices[org2] in accessible)
+
+        finally:
+            auth.s3_impersonate(None)
+            auth.s3_delete_role("TESTOWN")
+            auth.s3_delete_role("TESTTIGHT")
+            auth.s3_delete_role("TESTDELEGATED")
+            db.rollback()
+
     # -------------------------------------------------------------------------
     # Helpers
     #
@@ -2667,6 +2787,33 @@ class S3AccessibleQueryTests(unittest.TestCase):
             s3db.pr_remove_affiliation(self.org2, self.org3, role="TestOrgUnit")
             auth.s3_retract_role(user, self.dvi_reader, for_pe=self.org3)
 
+    def testPermittedIDs(self):
+
+        deployment_settings.security.policy = 5
+        auth.permission = s3base.S3Permission(auth)
+
+        permitted_ids = auth.permission.permitted_ids
+        table = s3db.dvi_body
+        ids = [self.record1, self.record2, self.record3]
+
+        # Check anonymous
+        self.assertEqual(permitted_ids("read", table, ids, c="dvi", f="body"), [])
+
+        auth.s3_impersonate("normaluser@example.com")
+        db(table.id == self.record2).update(owned_by_user=auth.user.id)
+
+        # Test with TESTDVIREADER
+        auth.s3_assign_role(auth.user.id, self.dvi_reader)
+        self.assertEqual(permitted_ids("read", table, ids, c="dvi", f="body"), ids)
+        self.assertEqual(permitted_ids("update", "dvi_body", ids, c="dvi", f="body"),
+                         [self.record2])
+        self.assertEqual(permitted_ids("delete", table, ids, c="dvi", f="body"), [])
+        self.assertEqual(permitted_ids("update", table, [], c="dvi", f="body"), [])
+        auth.s3_retract_role(auth.user.id, self.dvi_reader)
+
+        # Logout
+        auth.s3_impersonate(None)
+
     def tearDown(self):
         self.role = None
         db.rollback()
@@ -2741,6 +2888,90 @@ class S3EntityRoleManagerTests(unittest.TestCase):
         pass
 
 
+# =============================================================================
+class S3AuditTests(unittest.TestCase):
+    """ Test the buffered audit trail writer """
+
+    def setUp(self):
+
+        settings = deployment_settings.security
+        self.audit_read = settings.audit_read
+        self.audit_write = settings.audit_write
+        self.audit_aggregate = settings.audit_aggregate
+        settings.audit_read = True
+        settings.audit_write = True
+
+        self.audit = s3base.S3Audit()
+        self.table = self.audit.table
+
+    def count(self, operation):
+        table = self.table
+        query = (table.tablename == "dvi_body") & \
+                (table.operation == operation)
+        return db(query).count()
+
+    def testBatch(self):
+        """ Test that audit events are written at the end of a batch """
+
+        audit = self.audit
+        before = self.count("update")
+
+        audit.begin()
+        audit("update", "dvi", "body", record=1, representation="html")
+        audit("update", "dvi", "body", record=2, representation="html")
+        self.assertEqual(self.count("update"), before)
+        audit.end()
+        self.assertEqual(self.count("update"), before + 2)
+
+        # Outside of a batch, events are written immediately
+        audit("update", "dvi", "body", record=3, representation="html")
+        self.assertEqual(self.count("update"), before + 3)
+
+    def testDiscard(self):
+        """ Test that buffered events can be discarded """
+
+        audit = self.audit
+        before = self.count("update")
+
+        audit.begin()
+        audit("update", "dvi", "body", record=1, representation="html")
+        audit.end(flush=False)
+        self.assertEqual(self.count("update"), before)
+        self.assertEqual(audit.batch, 0)
+
+    def testAggregateReads(self):
+        """ Test the aggregation of read events """
+
+        deployment_settings.security.audit_aggregate = True
+
+        audit = self.audit
+        before = self.count("read")
+
+        audit.begin()
+        for record_id in (1, 2, 3):
+            audit("read", "dvi", "body", record=record_id, representation="xml")
+        audit.end()
+        self.assertEqual(self.count("read"), before + 1)
+
+        table = self.table
+        query = (table.tablename == "dvi_body") & \
+                (table.operation == "read")
+        row = db(query).select(table.record,
+                               table.new_value,
+                               orderby=~table.id,
+                               limitby=(0, 1)).first()
+        self.assertEqual(row.record, None)
+        for record_id in (1, 2, 3):
+            self.assertTrue("id:%s" % record_id in row.new_value)
+
+    def tearDown(self):
+
+        settings = deployment_settings.security
+        settings.audit_read = self.audit_read
+        settings.audit_write = self.audit_write
+        settings.audit_aggregate = self.audit_aggregate
+        db.rollback()
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
@@ -2762,7 +2993,8 @@ if __name__ == "__main__":
         S3HasPermissionTests,
         S3AccessibleQueryTests,
         S3DelegationTests,
-        S3EntityRoleManagerTests
+        S3EntityRoleManagerTests,
+        S3AuditTests,
     )
 
 # END ========================================================================
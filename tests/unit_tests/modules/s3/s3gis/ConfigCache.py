@@ -0,0 +1,56 @@
+import unittest
+
+from gluon import current
+
+class ConfigCache(unittest.TestCase):
+    """ Test the process-wide cache of map configurations """
+
+    def setUp(self):
+        current.gis.clear_config_cache()
+        current.response.s3.gis.config = None
+
+    def tearDown(self):
+        current.db.rollback()
+        current.gis.clear_config_cache()
+        current.response.s3.gis.config = None
+
+    def test_cached(self):
+        gis = current.gis
+        gis.set_config(0)
+        config = current.response.s3.gis.config
+        assert len(gis._config_cache) == 1
+
+        # Same config from the cache, but a separate copy per request
+        current.response.s3.gis.config = None
+        gis.set_config(0)
+        cached = current.response.s3.gis.config
+        assert cached == config
+        assert cached is not config
+        assert len(gis._config_cache) == 1
+
+    def test_invalidate(self):
+        gis = current.gis
+        gis.set_config(0)
+        version = gis.config_version()
+        gis.clear_config_cache()
+        assert len(gis._config_cache) == 0
+        assert gis.config_version() != version
+
+    def test_no_db_references(self):
+        gis = current.gis
+        gis.set_config(0)
+        config = current.response.s3.gis.config
+        for key in ("update_record", "delete_record", "gis_layer_config"):
+            assert key not in config
+
+    def test_marker_cached(self):
+        gis = current.gis
+        gis.set_config(0)
+        marker = gis.get_marker("org", "office")
+        size = len(gis._config_cache)
+
+        # Same marker from the cache, but a separate copy per call
+        cached = gis.get_marker("org", "office")
+        assert cached == marker
+        assert cached is not marker
+        assert len(gis._config_cache) == size
@@ -0,0 +1,64 @@
+import os
+import unittest
+
+from gluon import current
+
+s3gis = local_import("s3.s3gis")
+
+class LocationImporter(unittest.TestCase):
+    """ Test the bulk Location importer """
+
+    def setUp(self):
+        db = current.db
+        s3db = current.s3db
+        table = s3db.gis_location
+        ttable = s3db.gis_location_tag
+        self.l0 = table.insert(name = "ImportTestL0", level = "L0")
+        current.gis.update_location_tree(self.l0)
+        ttable.insert(location_id = self.l0,
+                      tag = "ISO2",
+                      value = "ZZ")
+
+    def tearDown(self):
+        current.db.rollback()
+
+    def importer(self):
+        return s3gis.S3LocationImporter("test",
+                                        "L1",
+                                        "geonames",
+                                        parent_level = "L0",
+                                        parent_tag = "ISO2",
+                                        batch_size = 2)
+
+    def test_import(self):
+        importer = self.importer()
+        items = [("1", 10, 10), ("2", 11, 11), ("3", 12, 12)]
+        for code, lat, lon in importer.resume(items):
+            assert importer.add(code, "ImportTest%s" % code,
+                                parent_code = "ZZ",
+                                lat = lat,
+                                lon = lon)
+        # Checkpoint written after the first batch
+        assert os.path.exists(importer.checkpoint)
+        assert importer.finish() == 3
+        assert not os.path.exists(importer.checkpoint)
+
+        table = current.s3db.gis_location
+        rows = current.db(table.parent == self.l0).select()
+        assert len(rows) == 3
+        for row in rows:
+            assert row.path == "%s/%s" % (self.l0, row.id)
+            assert row.lat_min == row.lat
+
+        # Re-import skips the existing Locations
+        importer = self.importer()
+        assert not importer.add("1", "ImportTest1", parent_code = "ZZ",
+                                lat = 10, lon = 10)
+        importer.finish()
+
+    def test_resume(self):
+        importer = self.importer()
+        importer.start = 2
+        items = list(importer.resume(["a", "b", "c"]))
+        assert items == ["c"]
+        assert importer.position == 3
@@ -0,0 +1,61 @@
+import unittest
+
+from gluon import current
+
+s3gis = local_import("s3.s3gis")
+
+class LocationIndex(unittest.TestCase):
+    """ Test the in-process R-tree index over Location bounds """
+
+    def setUp(self):
+        if not s3gis.RTREE:
+            raise unittest.SkipTest("Rtree not installed")
+        settings = current.deployment_settings
+        self.spatial_index = settings.gis.get("spatial_index", False)
+        settings.gis.spatial_index = True
+
+        table = current.s3db.gis_location
+        self.inside = table.insert(name = "IndexTestInside",
+                                   lat = 15, lon = 15,
+                                   lat_min = 14, lat_max = 16,
+                                   lon_min = 14, lon_max = 16)
+        self.outside = table.insert(name = "IndexTestOutside",
+                                    lat = 45, lon = 45,
+                                    lat_min = 45, lat_max = 45,
+                                    lon_min = 45, lon_max = 45)
+        s3gis.S3LocationIndex.build()
+
+    def tearDown(self):
+        current.db.rollback()
+        current.deployment_settings.gis.spatial_index = self.spatial_index
+        s3gis.S3LocationIndex._index = None
+
+    def test_bbox(self):
+        ids = s3gis.S3LocationIndex.bbox(10, 10, 20, 20)
+        assert self.inside in ids
+        assert self.outside not in ids
+
+    def test_point(self):
+        ids = s3gis.S3LocationIndex.point(15.5, 15.5)
+        assert self.inside in ids
+
+    def test_nearest(self):
+        ids = s3gis.S3LocationIndex.nearest(44, 44, 1)
+        assert self.outside in ids
+
+    def test_update(self):
+        table = current.s3db.gis_location
+        current.db(table.id == self.outside).update(lat = 18, lon = 18,
+                                                    lat_min = 18, lat_max = 18,
+                                                    lon_min = 18, lon_max = 18)
+        s3gis.S3LocationIndex.update(self.outside)
+        ids = s3gis.S3LocationIndex.bbox(10, 10, 20, 20)
+        assert self.outside in ids
+
+    def test_bbox_query(self):
+        gis = current.gis
+        query = gis.query_features_by_bbox(10, 10, 20, 20)
+        rows = current.db(query).select(current.s3db.gis_location.id)
+        ids = [row.id for row in rows]
+        assert self.inside in ids
+        assert self.outside not in ids
@@ -0,0 +1,42 @@
+import unittest
+
+from gluon import current
+
+class LocationTree(unittest.TestCase):
+    """ Test the maintenance of the Location hierarchy paths """
+
+    def setUp(self):
+        table = current.s3db.gis_location
+        insert = table.insert
+        self.l0 = insert(name = "TreeTestL0", level = "L0")
+        self.l0b = insert(name = "TreeTestL0b", level = "L0")
+        self.l1 = insert(name = "TreeTestL1", level = "L1", parent = self.l0)
+        self.l2 = insert(name = "TreeTestL2", level = "L2", parent = self.l1)
+
+    def tearDown(self):
+        current.db.rollback()
+
+    def path(self, location_id):
+        table = current.s3db.gis_location
+        return table[location_id].path
+
+    def test_rebuild(self):
+        gis = current.gis
+        gis.rebuild_location_tree()
+        assert self.path(self.l0) == str(self.l0)
+        assert self.path(self.l2) == "%s/%s/%s" % (self.l0, self.l1, self.l2)
+
+    def test_rebuild_subtree(self):
+        gis = current.gis
+        gis.rebuild_location_tree([self.l1])
+        assert self.path(self.l1) == "%s/%s" % (self.l0, self.l1)
+        assert self.path(self.l2) == "%s/%s/%s" % (self.l0, self.l1, self.l2)
+
+    def test_move_subtree(self):
+        gis = current.gis
+        gis.rebuild_location_tree()
+        table = current.s3db.gis_location
+        current.db(table.id == self.l1).update(parent = self.l0b)
+        gis.update_location_tree(self.l1, self.l0b)
+        # Descendants follow
+        assert self.path(self.l2) == "%s/%s/%s" % (self.l0b, self.l1, self.l2)
@@ -0,0 +1,68 @@
+import unittest
+
+from gluon import current
+from gluon.storage import Storage
+
+s3gis = local_import("s3.s3gis")
+
+class SimplifiedGeometries(unittest.TestCase):
+    """ Test the pre-simplified Location geometries """
+
+    WKT = "POLYGON((10 10, 10 10.00001, 10 20, 20 20, 20 10, 10 10))"
+
+    def setUp(self):
+        if not s3gis.SHAPELY:
+            raise unittest.SkipTest("Shapely not installed")
+        table = current.s3db.gis_location
+        self.location_id = table.insert(name = "SimplifyTestPolygon",
+                                        wkt = self.WKT,
+                                        lat = 15, lon = 15)
+        self.get_vars = current.request.get_vars
+        current.request.get_vars = Storage()
+
+    def tearDown(self):
+        current.db.rollback()
+        current.request.get_vars = self.get_vars
+
+    def test_update(self):
+        gis = current.gis
+        simplified = gis.update_simplified(self.location_id)
+        assert len(simplified) == len(gis.SIMPLIFY_TOLERANCES)
+        table = current.s3db.gis_location_simplified
+        query = (table.location_id == self.location_id)
+        assert current.db(query).count() == len(gis.SIMPLIFY_TOLERANCES)
+        # Re-generating replaces the previous geometries
+        gis.update_simplified(self.location_id)
+        assert current.db(query).count() == len(gis.SIMPLIFY_TOLERANCES)
+        # Points are skipped
+        point = "POINT(15 15)"
+        assert gis.update_simplified(self.location_id, wkt=point,
+                                     previous=point) == {}
+        assert current.db(query).count() == len(gis.SIMPLIFY_TOLERANCES)
+        # ...unless they replace a polygon
+        gis.update_simplified(self.location_id, wkt=point,
+                              previous=self.WKT)
+        assert current.db(query).count() == 0
+
+    def test_get_simplified(self):
+        gis = current.gis
+        geometries = gis.get_simplified([self.location_id],
+                                        tolerance=0.01,
+                                        output="geojson")
+        assert self.location_id in geometries
+        assert "Polygon" in geometries[self.location_id]
+        # Now served from the store
+        table = current.s3db.gis_location_simplified
+        query = (table.location_id == self.location_id)
+        assert current.db(query).count() > 0
+
+    def test_tolerance(self):
+        gis = current.gis
+        get_vars = current.request.get_vars
+        assert gis.get_simplify_tolerance() == gis.SIMPLIFY_DEFAULT
+        get_vars["bbox"] = "-180,-90,180,90"
+        assert gis.get_simplify_tolerance() == 0.1
+        get_vars["bbox"] = "0,0,15,10"
+        assert gis.get_simplify_tolerance() == 0.01
+        get_vars["bbox"] = "0,0,0.15,0.1"
+        assert gis.get_simplify_tolerance() == 0.0001
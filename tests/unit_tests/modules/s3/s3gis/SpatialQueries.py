@@ -0,0 +1,68 @@
+import unittest
+
+from gluon import current
+
+class SpatialQueries(unittest.TestCase):
+    """ Test the spatial query engine """
+
+    POLYGON = "POLYGON((10 10, 10 20, 20 20, 20 10, 10 10))"
+
+    def setUp(self):
+        table = current.s3db.gis_location
+        insert = table.insert
+        # Point inside, point outside, polygon overlapping the search area,
+        # point inside the bbox of an L-shaped search area but outside it
+        self.inside = insert(name = "SpatialTestInside",
+                             lat = 15, lon = 15,
+                             lat_min = 15, lat_max = 15,
+                             lon_min = 15, lon_max = 15)
+        self.outside = insert(name = "SpatialTestOutside",
+                              lat = 30, lon = 30,
+                              lat_min = 30, lat_max = 30,
+                              lon_min = 30, lon_max = 30)
+        self.overlap = insert(name = "SpatialTestOverlap",
+                              wkt = "POLYGON((18 18, 18 25, 25 25, 25 18, 18 18))",
+                              lat = 21.5, lon = 21.5,
+                              lat_min = 18, lat_max = 25,
+                              lon_min = 18, lon_max = 25)
+        self.nobounds = insert(name = "SpatialTestNoBounds",
+                               lat = 11, lon = 11)
+
+    def tearDown(self):
+        current.db.rollback()
+
+    def ids(self, op, shape, distance=None):
+        gis = current.gis
+        query = gis.spatial_query(op, shape, distance=distance)
+        table = current.s3db.gis_location
+        rows = current.db(query).select(table.id)
+        return [row.id for row in rows]
+
+    def test_intersects(self):
+        ids = self.ids("intersects", self.POLYGON)
+        assert self.inside in ids
+        assert self.overlap in ids
+        assert self.nobounds in ids
+        assert self.outside not in ids
+
+    def test_within(self):
+        ids = self.ids("within", self.POLYGON)
+        assert self.inside in ids
+        assert self.overlap not in ids
+        assert self.outside not in ids
+
+    def test_dwithin(self):
+        ids = self.ids("dwithin", "POINT(29 29)", distance=2)
+        assert self.outside in ids
+        assert self.inside not in ids
+
+    def test_features_by_latlon(self):
+        rows = current.gis.get_features_by_latlon(20, 20)
+        ids = [row.id for row in rows]
+        assert self.overlap in ids
+        assert self.inside not in ids
+
+    def test_invalid_operator(self):
+        gis = current.gis
+        self.assertRaises(SyntaxError,
+                          gis.spatial_query, "touches", self.POLYGON)
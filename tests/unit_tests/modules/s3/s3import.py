@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# S3Import Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3import.py
+#
+import datetime
+import unittest
+
+from gluon import current
+from gluon.storage import Storage
+
+# =============================================================================
+class S3ImportItemDataTests(unittest.TestCase):
+    """ Test the encoding of import item data in the item table """
+
+    def testRoundTrip(self):
+        """ Test that the data are restored with their original types """
+
+        from s3.s3import import S3ImportItem
+
+        table = s3db.pr_person
+        data = Storage(first_name="Test",
+                       date_of_birth=datetime.date(1970, 3, 14),
+                       modified_on=datetime.datetime(2012, 5, 1, 10, 30, 5,
+                                                     250),
+                       mci=2)
+
+        data_str = S3ImportItem.dump_data(data)
+        restored = S3ImportItem.load_data(data_str, table)
+        self.assertEqual(restored, data)
+        self.assertTrue(isinstance(restored.date_of_birth, datetime.date))
+        self.assertTrue(isinstance(restored.modified_on, datetime.datetime))
+        for key in restored:
+            self.assertTrue(isinstance(key, str))
+
+    def testPickled(self):
+        """ Test that pickled data from earlier versions can be restored """
+
+        import cPickle
+        from s3.s3import import S3ImportItem
+
+        data = Storage(first_name="Test")
+        restored = S3ImportItem.load_data(cPickle.dumps(data),
+                                          s3db.pr_person)
+        self.assertEqual(restored, data)
+
+# =============================================================================
+class S3ImportJobStoreTests(unittest.TestCase):
+    """ Test storing and restoring import jobs """
+
+    def setUp(self):
+
+        auth.s3_impersonate("admin@example.com")
+
+    def testStoreRestore(self):
+        """ Test that all items of a job are stored and restored """
+
+        from lxml import etree
+        from s3.s3import import S3ImportJob
+
+        xmlstr = """
+<s3xml>
+    <resource name="org_organisation">
+        <data field="name">TestImportJobStore1</data>
+    </resource>
+    <resource name="org_organisation">
+        <data field="name">TestImportJobStore2</data>
+    </resource>
+</s3xml>"""
+
+        resource = s3mgr.define_resource("org", "organisation")
+        tree = etree.ElementTree(etree.fromstring(xmlstr))
+        resource.import_xml(tree, commit_job=False)
+        job = resource.job
+        self.assertNotEqual(job, None)
+
+        item_table = S3ImportJob.define_item_table()
+        query = (item_table.job_id == job.job_id)
+        self.assertEqual(db(query).count(), 2)
+
+        # Storing again updates the items
+        job.store()
+        self.assertEqual(db(query).count(), 2)
+
+        resource.import_xml(None, job_id=job.job_id)
+        self.assertEqual(resource.error, None)
+        table = s3db.org_organisation
+        query = (table.name.like("TestImportJobStore%"))
+        self.assertEqual(db(query).count(), 2)
+
+    def tearDown(self):
+
+        current.db.rollback()
+        auth.s3_impersonate(None)
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3ImportItemDataTests,
+        S3ImportJobStoreTests,
+    )
+
+# END ========================================================================
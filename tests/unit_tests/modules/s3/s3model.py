@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# S3Model Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3model.py
+#
+import unittest
+
+from gluon import current
+from gluon.dal import Field
+
+# =============================================================================
+class S3ModelMigrationTests(unittest.TestCase):
+    """ Test the per-process re-use of table migrations """
+
+    TABLENAME = "test_migration"
+
+    def setUp(self):
+
+        self.migrated = dict(s3base.S3Model._migrated)
+
+    def testSignature(self):
+        """ Test that the signature reflects schema changes only """
+
+        signature = s3base.S3Model.table_signature
+        fields = (Field("name", length=64), Field("value", "integer"))
+
+        s1 = signature(fields, {})
+        s2 = signature((Field("name", length=64, label="Name"),
+                        Field("value", "integer")), {})
+        self.assertEqual(s1, s2)
+
+        s3 = signature((Field("name", length=128),
+                        Field("value", "integer")), {})
+        self.assertNotEqual(s1, s3)
+
+    def testMigrateOnce(self):
+        """ Test that the migration is recorded after the first definition """
+
+        db = current.db
+        tablename = self.TABLENAME
+        if tablename in db:
+            return
+
+        table = s3base.S3Model.define_table(tablename,
+                                            Field("name", length=64))
+        self.assertTrue(tablename in db)
+        if getattr(db, "_migrate_enabled", True):
+            keys = [k for k in s3base.S3Model._migrated if k[1] == tablename]
+            self.assertEqual(len(keys), 1)
+
+    def tearDown(self):
+
+        db = current.db
+        tablename = self.TABLENAME
+        if tablename in db:
+            db[tablename].drop()
+            db.commit()
+        s3base.S3Model._migrated = self.migrated
+
+# =============================================================================
+class S3ModelComponentTests(unittest.TestCase):
+    """ Test component lookups """
+
+    def testGetComponentNames(self):
+        """ Test that component names match the component definitions """
+
+        model = current.manager.model
+        s3db.org_office
+        names = model.get_component_names("org_office")
+        components = model.get_components("org_office")
+        # Names include components of disabled modules
+        self.assertTrue(all([alias in names for alias in components]))
+
+        # Components of the super-entity
+        s3db.pr_person
+        names = model.get_component_names("pr_person")
+        self.assertTrue("address" in names)
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3ModelMigrationTests,
+        S3ModelComponentTests,
+    )
+
+# END ========================================================================
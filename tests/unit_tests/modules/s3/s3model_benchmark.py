@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Model Loading Benchmark
+#
+# Measures the startup cost of the model index and the per-request cost
+# of resolving the tables and names of a typical hrm request
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3model_benchmark.py
+#
+import time
+import unittest
+
+from gluon import current
+
+# Number of lookups per measurement
+LOOKUPS = 10000
+
+# Tables and names resolved during a typical hrm/human_resource request
+HRM_NAMES = ("hrm_human_resource",
+             "hrm_skill",
+             "hrm_competency",
+             "hrm_certification",
+             "hrm_training",
+             "hrm_human_resource_id",
+             "hrm_rheader",
+             )
+
+# =============================================================================
+class S3ModelIndexBenchmark(unittest.TestCase):
+    """ Model index benchmark """
+
+    def scan(self, prefix, name):
+        """ Find the model for name by scanning the module (old method) """
+
+        module = current.models.__dict__[prefix]
+        for n in module.__all__:
+            model = module.__dict__[n]
+            if type(model).__name__ == "type" and \
+               hasattr(model, "names") and name in model.names:
+                return model
+        return None
+
+    def testStartup(self):
+        """ Time to build the index for all modules """
+
+        models = current.models
+        prefixes = [n for n in models.__dict__
+                    if type(models.__dict__[n]).__name__ == "module"]
+
+        s3base.S3Model._model_index = {}
+        start = time.time()
+        for prefix in prefixes:
+            s3base.S3Model.model_index(prefix)
+        duration = time.time() - start
+        print "index for %s modules built in %.2fms" % \
+              (len(prefixes), duration * 1000)
+
+        # Index is built only once
+        index = s3base.S3Model.model_index("hrm")
+        self.assertTrue(s3base.S3Model.model_index("hrm") is index)
+
+    def testLookup(self):
+        """ Per-request lookup: index vs. scan of the module """
+
+        model_index = s3base.S3Model.model_index
+        for name in HRM_NAMES:
+            index = model_index("hrm")
+            if name in index.names:
+                self.assertTrue(index.names[name] is self.scan("hrm", name))
+
+        start = time.time()
+        for i in xrange(LOOKUPS):
+            for name in HRM_NAMES:
+                self.scan("hrm", name)
+        scan = time.time() - start
+
+        start = time.time()
+        for i in xrange(LOOKUPS):
+            for name in HRM_NAMES:
+                model_index("hrm").names.get(name, None)
+        lookup = time.time() - start
+
+        print "%s hrm requests: scan %.2fms, index %.2fms" % \
+              (LOOKUPS, scan * 1000, lookup * 1000)
+        self.assertTrue(lookup < scan)
+
+    def testRequest(self):
+        """ Resolve the names of a typical hrm request """
+
+        start = time.time()
+        for name in HRM_NAMES:
+            self.assertNotEqual(s3db[name], None)
+        duration = time.time() - start
+        print "hrm request names resolved in %.2fms" % (duration * 1000)
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3ModelIndexBenchmark,
+    )
+
+# END ========================================================================
@@ -714,6 +714,169 @@ class S3ResourceFilterTests(unittest.TestCase):
     def tearDown(self):
         auth.s3_impersonate(None)
 
+# =============================================================================
+class S3ExportStreamTests(unittest.TestCase):
+    """ Streaming export tests """
+
+    def setUp(self):
+
+        auth.s3_impersonate("admin@example.com")
+
+        otable = s3db.org_organisation
+        org_id = otable.insert(name="TestStreamOrganisation")
+        table = s3db.org_office
+        self.office_ids = [table.insert(name="TestStreamOffice%s" % i,
+                                        organisation_id=org_id)
+                           for i in xrange(5)]
+
+    def testExportStreamXML(self):
+        """ Test that the streamed export contains the same records """
+
+        from lxml import etree
+
+        table = s3db.org_office
+        query = table.id.belongs(self.office_ids)
+
+        resource = s3mgr.define_resource("org", "office", filter=query)
+        tree = resource.export_tree()
+        expected = [e.get("uuid") for e in tree.getroot()]
+
+        resource = s3mgr.define_resource("org", "office", filter=query)
+        chunks = resource.export_stream(pagesize=2)
+        root = etree.fromstring("".join(chunks))
+        uuids = [e.get("uuid") for e in root]
+
+        self.assertEqual(root.tag, "s3xml")
+        self.assertEqual(root.get("results"), "5")
+        self.assertEqual(len(uuids), len(expected))
+        self.assertEqual(set(uuids), set(expected))
+
+    def testExportStreamJSON(self):
+        """ Test that the streamed S3JSON groups the records by table """
+
+        import gluon.contrib.simplejson as json
+
+        table = s3db.org_office
+        query = table.id.belongs(self.office_ids)
+
+        resource = s3mgr.define_resource("org", "office", filter=query)
+        chunks = resource.export_stream(pagesize=2, as_json=True)
+        output = json.loads("".join(chunks))
+
+        self.assertEqual(len(output["$_org_office"]), 5)
+        self.assertEqual(len(output["$_org_organisation"]), 1)
+
+    def tearDown(self):
+
+        db.rollback()
+        auth.s3_impersonate(None)
+
+# =============================================================================
+class S3ComponentIndexTests(unittest.TestCase):
+    """ Component lookup by master record """
+
+    def setUp(self):
+
+        auth.s3_impersonate("admin@example.com")
+
+        ptable = s3db.pr_person
+        ctable = s3db.pr_contact
+        self.person_ids = []
+        for i in xrange(3):
+            person_id = ptable.insert(first_name="TestComponentIndex%s" % i)
+            s3mgr.model.update_super(ptable, Storage(id=person_id))
+            pe_id = s3db.pr_get_pe_id(ptable, person_id)
+            for j in xrange(i):
+                ctable.insert(pe_id=pe_id,
+                              contact_method="EMAIL",
+                              value="test%s.%s@example.com" % (i, j))
+            self.person_ids.append(person_id)
+
+    def testComponentLookup(self):
+        """ Test that component records are grouped by master record """
+
+        resource = s3mgr.define_resource("pr", "person",
+                                         id=self.person_ids,
+                                         components=["contact"])
+        resource.load()
+        for i, person_id in enumerate(self.person_ids):
+            contacts = resource(person_id, component="contact")
+            self.assertEqual(len(contacts), i)
+            person = resource[person_id]
+            for contact in contacts:
+                self.assertEqual(contact.pe_id, person.pe_id)
+
+    def tearDown(self):
+
+        db.rollback()
+        auth.s3_impersonate(None)
+
+# =============================================================================
+class S3BulkImportTests(unittest.TestCase):
+    """ Bulk mode import tests """
+
+    def setUp(self):
+
+        auth.s3_impersonate("admin@example.com")
+        table = s3db.org_organisation
+        self.org_id = table.insert(name="TestBulkImportExisting")
+        self.uid = table[self.org_id].uuid
+
+    def testBulkImport(self):
+        """ Test that bulk imports find duplicates in the DB and the source """
+
+        from lxml import etree
+
+        xmlstr = """
+<s3xml>
+    <resource name="org_organisation" uuid="%(uid)s">
+        <data field="acronym">TBI1</data>
+    </resource>
+    <resource name="org_organisation">
+        <data field="name">TestBulkImportNew</data>
+        <data field="acronym">TBI2</data>
+    </resource>
+    <resource name="org_organisation">
+        <data field="name">TestBulkImportNew</data>
+        <data field="acronym">TBI3</data>
+    </resource>
+</s3xml>""" % dict(uid=self.uid)
+
+        table = s3db.org_organisation
+        resource = s3mgr.define_resource("org", "organisation")
+        tree = etree.ElementTree(etree.fromstring(xmlstr))
+        resource.import_xml(tree, bulk=True)
+        self.assertEqual(resource.error, None)
+
+        row = table[self.org_id]
+        self.assertEqual(row.acronym, "TBI1")
+        query = (table.name == "TestBulkImportNew")
+        rows = db(query).select(table.acronym)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows.first().acronym, "TBI3")
+
+    def testBatches(self):
+        """ Test that items are only committed after their references """
+
+        from s3.s3import import S3ImportJob
+
+        items = []
+        for i in xrange(3):
+            item = Storage(item_id=i, references=[])
+            if i:
+                entry = Storage(item_id=i - 1)
+                item.references.append(Storage(field="parent_id",
+                                               entry=entry))
+            items.append(item)
+        batches = S3ImportJob.batches(items)
+        self.assertEqual([[item.item_id for item in batch]
+                          for batch in batches], [[0], [1], [2]])
+
+    def tearDown(self):
+
+        db.rollback()
+        auth.s3_impersonate(None)
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
@@ -732,6 +895,9 @@ if __name__ == "__main__":
     run_suite(
         S3ResourceTests,
         S3ResourceFilterTests,
+        S3ExportStreamTests,
+        S3ComponentIndexTests,
+        S3BulkImportTests,
     )
 
 # END ========================================================================
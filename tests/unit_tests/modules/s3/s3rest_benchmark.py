@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# Export Benchmark
+#
+# Verifies that S3Resource.export_tree scales linearly with the number of
+# exported records (including dereferencing up to MAX_DEPTH)
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3rest_benchmark.py
+#
+import time
+import unittest
+
+# Maximum acceptable ratio between the per-record export times of the
+# largest and the smallest sample
+MAX_RATIO = 2.0
+
+# =============================================================================
+class S3ExportScalingTests(unittest.TestCase):
+    """ Export scaling benchmark """
+
+    SIZES = (5000, 10000, 25000, 50000)
+
+    def setUp(self):
+
+        auth.s3_impersonate("admin@example.com")
+
+        # Location hierarchy: L3 records (exported) => L2 => L1 => L0,
+        # so that exports need to dereference several levels
+        table = s3db.gis_location
+        insert = table.insert
+
+        count = max(self.SIZES)
+        l0 = insert(name="BenchmarkL0", level="L0")
+        l1 = [insert(name="BenchmarkL1-%s" % i, level="L1", parent=l0)
+              for i in xrange(10)]
+        l2 = [insert(name="BenchmarkL2-%s" % i, level="L2", parent=l1[i % 10])
+              for i in xrange(count / 10)]
+        self.ids = [insert(name="BenchmarkL3-%s" % i, level="L3",
+                           parent=l2[i % len(l2)])
+                    for i in xrange(count)]
+
+    def testExportScaling(self):
+        """ Test that export time per record does not grow with size """
+
+        table = s3db.gis_location
+
+        timings = []
+        for size in self.SIZES:
+            query = table.id.belongs(self.ids[:size])
+            resource = s3mgr.define_resource("gis", "location", filter=query)
+            start = time.time()
+            tree = resource.export_tree(dereference=True)
+            duration = time.time() - start
+            # All L3 + all referenced L2/L1/L0 records
+            self.assertTrue(len(tree.getroot()) > size)
+            timings.append(duration / size)
+            print "%6s records: %.2fs (%.3fms/record)" % \
+                  (size, duration, duration * 1000.0 / size)
+
+        ratio = timings[-1] / timings[0]
+        self.assertTrue(ratio < MAX_RATIO,
+                        "export time per record grows with size (ratio %.2f)" % ratio)
+
+    def tearDown(self):
+
+        db.rollback()
+        auth.s3_impersonate(None)
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3ExportScalingTests,
+    )
+
+# END ========================================================================
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# S3Sync Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3sync.py
+#
+# S3SyncPeerTests synchronize with a second Eden instance, e.g. started with:
+# python web2py.py -a <password> -i 127.0.0.1 -p 8001
+# and are only run if the peer is configured in the environment:
+# SYNC_PEER_URL=http://127.0.0.1:8001/eden
+# SYNC_PEER_USERNAME=admin@example.com
+# SYNC_PEER_PASSWORD=testing
+#
+# NB S3SyncPeerTests commit the pulled records
+#
+import datetime
+import os
+import unittest
+
+from gluon import current
+
+# =============================================================================
+class S3SyncPagingTests(unittest.TestCase):
+    """ Test the paged transfer of resources """
+
+    NAME = "TestSyncPage"
+
+    def setUp(self):
+
+        auth.override = True
+        table = s3db.org_organisation
+        self.ids = [table.insert(name="%s%s" % (self.NAME, i))
+                    for i in xrange(7)]
+        # Records with the same modification date are ordered by UID
+        now = datetime.datetime.utcnow()
+        db(table.id.belongs(self.ids[:4])).update(modified_on=now)
+
+    def testPages(self):
+        """ Test that the pages contain every record exactly once """
+
+        S3Sync = s3base.S3Sync
+        table = s3db.org_organisation
+
+        cursor = None
+        ids = []
+        pages = 0
+        while True:
+            resource = s3mgr.define_resource("org", "organisation")
+            resource.add_filter(table.name.like("%s%%" % self.NAME))
+            cursor = S3Sync.page(resource, cursor, pagesize=3)
+            resource.load()
+            page = [row.id for row in resource]
+            self.assertTrue(len(page) <= 3)
+            ids.extend(page)
+            pages += 1
+            if not cursor:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(sorted(ids), sorted(self.ids))
+
+    def testChanged(self):
+        """ Test that pages only contain records changed since msince """
+
+        S3Sync = s3base.S3Sync
+        table = s3db.org_organisation
+
+        msince = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        old = msince - datetime.timedelta(days=1)
+        db(table.id.belongs(self.ids[2:])).update(modified_on=old)
+
+        resource = s3mgr.define_resource("org", "organisation")
+        resource.add_filter(table.name.like("%s%%" % self.NAME))
+        S3Sync.changed(resource, msince)
+        cursor = S3Sync.page(resource, None, pagesize=3)
+        self.assertEqual(cursor, None)
+        resource.load()
+        self.assertEqual(sorted([row.id for row in resource]),
+                         sorted(self.ids[:2]))
+
+    def testCursor(self):
+        """ Test the encoding of page cursors """
+
+        S3Sync = s3base.S3Sync
+
+        mtime = datetime.datetime(2012, 6, 30, 12, 15, 30, 500)
+        uid = "urn:uuid:1f8c3b9a-5f3c-4c8e-9a3b-1c2d3e4f5a6b"
+        cursor = S3Sync.encode_cursor(mtime, uid)
+        self.assertEqual(S3Sync.decode_cursor(cursor), (mtime, uid))
+        self.assertEqual(S3Sync.decode_cursor("invalid"), None)
+        self.assertEqual(S3Sync.decode_cursor(None), None)
+
+    def testCompression(self):
+        """ Test the compression of transferred data """
+
+        S3Sync = s3base.S3Sync
+
+        data = ["<s3xml>", "<resource name=\"org_organisation\"/>" * 100,
+                "</s3xml>"]
+        compressed = S3Sync.compress(data)
+        self.assertTrue(len(compressed.read()) < len("".join(data)))
+        compressed.seek(0)
+        self.assertEqual(S3Sync.decompress(compressed).read(), "".join(data))
+
+    def tearDown(self):
+
+        db.rollback()
+        auth.override = False
+
+# =============================================================================
+class S3SyncPeerTests(unittest.TestCase):
+    """ Synchronization with a second instance """
+
+    def setUp(self):
+
+        url = os.environ.get("SYNC_PEER_URL", None)
+        if not url:
+            self.skipTest("SYNC_PEER_URL not set")
+
+        auth.override = True
+        s3mgr.load("sync_repository")
+        rtable = db.sync_repository
+        self.repository_id = rtable.insert(
+                                name="Test Peer",
+                                url=url,
+                                username=os.environ.get("SYNC_PEER_USERNAME"),
+                                password=os.environ.get("SYNC_PEER_PASSWORD"))
+        ttable = db.sync_task
+        self.task_id = ttable.insert(repository_id=self.repository_id,
+                                     resource_name="org_organisation",
+                                     mode=1)
+
+    def testPull(self):
+        """ Test a paged pull from the peer """
+
+        S3Sync = s3base.S3Sync
+
+        pagesize = S3Sync.PAGESIZE
+        S3Sync.PAGESIZE = 2
+        try:
+            repository = db.sync_repository[self.repository_id]
+            S3Sync().synchronize(repository)
+        finally:
+            S3Sync.PAGESIZE = pagesize
+
+        ltable = db.sync_log
+        query = (ltable.repository_id == self.repository_id)
+        log = db(query).select(orderby=~ltable.id, limitby=(0, 1)).first()
+        S3SyncLog = s3base.S3SyncLog
+        self.assertTrue(log.result in (S3SyncLog.SUCCESS, S3SyncLog.WARNING))
+
+        task = db.sync_task[self.task_id]
+        self.assertEqual(task.pull_cursor, None)
+        self.assertNotEqual(task.last_sync, None)
+
+    def tearDown(self):
+
+        db(db.sync_log.repository_id == self.repository_id).delete()
+        db(db.sync_task.id == self.task_id).delete()
+        db(db.sync_repository.id == self.repository_id).delete()
+        db.commit()
+        auth.override = False
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3SyncPagingTests,
+        S3SyncPeerTests,
+    )
+
+# END ========================================================================
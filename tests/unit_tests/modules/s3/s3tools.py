@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# S3Tools Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3tools.py
+#
+import os
+import unittest
+
+from gluon import current
+from gluon.storage import Storage
+
+# =============================================================================
+class S3BulkImporterScheduleTests(unittest.TestCase):
+    """ Task graph for parallel prepopulate """
+
+    def testStylesheetTables(self):
+        """ Test that the resources of a stylesheet are found """
+
+        path = os.path.join(current.request.folder,
+                            "static", "formats", "s3csv",
+                            "hrm", "person.xsl")
+        tables = s3base.S3BulkImporter.stylesheet_tables(path)
+        self.assertTrue("pr_person" in tables)
+        self.assertTrue("hrm_human_resource" in tables)
+        self.assertTrue("gis_location" in tables)
+
+    def testConflict(self):
+        """ Test which tasks must run one after another """
+
+        conflict = s3base.S3BulkImporter.conflict
+
+        org = Storage(writes=set(["org_organisation"]),
+                      supers=set(["pr_pentity"]),
+                      reads=set(["gis_location"]))
+        office = Storage(writes=set(["org_office"]),
+                         supers=set(["pr_pentity", "org_site"]),
+                         reads=set(["org_organisation", "gis_location"]))
+        item = Storage(writes=set(["supply_item"]),
+                       supers=set(),
+                       reads=set(["supply_catalog"]))
+        stock = Storage(writes=set(["inv_inv_item"]),
+                        supers=set(),
+                        reads=set(["org_site", "supply_item"]))
+
+        self.assertTrue(conflict(org, office))
+        self.assertFalse(conflict(org, item))
+        self.assertTrue(conflict(office, stock))
+        self.assertTrue(conflict(item, stock))
+        self.assertTrue(conflict(None, item))
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3BulkImporterScheduleTests,
+    )
+
+# END ========================================================================
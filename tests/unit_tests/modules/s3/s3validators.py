@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Validators Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3validators.py
+#
+import unittest
+
+from gluon import current
+from s3.s3validators import IS_ONE_OF
+
+# =============================================================================
+class IS_ONE_OF_Tests(unittest.TestCase):
+    """ Test the option set cache and the lazy mode of IS_ONE_OF """
+
+    def setUp(self):
+
+        current.auth.override = True
+        s3db.org_organisation
+        IS_ONE_OF.clear_cache()
+
+    def testCache(self):
+        """ Test that option sets are cached until the key table changes """
+
+        db = current.db
+        table = s3db.org_organisation
+
+        # Not cached with auth override
+        validator = IS_ONE_OF(db, "org_organisation.id", "%(name)s")
+        validator.options()
+        self.assertEqual(len(IS_ONE_OF._options_cache), 0)
+
+        current.auth.override = False
+        auth.s3_impersonate("admin@example.com")
+        validator = IS_ONE_OF(db, "org_organisation.id", "%(name)s")
+        options = validator.options()
+        self.assertEqual(len(IS_ONE_OF._options_cache), 1)
+
+        # Same option set from the cache
+        validator = IS_ONE_OF(db, "org_organisation.id", "%(name)s")
+        self.assertEqual(validator.options(), options)
+        self.assertEqual(len(IS_ONE_OF._options_cache), 1)
+
+        # New record invalidates the option set, even within
+        # the same request
+        record_id = table.insert(name="IS_ONE_OF Cache Test")
+        validator = IS_ONE_OF(db, "org_organisation.id", "%(name)s")
+        self.assertTrue(str(record_id) in [k for k, v in validator.options()])
+
+    def testLabelFunction(self):
+        """ Test caching of option sets with label functions """
+
+        db = current.db
+        table = s3db.org_organisation
+
+        current.auth.override = False
+        auth.s3_impersonate("admin@example.com")
+        represent = s3db.org_organisation_represent
+
+        # Not cached without cache_tables
+        validator = IS_ONE_OF(db, "org_organisation.id", represent)
+        validator.options()
+        self.assertEqual(len(IS_ONE_OF._options_cache), 0)
+
+        # Cached with cache_tables
+        cache_tables = ["org_organisation_branch"]
+        validator = IS_ONE_OF(db, "org_organisation.id", represent,
+                              cache_tables=cache_tables)
+        options = validator.options()
+        self.assertEqual(len(IS_ONE_OF._options_cache), 1)
+        validator = IS_ONE_OF(db, "org_organisation.id", represent,
+                              cache_tables=cache_tables)
+        self.assertEqual(validator.options(), options)
+        self.assertEqual(len(IS_ONE_OF._options_cache), 1)
+
+        # Changes in the cache tables invalidate the option set
+        current.auth.override = True
+        parent = table.insert(name="IS_ONE_OF Parent Test")
+        branch = table.insert(name="IS_ONE_OF Branch Test")
+        current.auth.override = False
+        options = validator.options()
+        self.assertEqual(len(IS_ONE_OF._options_cache), 2)
+        s3db.org_organisation_branch.insert(organisation_id=parent,
+                                            branch_id=branch)
+        validator = IS_ONE_OF(db, "org_organisation.id", represent,
+                              cache_tables=cache_tables)
+        validator.options()
+        self.assertEqual(len(IS_ONE_OF._options_cache), 3)
+
+    def testLazy(self):
+        """ Test validation by existence check """
+
+        db = current.db
+        table = s3db.org_organisation
+        record_id = table.insert(name="IS_ONE_OF Lazy Test")
+
+        validator = IS_ONE_OF(db, "org_organisation.id", lazy=True)
+        value, error = validator(str(record_id))
+        self.assertEqual(error, None)
+        self.assertEqual(validator.theset, None)
+
+        db(table.id == record_id).update(deleted=True)
+        value, error = validator(str(record_id))
+        self.assertNotEqual(error, None)
+
+        validator = IS_ONE_OF(db, "org_organisation.id",
+                              multiple=True, lazy=True)
+        value, error = validator([str(record_id)])
+        self.assertNotEqual(error, None)
+
+    def tearDown(self):
+
+        current.db.rollback()
+        auth.s3_impersonate(None)
+        current.auth.override = False
+        IS_ONE_OF.clear_cache()
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        IS_ONE_OF_Tests,
+    )
+
+# END ========================================================================
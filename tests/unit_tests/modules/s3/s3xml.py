@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+#
+# S3XML Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3xml.py
+#
+import os
+import unittest
+
+from gluon import current
+
+# =============================================================================
+class S3XMLReferenceLookupTests(unittest.TestCase):
+    """ Test bulk reference resolution for rmap """
+
+    def setUp(self):
+
+        auth.s3_impersonate("admin@example.com")
+
+        otable = s3db.org_organisation
+        self.org1 = otable.insert(name="TestLookupOrganisation1")
+        self.org2 = otable.insert(name="TestLookupOrganisation2")
+        deleted = otable.insert(name="TestLookupOrganisation3")
+        db(otable.id == deleted).update(deleted=True)
+        self.deleted = deleted
+
+        table = s3db.org_office
+        self.office_ids = [table.insert(name="TestLookupOffice1",
+                                        organisation_id=self.org1),
+                           table.insert(name="TestLookupOffice2",
+                                        organisation_id=self.org2),
+                           table.insert(name="TestLookupOffice3",
+                                        organisation_id=self.org1),
+                           table.insert(name="TestLookupOffice4",
+                                        organisation_id=deleted)]
+
+    def testLookup(self):
+        """ Test that lookup resolves all keys in one map per field """
+
+        xml = current.manager.xml
+        table = s3db.org_office
+        rows = db(table.id.belongs(self.office_ids)).select()
+
+        lookup = xml.lookup(table, rows, ["organisation_id"])
+        self.assertTrue("organisation_id" in lookup)
+        kmap = lookup["organisation_id"]
+        self.assertTrue(self.org1 in kmap)
+        self.assertTrue(self.org2 in kmap)
+        # Deleted records must not be resolved
+        self.assertFalse(self.deleted in kmap)
+
+    def testRMapWithLookup(self):
+        """ Test that rmap produces the same map with and without lookup """
+
+        xml = current.manager.xml
+        table = s3db.org_office
+        rows = db(table.id.belongs(self.office_ids)).select()
+        fields = ["organisation_id"]
+
+        lookup = xml.lookup(table, rows, fields)
+        for row in rows:
+            expected = xml.rmap(table, row, fields)
+            rmap = xml.rmap(table, row, fields, lookup=lookup)
+            self.assertEqual(len(rmap), len(expected))
+            for i in xrange(len(rmap)):
+                self.assertEqual(rmap[i].table, expected[i].table)
+                self.assertEqual(rmap[i].id, expected[i].id)
+                self.assertEqual(rmap[i].uid, expected[i].uid)
+                self.assertEqual(rmap[i].value, expected[i].value)
+
+    def tearDown(self):
+
+        db.rollback()
+        auth.s3_impersonate(None)
+
+# =============================================================================
+class S3XMLStylesheetCacheTests(unittest.TestCase):
+    """ Test the compiled XSLT stylesheet cache """
+
+    STYLESHEET = """<?xml version="1.0"?>
+<xsl:stylesheet xmlns:xsl="http://www.w3.org/1999/XSL/Transform" version="1.0">
+    <xsl:template match="/"><result><xsl:value-of select="%s"/></result></xsl:template>
+</xsl:stylesheet>"""
+
+    def setUp(self):
+
+        import tempfile
+        fd, self.path = tempfile.mkstemp(suffix=".xsl")
+        os.write(fd, self.STYLESHEET % "'A'")
+        os.close(fd)
+
+    def testCacheHit(self):
+        """ Test that the compiled stylesheet is reused """
+
+        xml = current.manager.xml
+        transformer = xml.xslt(self.path)
+        self.assertNotEqual(transformer, None)
+        self.assertTrue(xml.xslt(self.path) is transformer)
+
+    def testCachePerThread(self):
+        """ Test that each thread compiles its own stylesheet """
+
+        import threading
+
+        xml = current.manager.xml
+        transformer = xml.xslt(self.path)
+
+        result = []
+        thread = threading.Thread(target=lambda: \
+                                  result.append(xml.xslt(self.path)))
+        thread.start()
+        thread.join()
+        self.assertNotEqual(result[0], None)
+        self.assertFalse(result[0] is transformer)
+        self.assertTrue(xml.xslt(self.path) is transformer)
+
+    def testCacheInvalidation(self):
+        """ Test that the stylesheet is re-compiled when it changes """
+
+        from lxml import etree
+
+        xml = current.manager.xml
+        tree = etree.ElementTree(etree.Element("s3xml"))
+
+        result = xml.transform(tree, self.path)
+        self.assertEqual(result.getroot().text, "A")
+
+        f = open(self.path, "w")
+        f.write(self.STYLESHEET % "'B'")
+        f.close()
+        mtime = os.path.getmtime(self.path) + 10
+        os.utime(self.path, (mtime, mtime))
+
+        result = xml.transform(tree, self.path)
+        self.assertEqual(result.getroot().text, "B")
+
+    def tearDown(self):
+
+        os.remove(self.path)
+
+# =============================================================================
+class S3XMLCSVChunkTests(unittest.TestCase):
+    """ Test the conversion of CSV sources in chunks """
+
+    def source(self, rows):
+
+        from StringIO import StringIO
+        lines = ["Name,Acronym"]
+        lines.extend(["Organisation %s,ORG%s" % (i, i) for i in xrange(rows)])
+        return StringIO("\n".join(lines))
+
+    def testChunks(self):
+        """ Test that the rows are split into trees of chunk_size rows """
+
+        xml = current.manager.xml
+        trees = list(xml.csv2trees(self.source(25),
+                                   resourcename="organisation",
+                                   chunk_size=10))
+        self.assertEqual([len(t.getroot()) for t in trees], [10, 10, 5])
+        for t in trees:
+            self.assertEqual(t.getroot().get("name"), "organisation")
+
+        trees = list(xml.csv2trees(self.source(20), chunk_size=10))
+        self.assertEqual([len(t.getroot()) for t in trees], [10, 10])
+
+    def testSingleTree(self):
+        """ Test that csv2tree returns all rows in one tree """
+
+        xml = current.manager.xml
+        tree = xml.csv2tree(self.source(25))
+        self.assertEqual(len(tree.getroot()), 25)
+
+        tree = xml.csv2tree(self.source(0))
+        self.assertEqual(len(tree.getroot()), 0)
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3XMLReferenceLookupTests,
+        S3XMLStylesheetCacheTests,
+        S3XMLCSVChunkTests,
+    )
+
+# END ========================================================================